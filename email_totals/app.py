@@ -1,12 +1,21 @@
+import contextlib
+import importlib
 import logging
 import os
+import threading
 from datetime import datetime
 
-from email_totals import ce, org, synapse, ses
+from email_totals import cassette, ce, checkpoint, deadline, memory, metrics, model, org, render, shard, synapse, ses, workers
 
 LOG = logging.getLogger(__name__)
 LOG.setLevel(logging.DEBUG)
 
+# Nesting depth of lambda_handler() calls, only the outermost call starts and
+# finishes the run, see run_context()
+_depth = 0
+
+_lock = threading.Lock()
+
 
 def report_periods(today):
     """
@@ -51,6 +60,23 @@ def report_periods(today):
     return target_period, compare_period
 
 
+def load_vectorized():
+    """
+    Get the optional vectorized module if enabled by the VECTORIZE
+    environment variable and NumPy is available, otherwise return None to
+    use the pure-python path
+    """
+
+    if os.environ.get('VECTORIZE', 'False') != 'True':
+        return None
+
+    try:
+        return importlib.import_module('email_totals.vectorized')
+    except ImportError as e:
+        LOG.warning(f"Vectorized totals unavailable, falling back to python: {e}")
+        return None
+
+
 def get_resource_totals(target_period, compare_period, minimum_total):
     """
     Get email cost information from cost explorer for both time periods
@@ -64,6 +90,9 @@ def get_resource_totals(target_period, compare_period, minimum_total):
     As a special case, a top-level key equal to the empty string will contain
     data for resources with no owner.
 
+    Each 'resources' value is a compact model.UsageTable rather than a
+    dictionary per account, but it can be read the same way.
+
     Example:
     ```
     email1@example.com:
@@ -78,70 +107,87 @@ def get_resource_totals(target_period, compare_period, minimum_total):
     ```
     """
 
-    def _build_dict(results_by_time, compare=None):
+    def _build_dict(period_groups):
         """
         Build our simple data structure from the cost explorer results,
-        optionally adding a percent change against compare data (if present).
+        adding a percent change against the compare period (if present).
+
+        Both periods are tallied in a single pass over the results, and then
+        the percent change is calculated for each target total.
         """
+        target = {}
+        compare = {}
+        for start, group in period_groups:
+            amount = float(group['Metrics'][ce.cost_metric]['Amount'])
+
+            # Keys preserve the order defined in the GroupBy parameter from
+            # the call to get_cost_and_usage().
+            if len(group['Keys']) != 2:
+                LOG.error(f"Unexpected grouping: {group['Keys']}")
+                continue
+
+            # The category key has the format "<category name>$<category value>"
+            # so everything after the first '$' will be the email address
+            # A special case of "<category name>$" is used for uncategorized costs
+            # giving us an empty-string email for costs with no owner
+            # Downcase all emails to detect case-insensitive duplicates.
+            email = model.intern_id(group['Keys'][0].split('$', maxsplit=1)[1].lower())
+
+            account_id = model.intern_id(group['Keys'][1])
+
+            if email == '':
+                LOG.debug(f"Unowned costs in account {account_id} "
+                          f"for {start}: {amount}")
+
+            # Skip insignificant totals
+            if amount < minimum_total:
+                LOG.info(f"Skipping total less than ${minimum_total} for "
+                         f"{email}: {account_id} ${amount} ({start})")
+                continue
+
+            # Tally the amount in the totals for its period
+            if start == target_period['Start']:
+                totals = target
+            else:
+                totals = compare
+
+            # If this account is already listed, the email is a duplicate
+            # this can happen if it is tagged with different casing.
+            key = (email, account_id)
+            if key in totals:
+                LOG.debug(f"duplicate entry found")
+                totals[key] += amount
+            else:
+                totals[key] = amount
+
         resources = {}
-        for result in results_by_time:
-            for group in result['Groups']:
-                amount = float(group['Metrics'][ce.cost_metric]['Amount'])
-
-                # Keys preserve the order defined in the GroupBy parameter from
-                # the call to get_cost_and_usage().
-                if len(group['Keys']) != 2:
-                    LOG.error(f"Unexpected grouping: {group['Keys']}")
-                    continue
-
-                # The category key has the format "<category name>$<category value>"
-                # so everything after the first '$' will be the email address
-                # A special case of "<category name>$" is used for uncategorized costs
-                # giving us an empty-string email for costs with no owner
-                # Downcase all emails to detect case-insensitive duplicates.
-                email = group['Keys'][0].split('$', maxsplit=1)[1].lower()
-
-                account_id = group['Keys'][1]
-
-                if email == '':
-                    LOG.debug(f"Unowned costs in account {account_id}: {amount}")
-
-                # Skip insignificant totals
-                if amount < minimum_total:
-                    LOG.info(f"Skipping total less than ${minimum_total} for "
-                             f"{email}: {account_id} ${amount}")
-                    continue
-
-                # Add 'resources' subkey if this is the first account we're
-                # processing for this email
-                if email not in resources:
-                    resources[email] = {'resources': {}}
-
-                # If this account is already listed, the email is a duplicate
-                # this can happen if it is tagged with different casing.
-                if account_id in resources[email]['resources']:
-                    LOG.debug(f"duplicate entry found")
-                    resources[email]['resources'][account_id]['total'] += amount
-                else:
-                    resources[email]['resources'][account_id] = {'total': amount}
-
-                # If we have a compare dict, calculate a percent change
-                if compare and email in compare:
-                    _compare = compare[email]['resources']
-                    if account_id in _compare:
-                        # Calculate percent change from compare month
-                        pct = (amount / _compare[account_id]['total']) - 1
-                        resources[email]['resources'][account_id]['change'] = pct
+        for (email, account_id), amount in target.items():
+            # Add 'resources' subkey if this is the first account we're
+            # processing for this email
+            if email not in resources:
+                resources[email] = {'resources': model.UsageTable()}
+
+            # If we have a non-zero compare total, calculate a percent change
+            pct = None
+            if compare.get((email, account_id)):
+                pct = (amount / compare[(email, account_id)]) - 1
+
+            resources[email]['resources'].add(account_id, amount, pct)
 
         return resources
 
-    # First generate data to compare against
-    compare_data = ce.get_ce_email_costs(compare_period)
-    compare_dict = _build_dict(compare_data['ResultsByTime'])
+    # Query both periods at once and build our dictionary in a single pass,
+    # consuming groups as each page of results arrives
+    ce_pages = ce.get_ce_email_costs(target_period, compare_period)
+    period_groups = ce.iter_period_groups(ce_pages)
 
-    # Then generate data our target data, passing in compare data
-    target_data = ce.get_ce_email_costs(target_period)
-    target_dict = _build_dict(target_data['ResultsByTime'], compare_dict)
+    vectorized = load_vectorized()
+    if vectorized is not None:
+        return vectorized.build_resource_totals(period_groups,
+                                                target_period['Start'],
+                                                minimum_total)
+
+    target_dict = _build_dict(period_groups)
 
     return target_dict
 
@@ -158,7 +204,8 @@ def get_account_totals(target_period, compare_period, minimum_total):
     and the third-level subkeys will be the literal string 'total', and
     optionally 'change'; 'total' will map to a float representing the account
     total, and if 'change' is present it will map to a float representing
-    percent change from the last month (1.0 is 100% growth).
+    percent change from the last month (1.0 is 100% growth). Each 'accounts'
+    value is a compact model.UsageTable that can be read the same way.
 
     The second is a simple dictionary mapping account IDs to their names.
 
@@ -181,10 +228,11 @@ def get_account_totals(target_period, compare_period, minimum_total):
     ```
     """
 
-    def _build_result_dict(results_by_time):
+    def _build_result_dict(period_groups):
         """
-        Transform the account results from cost explorer into a dictionary
-        mapping account IDs to account totals for easy lookup.
+        Transform the account results from cost explorer into a tuple of two
+        dictionaries, for the target and compare periods respectively, mapping
+        account IDs to account totals for easy lookup.
 
         Example:
         ```
@@ -192,25 +240,30 @@ def get_account_totals(target_period, compare_period, minimum_total):
         222233334444: 10
         ```
         """
-        account_totals = {}
-        for result in results_by_time:
-            for group in result['Groups']:
-                amount = float(group['Metrics'][ce.cost_metric]['Amount'])
-
-                # Keys preserve the order defined in the GroupBy parameter from
-                # the call to get_cost_and_usage().
-                if len(group['Keys']) != 1:
-                    LOG.error(f"Unexpected grouping: {group['Keys']}")
-                    continue
-
-                # Add this account total to our output
-                account_id = group['Keys'][0]
-                if account_id not in account_totals:
-                    account_totals[account_id] = amount
-                else:
-                    LOG.error(f"Duplicate account total found: {account_id}")
-
-        return account_totals
+        target_totals = {}
+        compare_totals = {}
+        for start, group in period_groups:
+            amount = float(group['Metrics'][ce.cost_metric]['Amount'])
+
+            # Keys preserve the order defined in the GroupBy parameter from
+            # the call to get_cost_and_usage().
+            if len(group['Keys']) != 1:
+                LOG.error(f"Unexpected grouping: {group['Keys']}")
+                continue
+
+            if start == target_period['Start']:
+                account_totals = target_totals
+            else:
+                account_totals = compare_totals
+
+            # Add this account total to our output
+            account_id = model.intern_id(group['Keys'][0])
+            if account_id not in account_totals:
+                account_totals[account_id] = amount
+            else:
+                LOG.error(f"Duplicate account total found: {account_id} ({start})")
+
+        return target_totals, compare_totals
 
     def _build_attr_dict(attributes):
         """
@@ -252,18 +305,33 @@ def get_account_totals(target_period, compare_period, minimum_total):
 
     output = {}
 
-    compare_ce_data = ce.get_ce_account_costs(compare_period)
-    compare_dict = _build_result_dict(compare_ce_data['ResultsByTime'])
-
-    target_ce_data = ce.get_ce_account_costs(target_period)
-    target_dict = _build_result_dict(target_ce_data['ResultsByTime'])
-
-    account_names = _build_attr_dict(target_ce_data['DimensionValueAttributes'])
-    account_owners = org.get_account_owners()
+    # Query both periods at once and split the totals by period,
+    # consuming groups as each page of results arrives
+    ce_pages = ce.get_ce_account_costs(target_period, compare_period)
+    attributes = []
+    target_dict, compare_dict = _build_result_dict(
+        ce.iter_period_groups(ce_pages, attributes))
+
+    with metrics.phase('account_owners'):
+        account_owners = org.get_account_owners()
+
+    # Start from cached account names, so that accounts missing from the cost
+    # explorer attributes still have a name, and then cache any new names
+    ce_account_names = _build_attr_dict(attributes)
+    org.update_account_names(ce_account_names)
+    account_names = org.get_account_names()
+    account_names.update(ce_account_names)
+
+    # Calculate percent changes for all accounts at once if vectorized
+    vectorized = load_vectorized()
+    if vectorized is not None:
+        account_changes = vectorized.build_account_changes(target_dict,
+                                                           compare_dict,
+                                                           minimum_total)
 
     # Build an accounts subkey for each account owner
     for owner in account_owners:
-        account_dict = {'accounts': {}}
+        account_dict = {'accounts': model.UsageTable()}
 
         for account in account_owners[owner]:
             if account not in target_dict:
@@ -279,25 +347,27 @@ def get_account_totals(target_period, compare_period, minimum_total):
                          f"{account} ${target_total}")
                 continue
 
-            account_dict['accounts'][account] = {'total': target_total}
+            # If we have a non-zero compare total, calculate percent change
+            if vectorized is not None:
+                pct_change = account_changes[account]
+            else:
+                pct_change = None
+                if compare_dict.get(account):
+                    pct_change = (target_total / compare_dict[account]) - 1
 
-            # If we have a compare dict, calculate percent change
-            if account in compare_dict:
-                compare_total = compare_dict[account]
-                pct_change = (target_total / compare_total) - 1
-                account_dict['accounts'][account]['change'] = pct_change
+            account_dict['accounts'].add(account, target_total, pct_change)
 
         # Only add the subkey for the owner if its not empty
         if account_dict['accounts']:
-            output[owner] = account_dict
+            output[model.intern_id(owner)] = account_dict
 
     return output, account_names
 
 
-def _parse_ce_tag_results(result_data):
+def _parse_ce_tag_results(result_pages, account_pages=None, ambiguous=None):
     """
-    Parse data returned by cost explorer and generate a dictionary mapping
-    an account ID to a list of resource IDs.
+    Parse pages of results returned by cost explorer and generate a dictionary
+    mapping an account ID to a list of resource IDs.
 
     Example:
     ```
@@ -305,31 +375,79 @@ def _parse_ce_tag_results(result_data):
       - i-0abcdefg
       - i-1hijkmln
     ```
+
+    If account pages are also given, then the result pages are expected to be
+    grouped by owner email instead of account, and the account pages (grouped
+    by account) are used to look up the account for each resource. Generate a
+    dictionary mapping each owner email to the above structure instead.
+
+    Example:
+    ```
+    email1@example.com:
+      111122223333:
+        - i-0abcdefg
+    email2@example.com:
+      111122223333:
+        - i-1hijkmln
+    ```
+
+    Resource IDs are not always unique across accounts, e.g. S3 bucket names
+    reused after deletion. A resource found in more than one account can't be
+    attributed to an account this way, so it is left out with a warning, and
+    if an `ambiguous` set is given the owner's email is added to it.
     """
 
     output = {}
 
-    for result in result_data['ResultsByTime']:
-        for group in result['Groups']:
-            # Keys preserve the order defined in the GroupBy parameter from
-            # the call to get_cost_and_usage().
-            if len(group['Keys']) != 2:
-                LOG.error(f"Unexpected grouping: {group['Keys']}")
-                continue
-
+    # Map each resource ID to its account for the multi-owner grouping
+    resource_accounts = {}
+    conflicts = set()
+    if account_pages is not None:
+        for account_id, resources in _parse_ce_tag_results(account_pages).items():
+            for resource in resources:
+                if resource_accounts.setdefault(resource, account_id) != account_id:
+                    conflicts.add(resource)
+
+    for _, group in ce.iter_period_groups(result_pages):
+        # Keys preserve the order defined in the GroupBy parameter from
+        # the call to get_cost_and_usage().
+        if len(group['Keys']) != 2:
+            LOG.error(f"Unexpected grouping: {group['Keys']}")
+            continue
+
+        resource = group['Keys'][1]
+
+        # Ignore entries with no resource ID
+        if resource == 'NoResourceId':
+            continue
+
+        if account_pages is None:
             account_id = group['Keys'][0]
-            resource = group['Keys'][1]
+            resources = output
+        else:
+            # The category key has the format "<category name>$<category value>"
+            # downcase the email to match the keys in our summary
+            email = group['Keys'][0].split('$', maxsplit=1)[1].lower()
+
+            if resource not in resource_accounts:
+                LOG.error(f"No account found for resource: {resource}")
+                continue
 
-            # Ignore entries with no resource ID
-            if resource == 'NoResourceId':
+            if resource in conflicts:
+                LOG.warning(f"Resource {resource} owned by {email} is in more than one account")
+                if ambiguous is not None:
+                    ambiguous.add(email)
                 continue
 
-            # Create initial list if needed
-            if account_id not in output:
-                output[account_id] = []
+            account_id = resource_accounts[resource]
+            resources = output.setdefault(email, {})
+
+        # Create initial list if needed
+        if account_id not in resources:
+            resources[account_id] = []
 
-            # Add this resource to the account
-            output[account_id].append(resource)
+        # Add this resource to the account
+        resources[account_id].append(resource)
 
     return output
 
@@ -357,6 +475,82 @@ def get_missing_other_tags(owner):
     return missing_tags
 
 
+def audit_other_tags(owner):
+    """
+    Query cost explorer for both missing and invalid CostCenterOther tags
+    for the given resource owner, and return a tuple of the two results.
+    """
+
+    missing_tags = get_missing_other_tags(owner)
+    invalid_tags = get_invalid_other_tags(owner)
+    return missing_tags, invalid_tags
+
+
+def audit_other_tags_batch(owners):
+    """
+    Query cost explorer for both missing and invalid CostCenterOther tags
+    for many resource owners at once, and return a dictionary mapping each
+    owner to a tuple of the two results. This uses a constant number of
+    queries regardless of the number of owners.
+
+    Owners with a resource ID found in more than one account are audited
+    separately with audit_other_tags() instead, see _parse_ce_tag_results().
+    """
+
+    ambiguous = set()
+    missing = _parse_ce_tag_results(*ce.get_ce_missing_tag_for_emails(owners),
+                                    ambiguous=ambiguous)
+    invalid = _parse_ce_tag_results(*ce.get_ce_invalid_tag_for_emails(owners),
+                                    ambiguous=ambiguous)
+
+    output = {}
+    for owner in owners:
+        if owner in ambiguous:
+            LOG.info(f"Auditing {owner} separately, a resource is in more than one account")
+            output[owner] = audit_other_tags(owner)
+        else:
+            output[owner] = (missing.get(owner, {}), invalid.get(owner, {}))
+
+    return output
+
+
+def audit_recipients(recipients, concurrency, batch_size):
+    """
+    Audit CostCenterOther tags for a list of recipients, and return a list
+    of (missing, invalid) tuples in the same order as the recipients.
+
+    If the batch size is positive, recipients are audited in batches of that
+    size with audit_other_tags_batch(), otherwise each recipient is audited
+    separately with audit_other_tags(). Either way, up to `concurrency`
+    audits will run at once.
+
+    Once the run deadline has passed no new audits are started, and the
+    remaining recipients have None in place of their audit results.
+    """
+
+    def _audit(owner):
+        if deadline.expired():
+            return None
+        return audit_other_tags(owner)
+
+    def _audit_batch(owners):
+        if deadline.expired():
+            return dict.fromkeys(owners)
+        return audit_other_tags_batch(owners)
+
+    if batch_size <= 0:
+        return workers.map_bounded(_audit, recipients, concurrency)
+
+    batches = [recipients[i:i + batch_size]
+               for i in range(0, len(recipients), batch_size)]
+
+    audits = {}
+    for batch in workers.map_bounded(_audit_batch, batches, concurrency):
+        audits.update(batch)
+
+    return [audits[r] for r in recipients]
+
+
 def build_summary(target_period, compare_period, team_sage):
     """
     Build a complex data structure representing the input needed for email
@@ -365,7 +559,7 @@ def build_summary(target_period, compare_period, team_sage):
     The first function parameter is a TimePeriod dict representing the month we
     are reporting on. The second parameter is a TimePeriod dict representing the
     month prior to the target month, for calculating percent change. The third
-    parameter is a list of valid synapse users for receiving notifications.
+    parameter is a set of valid synapse users for receiving notifications.
 
     The top-level data structure is a dictionary with three static keys:
     'account_names', 'per_user_summary', and 'unowned'.
@@ -398,6 +592,10 @@ def build_summary(target_period, compare_period, team_sage):
     total cost of unowned resources in the account and the percent change from
     the previous month, respectively.
 
+    If the run deadline passes before every recipient's tags are audited, the
+    remaining recipients are left out of 'per_user_summary' and listed under
+    an additional 'pending' key instead.
+
     Example output
     ```
     account_names:
@@ -429,11 +627,59 @@ def build_summary(target_period, compare_period, team_sage):
     ```
     """
 
+    concurrency = int(os.environ.get('AUDIT_CONCURRENCY', '8'))
+    batch_size = int(os.environ.get('AUDIT_BATCH_SIZE', '100'))
+
+    data, account_names, unowned = build_owner_totals(target_period, compare_period)
+
+    # Filter valid recipients, in the order they will be sent reports
+    recipients = [r for r in data if ses.valid_recipient(r, team_sage)]
+    recipients = prioritize_recipients(recipients, data)
+
+    # Amend summary with missing or invalid CostCenterOther tags
+    # Do this after filtering to minimize CE calls
+    with metrics.phase('audit'):
+        audits = audit_recipients(recipients, concurrency, batch_size)
+
+    filtered = {}
+    pending = []
+    for recipient, audit in zip(recipients, audits):
+        if audit is None:
+            pending.append(recipient)
+            continue
+        missing_tags, invalid_tags = audit
+        filtered[recipient] = add_tag_audit(data[recipient], missing_tags, invalid_tags)
+
+    LOG.debug(f"Final summary: {filtered}")
+
+    summary = {
+        'account_names': account_names,
+        'per_user_summary': filtered,
+        'unowned': unowned,
+    }
+
+    if pending:
+        LOG.warning(f"Deadline reached before auditing tags for: {pending}")
+        summary['pending'] = pending
+
+    return summary
+
+
+def build_owner_totals(target_period, compare_period):
+    """
+    Build the resource and account totals for each owner, before filtering
+    recipients and auditing tags, see build_summary().
+
+    Return a tuple of the unfiltered per-user summary, account names, and
+    unowned totals.
+    """
+
     data = {}
     min_value = float(os.environ['MINIMUM'])
 
     # Generate 'resources' subkeys under 'per_user_summary'
-    resources_by_owner = get_resource_totals(target_period, compare_period, min_value)
+    with metrics.phase('resource_totals'):
+        resources_by_owner = get_resource_totals(target_period, compare_period, min_value)
     LOG.debug(f"Resource data: {resources_by_owner}")
 
     # Unowned resource costs will be associated with an empty string owner,
@@ -451,9 +697,10 @@ def build_summary(target_period, compare_period, team_sage):
         data[owner]['resources'] = resources_by_owner[owner]['resources']
 
     # Generate 'accounts' subkeys
-    accounts_dict, account_names = get_account_totals(target_period,
-                                                      compare_period,
-                                                      min_value)
+    with metrics.phase('account_totals'):
+        accounts_dict, account_names = get_account_totals(target_period,
+                                                          compare_period,
+                                                          min_value)
     LOG.debug(f"Account data: {accounts_dict}")
     LOG.debug(f"Account names: {account_names}")
 
@@ -474,29 +721,264 @@ def build_summary(target_period, compare_period, team_sage):
     LOG.debug(f"Uncategorized: {unowned}")
     LOG.debug(f"Unfiltered data: {data}")
 
-    # Filter valid recipients and amend missing tag info
-    filtered = {}
-    for recipient in data:
-        if ses.valid_recipient(recipient, team_sage):
-            filtered[recipient] = data[recipient]
+    return data, account_names, unowned
 
-            # Amend summary with missing CostCenterOther tags
-            # Do this after filtering to minimize CE calls
-            missing_tags = get_missing_other_tags(recipient)
-            if missing_tags:
-                filtered[recipient]['missing_other_tag'] = missing_tags
 
-            invalid_tags = get_invalid_other_tags(recipient)
-            if invalid_tags:
-                filtered[recipient]['invalid_other_tag'] = invalid_tags
+def owner_priority(entry, order='spend'):
+    """
+    Get the send priority of an owner's summary entry from the totals in
+    their report, see render.owned_resources(): the total spend for 'spend',
+    or the absolute month-over-month change in dollars for 'change'. Percent
+    changes are converted back to dollars, a total with nothing to compare
+    against counts entirely as change.
+    """
 
-    LOG.debug(f"Final summary: {filtered}")
+    spend = 0.0
+    delta = 0.0
+    for usage in (render.owned_resources(entry), entry.get('accounts') or {}):
+        for _, total, change in model.iter_usage(usage):
+            spend += total
+            if change is None:
+                delta += total
+            elif change != -1:
+                delta += total * change / (1 + change)
 
-    return {
-        'account_names': account_names,
-        'per_user_summary': filtered,
-        'unowned': unowned,
-    }
+    if order == 'change':
+        return abs(delta)
+    return spend
+
+
+def prioritize_recipients(recipients, data):
+    """
+    Order recipients for sending by owner_priority(), highest first, so that
+    the owners with the most at stake get their reports first if a run is
+    throttled or cut short. The priority is set by the SEND_ORDER environment
+    variable: 'spend' (the default), 'change', or 'none' to keep the cost
+    explorer order. Owners with the same priority keep the cost explorer
+    order.
+
+    Each priority is computed once, and sorting takes O(n log n) time.
+    """
+
+    order = os.environ.get('SEND_ORDER', 'spend')
+    if order == 'none':
+        return list(recipients)
+
+    priority = {r: owner_priority(data[r], order) for r in recipients}
+    return sorted(recipients, key=priority.__getitem__, reverse=True)
+
+
+def add_tag_audit(summary, missing_tags, invalid_tags):
+    """
+    Amend a user summary entry with missing or invalid CostCenterOther tags
+    """
+
+    if missing_tags:
+        summary['missing_other_tag'] = missing_tags
+
+    if invalid_tags:
+        summary['invalid_other_tag'] = invalid_tags
+
+    return summary
+
+
+def stream_user_reports(target_period, compare_period, team_sage, period,
+                        skip=frozenset(), on_result=None, on_unowned=None):
+    """
+    Streaming alternative to build_summary() followed by sending reports.
+
+    Owner totals are built as in build_summary(), then each recipient's tag
+    audit, report rendering and send are pipelined: a report is rendered and
+    sent as soon as the audit covering its recipient completes. Audits and
+    sends are connected by a bounded queue (STREAM_QUEUE_DEPTH entries), and
+    each summary entry is released once it is queued, so rendered bodies and
+    audited summaries never accumulate for every recipient at once.
+
+    Recipients in `skip` are neither audited nor sent a report, e.g. if they
+    were already sent one by an earlier attempt. If given, `on_result` is
+    called with each send result as soon as it is known. Once the run
+    deadline has passed no new audits or sends are started, and the remaining
+    recipients have pending results.
+
+    Recipients are audited and sent reports in prioritize_recipients() order.
+    If given, `on_unowned` is called with the unowned totals and account
+    names as soon as they are known, before any user report is sent.
+
+    Return a tuple of account names, unowned totals, and a list of
+    per-recipient send results in recipient order.
+    """
+
+    concurrency = int(os.environ.get('AUDIT_CONCURRENCY', '8'))
+    batch_size = int(os.environ.get('AUDIT_BATCH_SIZE', '100'))
+    queue_depth = int(os.environ.get('STREAM_QUEUE_DEPTH', '16'))
+
+    data, account_names, unowned = build_owner_totals(target_period, compare_period)
+    recipients = [r for r in data if r not in skip and ses.valid_recipient(r, team_sage)]
+    recipients = prioritize_recipients(recipients, data)
+
+    if on_unowned is not None:
+        on_unowned(unowned, account_names)
+
+    if batch_size <= 0:
+        batches = [[r, ] for r in recipients]
+    else:
+        batches = [recipients[i:i + batch_size]
+                   for i in range(0, len(recipients), batch_size)]
+
+    def _audit(batch):
+        if deadline.expired():
+            return [(r, None) for r in batch]
+
+        if batch_size <= 0:
+            audits = {batch[0]: audit_other_tags(batch[0])}
+        else:
+            audits = audit_other_tags_batch(batch)
+
+        return [(r, add_tag_audit(data.pop(r), *audits[r])) for r in batch]
+
+    send_report = ses.report_sender(account_names, period)
+
+    def _send(record):
+        recipient, summary = record
+        if summary is None or deadline.expired():
+            return ses.pending_result(recipient)
+
+        result = send_report(recipient, summary)
+        if on_result is not None:
+            on_result(result)
+        return result
+
+    with metrics.phase('stream'):
+        results = workers.pipeline(_audit, batches, _send,
+                                   concurrency, ses.send_concurrency(), queue_depth)
+
+    order = {r: i for i, r in enumerate(recipients)}
+    results.sort(key=lambda result: order[result['recipient']])
+
+    return account_names, unowned, results
+
+
+def _log_send_results(results):
+    sent = [r['recipient'] for r in results if r['status'] == 'sent']
+    failed = [r['recipient'] for r in results if r['status'] == 'failed']
+    pending = [r['recipient'] for r in results if r['status'] == 'pending']
+    LOG.info(f"Sent {len(sent)} of {len(results)} user reports")
+    if failed:
+        LOG.error(f"Failed to send user reports to: {failed}")
+    if pending:
+        LOG.warning(f"Deadline reached before sending user reports to: {pending}")
+
+
+def build_run_report(recipients, results, sent=frozenset()):
+    """
+    Build the result of a run from per-recipient send results. Recipients
+    in `sent` were sent a report by an earlier attempt, and recipients with
+    no result are pending, e.g. if their shard has not reported back.
+
+    Example report:
+    ```
+    completed: [user1@example.com]
+    failed: [user2@example.com]
+    pending: [user3@example.com]
+    deadline_reached: true
+    ```
+    """
+
+    status = {r: 'sent' for r in recipients if r in sent}
+    for result in results:
+        status[result['recipient']] = result['status']
+
+    report = {'completed': [], 'failed': [], 'pending': []}
+    lists = {'sent': report['completed'], 'failed': report['failed']}
+    for recipient in recipients:
+        lists.get(status.get(recipient), report['pending']).append(recipient)
+
+    report['deadline_reached'] = deadline.expired()
+    return report
+
+
+def send_user_reports(per_user, account_names, email_period, run, rate_share=1.0):
+    """
+    Send reports for a per-user summary, in bulk if enabled by the BULK_SEND
+    environment variable, recording each result in the run checkpoint and
+    skipping recipients it has already recorded as sent.
+
+    Return a list of per-recipient send results. If the run deadline has
+    already passed nothing is sent, and every remaining recipient has a
+    pending result.
+    """
+
+    sent = run.sent()
+    per_user = {r: s for r, s in per_user.items() if r not in sent}
+
+    with metrics.phase('send'):
+        if deadline.expired():
+            results = [ses.pending_result(r) for r in per_user]
+        elif os.environ.get('BULK_SEND', 'False') == 'True':
+            results = ses.send_bulk_report_emails(per_user, account_names, email_period,
+                                                  on_result=run.record, rate_share=rate_share)
+        else:
+            results = ses.send_report_emails(per_user, account_names, email_period,
+                                             on_result=run.record, rate_share=rate_share)
+
+    _log_send_results(results)
+    return results
+
+
+def send_unowned_report(unowned, account_names, email_period, run, sent=frozenset()):
+    """
+    Build and send the report on unowned costs to the admin recipient,
+    recording it in the run checkpoint, unless it is in `sent` because an
+    earlier attempt already sent it.
+
+    Return 'sent' if the report was sent by this or an earlier attempt, or
+    'failed' if it could not be sent.
+    """
+
+    if checkpoint.unowned_recipient in sent:
+        LOG.info("Unowned report already sent")
+        return 'sent'
+
+    with metrics.phase('unowned'):
+        unowned_html, unowned_text = ses.build_unowned_email_body(unowned, account_names)
+        message_id = ses.send_unowned_email(unowned_html, unowned_text, email_period)
+
+    if message_id is None:
+        return 'failed'
+
+    run.record({'recipient': checkpoint.unowned_recipient,
+                'status': 'sent',
+                'message_id': message_id})
+    return 'sent'
+
+
+def send_shard(event):
+    """
+    Send user reports for a single shard of the summary, see
+    shard.build_shard_events(). Each shard paces its sends to an equal share
+    of the account's SES send rate.
+
+    Return a run report like build_run_report(), with the shard name and a
+    list of per-recipient send results.
+    """
+
+    info = event['shard']
+    name = shard.shard_name(info['index'], info['count'])
+    LOG.info(f"Sending reports for {name} of {info['email_period']}")
+
+    summary = checkpoint.decode_summary(event['summary'])
+    run = shard.open_shard_run(event)
+    sent = run.sent()
+
+    per_user = summary['per_user_summary']
+    results = send_user_reports(per_user,
+                                summary['account_names'],
+                                info['email_period'],
+                                run,
+                                rate_share=1 / info['count'])
+
+    report = build_run_report(list(per_user), results, sent)
+    return {'shard': name, 'results': results, **report}
 
 
 def lambda_handler(event, context):
@@ -507,8 +989,85 @@ def lambda_handler(event, context):
     (2) tagged account totals for the month, and (3) resources missing a required
     CostCenterOther tag. Include month-over-month changes for both resource and
     account totals.
+
+    Progress is checkpointed per report period, so if the lambda is retried
+    it reuses the summary from the earlier attempt and skips recipients that
+    were already sent a report. An event with a 'run_id' is checkpointed
+    separately, e.g. to re-run a report on purpose, see checkpoint.run_key().
+
+    If the SHARD_COUNT environment variable is greater than 1, this
+    invocation acts as a coordinator: it builds the summary and then invokes
+    the lambda once per shard of recipients, with a 'shard' event handled by
+    send_shard(). Sharding is ignored, with a warning, if the STREAMING
+    environment variable is 'True'.
+
+    Metrics for each phase of the run are written as a single CloudWatch
+    Embedded Metric Format log line when the run ends, see metrics.flush().
+    If memory profiling is enabled, a memory report with the same phases is
+    also written, see memory.finish().
+
+    If the CASSETTE environment variable is 'record', every API call made
+    during the run is saved to a cassette file that can be replayed offline
+    with CASSETTE set to 'replay', see the cassette module.
+
+    The run has a deadline, DEADLINE_RESERVE seconds before the lambda times
+    out according to the context. Once it passes no new sends are started,
+    and the run returns a report of completed, failed and pending recipients
+    so that nobody is skipped silently (see build_run_report()), along with
+    the status of the unowned report.
+
+    Shards invoked in-process (see shard.LocalDispatcher) run inside the
+    coordinator's run, sharing its metrics, memory profile, deadline and
+    cassette.
     """
 
+    global _depth
+
+    with _lock:
+        _depth += 1
+        outermost = _depth == 1
+
+    try:
+        if not outermost:
+            return handle_event(event, context)
+
+        with run_context(context):
+            return handle_event(event, context)
+    finally:
+        with _lock:
+            _depth -= 1
+
+
+@contextlib.contextmanager
+def run_context(context):
+    """
+    Start the per-run state of each module for a run, and finish it in
+    reverse order when the run ends, even if the run fails
+    """
+
+    with contextlib.ExitStack() as stack:
+        stack.callback(cassette.save)
+
+        metrics.start()
+        stack.callback(metrics.flush)
+
+        memory.start()
+        stack.callback(memory.finish)
+
+        deadline.start(context)
+        stack.callback(deadline.finish)
+
+        yield
+
+
+def handle_event(event, context):
+    """
+    Handle a lambda event, see lambda_handler()
+    """
+
+    if 'shard' in event:
+        return send_shard(event)
+
     # Calculate the reporting periods to send to cost explorer
     now = datetime.now()
     target_month, compare_month = report_periods(now)
@@ -517,20 +1076,84 @@ def lambda_handler(event, context):
     _dt = datetime.fromisoformat(target_month['Start'])
     email_period = _dt.strftime("%B %Y")  # Month Year
 
-    # Get Team Sage from Synapse
-    team_sage = synapse.get_team_sage_members()
-
-    # Build email summary
-    summary = build_summary(target_month, compare_month, team_sage)
-    per_user = summary['per_user_summary']
-    accounts = summary['account_names']
-    unowned = summary['unowned']
-
-    # Create and send user reports from summary
-    for email in per_user:
-        user_html, user_text = ses.build_user_email_body(per_user[email], accounts)
-        ses.send_report_email(email, user_html, user_text, email_period)
-
-    # Create and send unowned report to admin
-    unowned_html, unowned_text = ses.build_unowned_email_body(unowned, accounts)
-    ses.send_unowned_email(unowned_html, unowned_text, email_period)
+    run_key = checkpoint.run_key(target_month['Start'], event.get('run_id'))
+    run = checkpoint.open_run(run_key)
+    sent = run.sent()
+
+    # The unowned report is sent to the admin before user reports, so that it
+    # isn't held up by a long send or cut short by the deadline
+    unowned_status = None
+
+    def _send_unowned(unowned, accounts):
+        nonlocal unowned_status
+        unowned_status = send_unowned_report(unowned, accounts, email_period, run, sent)
+
+    if os.environ.get('STREAMING', 'False') == 'True':
+        # Streamed reports are sent by this invocation as each audit
+        # completes, before there is a summary to shard
+        if shard.shard_count() > 1:
+            LOG.warning(f"Ignoring SHARD_COUNT={shard.shard_count()} when STREAMING is "
+                        f"enabled, sending every report from this invocation")
+
+        # Get Team Sage from Synapse
+        with metrics.phase('synapse'):
+            team_sage = synapse.get_team_sage_members()
+
+        # Send user reports as each one is ready
+        _, _, results = stream_user_reports(target_month,
+                                            compare_month,
+                                            team_sage,
+                                            email_period,
+                                            skip=sent,
+                                            on_result=run.record,
+                                            on_unowned=_send_unowned)
+        _log_send_results(results)
+
+        recipients = sorted(sent - {checkpoint.unowned_recipient})
+        recipients.extend(r['recipient'] for r in results)
+    else:
+        # Build email summary, unless an earlier attempt already built it
+        summary = run.load_summary()
+        if summary is None:
+            with metrics.phase('synapse'):
+                team_sage = synapse.get_team_sage_members()
+            with metrics.phase('summary'):
+                summary = build_summary(target_month, compare_month, team_sage)
+
+            # An incomplete summary is rebuilt by the next attempt, so that
+            # recipients left pending by the deadline are audited then
+            if 'pending' not in summary:
+                run.save_summary(summary)
+
+        per_user = summary['per_user_summary']
+        accounts = summary['account_names']
+
+        # Build shard events before sending anything, so that a summary too
+        # large to dispatch fails the run before any report goes out
+        count = shard.shard_count()
+        if count > 1:
+            events = shard.build_shard_events(summary, run_key, email_period, count)
+
+        _send_unowned(summary['unowned'], accounts)
+
+        if count > 1:
+            # Fan out user reports to shard invocations
+            dispatcher = shard.get_dispatcher(context, lambda_handler)
+            with metrics.phase('dispatch'):
+                dispatched = shard.dispatch_shards(dispatcher, events, run)
+
+            # In-process shards report their results, lambda shards are
+            # still running so their recipients are pending
+            results = [r for d in dispatched for r in d.get('results', [])]
+        else:
+            # Create and send user reports from summary
+            results = send_user_reports(per_user, accounts, email_period, run)
+
+        recipients = list(per_user) + summary.get('pending', [])
+
+    report = build_run_report(recipients, results, sent)
+    report['unowned'] = unowned_status
+
+    LOG.info(f"Completed {len(report['completed'])} user reports, "
+             f"{len(report['failed'])} failed, {len(report['pending'])} pending")
+    return report
@@ -0,0 +1,141 @@
+import json
+import logging
+import os
+import threading
+import time
+
+LOG = logging.getLogger(__name__)
+LOG.setLevel(logging.DEBUG)
+
+# The lambda homedir is not writeable, keep cache files in /tmp
+cache_root = '/tmp/email_totals'
+
+# Cached data kept in process memory, which persists across warm invocations
+memory = {}
+
+
+def _cache_path(name, root):
+    return os.path.join(root or cache_root, f"{name}.json")
+
+
+def load(name, root=None):
+    """
+    Load cached data by name, from process memory if present, otherwise from
+    a file in the cache directory (or the given root directory). Return None
+    if nothing is cached.
+    """
+
+    if name in memory:
+        return memory[name]
+
+    try:
+        with open(_cache_path(name, root)) as f:
+            data = json.load(f)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        LOG.warning(f"Ignoring unreadable cache file for {name}: {e}")
+        return None
+
+    memory[name] = data
+    return data
+
+
+def store(name, data, root=None):
+    """
+    Store JSON-serializable data by name, both in process memory and in a
+    file in the cache directory (or the given root directory). The file is
+    replaced atomically so that a partial write is never read back.
+    """
+
+    memory[name] = data
+
+    path = _cache_path(name, root)
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(f"{path}.tmp", 'w') as f:
+            json.dump(data, f, separators=(',', ':'))
+        os.replace(f"{path}.tmp", path)
+    except OSError as e:
+        LOG.warning(f"Unable to write cache file for {name}: {e}")
+
+
+class ListWriter:
+    """
+    Store a JSON list by name one item at a time, so that the whole list is
+    never held in memory. Items are written to a temporary file, which
+    replaces the cache file atomically on commit() or is removed by
+    discard(). Unlike store(), the list is not kept in process memory.
+    """
+
+    def __init__(self, name, root=None):
+        self.name = name
+        self.path = _cache_path(name, root)
+        self._tmp_path = f"{self.path}.{os.getpid()}-{threading.get_ident()}.tmp"
+        self._file = None
+        self._count = 0
+
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self._file = open(self._tmp_path, 'w')
+            self._file.write('[')
+        except OSError as e:
+            LOG.warning(f"Unable to write cache file for {name}: {e}")
+            self.discard()
+
+    def append(self, item):
+        if self._file is None:
+            return
+
+        try:
+            if self._count:
+                self._file.write(',')
+            json.dump(item, self._file, separators=(',', ':'))
+            self._count += 1
+        except OSError as e:
+            LOG.warning(f"Unable to write cache file for {self.name}: {e}")
+            self.discard()
+
+    def commit(self):
+        if self._file is None:
+            return
+
+        try:
+            self._file.write(']')
+            self._file.close()
+            self._file = None
+            os.replace(self._tmp_path, self.path)
+        except OSError as e:
+            LOG.warning(f"Unable to write cache file for {self.name}: {e}")
+            self.discard()
+            return
+
+        memory.pop(self.name, None)
+
+    def discard(self):
+        """
+        Remove the temporary file, unless the list was already committed
+        """
+
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+        try:
+            os.remove(self._tmp_path)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            LOG.warning(f"Unable to remove temporary cache file for {self.name}: {e}")
+
+
+def is_fresh(timestamp, ttl):
+    """
+    Determine if a cache timestamp (in epoch seconds) is within the given
+    time-to-live (in seconds)
+    """
+
+    if timestamp is None:
+        return False
+
+    return time.time() - timestamp < ttl
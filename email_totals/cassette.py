@@ -0,0 +1,350 @@
+import gzip
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+from collections import defaultdict, deque
+
+from botocore.exceptions import ClientError
+
+from email_totals import tracing
+
+LOG = logging.getLogger(__name__)
+LOG.setLevel(logging.DEBUG)
+
+# Default cassette file, see cassette_file()
+default_cassette_file = '/tmp/email_totals/cassette.json.gz'
+
+# Bump when the cassette format changes
+cassette_version = 1
+
+email_pattern = re.compile(r'([A-Za-z0-9._%+-]+)@([A-Za-z0-9.-]+\.[A-Za-z]+)')
+
+# The cassette for this process, see get_cassette()
+_cassette = None
+
+_lock = threading.Lock()
+
+
+def cassette_mode():
+    """
+    Get the cassette mode from the CASSETTE environment variable: 'record'
+    to record every API call, 'replay' to serve API calls from a recorded
+    cassette, or 'none'
+    """
+
+    return os.environ.get('CASSETTE', 'none')
+
+
+def cassette_file():
+    return os.environ.get('CASSETTE_FILE', default_cassette_file)
+
+
+def pseudonym(name):
+    """
+    Replace a user name, or the local part of an email address, with a
+    stable pseudonym. Case is ignored, like the summary ignores email case.
+    """
+
+    return 'user-' + hashlib.sha256(name.lower().encode()).hexdigest()[:10]
+
+
+def _scrub_email(match):
+    return f"{pseudonym(match.group(1))}@{match.group(2)}"
+
+
+def scrub(value):
+    """
+    Replace every email address in a request or response with a pseudonym
+    at the same domain, so that recipient filtering still behaves the same.
+    Synapse user names are replaced with the pseudonym for their email.
+    """
+
+    if isinstance(value, str):
+        return email_pattern.sub(_scrub_email, value)
+
+    if isinstance(value, list):
+        return [scrub(v) for v in value]
+
+    if isinstance(value, dict):
+        output = {}
+        for key, v in value.items():
+            if key == 'userName' and isinstance(v, str):
+                output[key] = pseudonym(v)
+            else:
+                output[key] = scrub(v)
+        return output
+
+    return value
+
+
+def _jsonable(value):
+    # Responses include datetimes, which are not used by this lambda
+    return json.loads(json.dumps(value, default=str))
+
+
+class Cassette:
+    """
+    Recorded API calls, each with the client name, operation, a fingerprint
+    of the parameters, the parameters, and the response (or error response).
+
+    Replayed calls are matched by client, operation and fingerprint. If no
+    recorded call has the same parameters, e.g. because a date changed since
+    recording, the next recorded call of the same operation is used instead.
+    """
+
+    def __init__(self, interactions=None, scrub_emails=False):
+        self.interactions = interactions or []
+        self.scrub_emails = scrub_emails
+        self._lock = threading.Lock()
+        self._exact = defaultdict(deque)
+        self._loose = defaultdict(deque)
+        self._last = {}
+        self._used = set()
+
+        for index, interaction in enumerate(self.interactions):
+            key = (interaction['client'], interaction['operation'])
+            self._exact[key + (interaction['fingerprint'],)].append(index)
+            self._loose[key].append(index)
+
+    @classmethod
+    def load(cls, path):
+        with gzip.open(path, 'rt') as f:
+            data = json.load(f)
+
+        if data.get('version') != cassette_version:
+            raise ValueError(f"Unsupported cassette version: {data.get('version')}")
+
+        LOG.info(f"Loaded {len(data['interactions'])} API calls from {path}")
+        return cls(data['interactions'])
+
+    def save(self, path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with self._lock:
+            data = {'version': cassette_version, 'interactions': list(self.interactions)}
+
+        # Each writer has its own temporary file, the last to finish wins
+        tmp_path = f"{path}.{os.getpid()}-{threading.get_ident()}.tmp"
+        with gzip.open(tmp_path, 'wt') as f:
+            json.dump(data, f, separators=(',', ':'))
+        os.replace(tmp_path, path)
+
+        LOG.info(f"Saved {len(data['interactions'])} API calls to {path}")
+
+    def record(self, client, operation, params, response=None, error=None):
+        if self.scrub_emails:
+            params = scrub(params)
+            response = scrub(response)
+            error = scrub(error)
+
+        params = _jsonable(params)
+        interaction = {
+            'client': client,
+            'operation': operation,
+            'fingerprint': tracing.fingerprint(params),
+            'params': params,
+        }
+        if error is not None:
+            interaction['error'] = _jsonable(error)
+        else:
+            interaction['response'] = _jsonable(response)
+
+        with self._lock:
+            self.interactions.append(interaction)
+
+    @staticmethod
+    def _next(queue, used):
+        while queue and queue[0] in used:
+            queue.popleft()
+        return queue.popleft() if queue else None
+
+    def find(self, client, operation, params, exact=False):
+        """
+        Find the next recorded call matching a request, or None. Once every
+        matching call has been replayed, the last one is repeated.
+        """
+
+        key = (client, operation, tracing.fingerprint(_jsonable(params)))
+
+        with self._lock:
+            index = self._next(self._exact[key], self._used)
+            if index is None and not exact:
+                index = self._next(self._loose[key[:2]], self._used)
+                if index is not None:
+                    LOG.debug(f"No exact match for {client}.{operation}, "
+                              f"replaying the next recorded call")
+
+            if index is None:
+                index = self._last.get(key)
+                if index is None:
+                    return None
+            else:
+                self._used.add(index)
+                self._last[key] = index
+
+        return self.interactions[index]
+
+    def replay(self, client, operation, params):
+        """
+        Return the recorded response for a request, or raise the recorded
+        error response as a ClientError
+        """
+
+        interaction = self.find(client, operation, params)
+        if interaction is None:
+            raise KeyError(f"No recorded call for {client}.{operation}")
+
+        if 'error' in interaction:
+            raise ClientError(interaction['error'], operation)
+        return interaction['response']
+
+
+def get_cassette():
+    """
+    Get the cassette for this process, loading it from the cassette file
+    when replaying
+    """
+
+    global _cassette
+
+    with _lock:
+        if _cassette is None:
+            if cassette_mode() == 'replay':
+                _cassette = Cassette.load(cassette_file())
+            else:
+                scrub_emails = os.environ.get('CASSETTE_SCRUB', 'True') == 'True'
+                _cassette = Cassette(scrub_emails=scrub_emails)
+        return _cassette
+
+
+def save():
+    """
+    Save the cassette file if recording
+    """
+
+    if cassette_mode() != 'record' or _cassette is None:
+        return
+
+    try:
+        _cassette.save(cassette_file())
+    except OSError as e:
+        LOG.warning(f"Unable to save cassette: {e}")
+
+
+def _call_params(args, kwargs):
+    # boto3 operations only take keyword arguments, synapse methods take both
+    if args:
+        return {'args': list(args), 'kwargs': kwargs}
+    return kwargs
+
+
+class _RecordingPaginator:
+    def __init__(self, client, operation, paginator):
+        self._client = client
+        self._operation = operation
+        self._paginator = paginator
+
+    def paginate(self, **kwargs):
+        cassette = get_cassette()
+        operation = f"paginate.{self._operation}"
+        for page_number, page in enumerate(self._paginator.paginate(**kwargs)):
+            cassette.record(self._client, operation, {'kwargs': kwargs, 'page': page_number}, page)
+            yield page
+
+
+class RecordingClient:
+    """
+    Wrapper for an API client that records every call to the cassette,
+    including each page of boto3 paginators
+    """
+
+    def __init__(self, name, client):
+        self._name = name
+        self._client = client
+
+    def get_paginator(self, operation):
+        return _RecordingPaginator(self._name, operation,
+                                   self._client.get_paginator(operation))
+
+    def __getattr__(self, operation):
+        attribute = getattr(self._client, operation)
+        if not callable(attribute):
+            return attribute
+
+        def _call(*args, **kwargs):
+            cassette = get_cassette()
+            params = _call_params(args, kwargs)
+            try:
+                response = attribute(*args, **kwargs)
+            except ClientError as e:
+                cassette.record(self._name, operation, params, error=e.response)
+                raise
+
+            # Generators, e.g. synapse team members, are recorded as lists
+            if hasattr(response, '__next__'):
+                response = list(response)
+
+            cassette.record(self._name, operation, params, response)
+            return response
+
+        return _call
+
+
+class _ReplayPaginator:
+    def __init__(self, client, operation):
+        self._client = client
+        self._operation = operation
+
+    def paginate(self, **kwargs):
+        cassette = get_cassette()
+        operation = f"paginate.{self._operation}"
+        page_number = 0
+        while True:
+            params = {'kwargs': kwargs, 'page': page_number}
+            interaction = cassette.find(self._client, operation, params, exact=True)
+            if interaction is None:
+                if page_number == 0:
+                    raise KeyError(f"No recorded pages for {self._client}.{self._operation}")
+                return
+            yield interaction['response']
+            page_number += 1
+
+
+class ReplayClient:
+    """
+    Stand-in for an API client that serves every call from the cassette,
+    without creating the real client
+    """
+
+    def __init__(self, name):
+        self._name = name
+
+    def get_paginator(self, operation):
+        return _ReplayPaginator(self._name, operation)
+
+    def __getattr__(self, operation):
+        if operation.startswith('_'):
+            raise AttributeError(operation)
+
+        def _call(*args, **kwargs):
+            return get_cassette().replay(self._name, operation, _call_params(args, kwargs))
+
+        return _call
+
+
+def wrap(name, factory):
+    """
+    Create a shared client by name, wrapped for recording or replaced for
+    replay according to the cassette mode
+    """
+
+    mode = cassette_mode()
+    if mode == 'replay':
+        return ReplayClient(name)
+
+    client = factory()
+    if mode == 'record':
+        return RecordingClient(name, client)
+    return client
@@ -1,9 +1,10 @@
+import hashlib
+import json
 import logging
-from datetime import datetime, timedelta
-
-import boto3
-from botocore.config import Config as BotoConfig
+import os
+from datetime import date, datetime, timedelta
 
+from email_totals import cache, clients
 
 LOG = logging.getLogger(__name__)
 LOG.setLevel(logging.DEBUG)
@@ -11,31 +12,234 @@ LOG.setLevel(logging.DEBUG)
 cost_metric = 'NetAmortizedCost'
 
 # Use adaptive mode in an attempt to optimize retry back-off
-ce_config = BotoConfig(
-    retries = {
-        'mode': 'adaptive',  # default mode is legacy
+ce_retries = {
+    'mode': 'adaptive',  # default mode is legacy
+}
+
+# Group definitions used for resource queries
+account_group = {
+    'Type': 'DIMENSION',
+    'Key': 'LINKED_ACCOUNT',
+}
+
+owner_group = {
+    'Type': 'COST_CATEGORY',
+    'Key': 'Owner Email',
+}
+
+# Count cached months served (hits) and months queried (misses)
+cache_stats = {
+    'hits': 0,
+    'misses': 0,
+}
+
+
+def get_ce_client():
+    """
+    Get the shared cost explorer client, creating it on first use
+    """
+
+    return clients.get_boto_client('ce', ce_retries)
+
+
+def yesterday_period():
+    """
+    get_cost_and_usage_with_resources() can only look back at most 14 days,
+    but we only need current resources missing tags, so use a period of
+    yesterday
+    """
+
+    today = datetime.now()
+    return {
+        'Start': (today - timedelta(days=1)).strftime('%Y-%m-%d'),
+        'End': today.strftime('%Y-%m-%d'),
+    }
+
+
+def span_periods(*periods):
+    """
+    Build a single TimePeriod covering all of the given periods
+    """
+
+    return {
+        'Start': min(p['Start'] for p in periods),
+        'End': max(p['End'] for p in periods),
     }
-)
-ce_client = boto3.client('ce', config=ce_config)
 
-# get_cost_and_usage_with_resources() can only look back at most 14 days,
-# but we only need current resources missing tags, so hard-code the period
-# to be yesterday; store it in a global variable to avoid recalculating it
-# on every call to get_ce_missing_tag_for_email()
-today = datetime.now()
-yesterday = {}
-yesterday['Start'] = (today - timedelta(days=1)).strftime('%Y-%m-%d')
-yesterday['End'] = today.strftime('%Y-%m-%d')
 
+def paginate(operation, **kwargs):
+    """
+    Call a cost explorer client operation, following NextPageToken, and
+    yield each page of results as it arrives. Cost explorer does not provide
+    boto paginators for these operations.
+    """
+
+    while True:
+        page = getattr(get_ce_client(), operation)(**kwargs)
+        yield page
+
+        token = page.get('NextPageToken')
+        if not token:
+            break
+
+        kwargs['NextPageToken'] = token
+
+
+def iter_period_groups(pages, attributes=None):
+    """
+    Split the results of a query spanning multiple months by TimePeriod,
+    yielding a tuple of the period start date and group for every group as
+    each page arrives. A month may be split across pages, so the same period
+    start can appear again in a later page.
+
+    If an attributes list is given, it is extended with the
+    DimensionValueAttributes from each page.
+    """
+
+    for page in pages:
+        if attributes is not None:
+            attributes.extend(page.get('DimensionValueAttributes', []))
+
+        for result in page['ResultsByTime']:
+            start = result['TimePeriod']['Start']
+            for group in result['Groups']:
+                yield start, group
+
+
+def _split_months(period):
+    """
+    Split a TimePeriod into a list of TimePeriods for each calendar month
+    """
+
+    months = []
+    current = date.fromisoformat(period['Start'])
+    end = date.fromisoformat(period['End'])
+
+    while current < end:
+        if current.month == 12:
+            following = date(current.year + 1, 1, 1)
+        else:
+            following = date(current.year, current.month + 1, 1)
+        following = min(following, end)
+
+        months.append({
+            'Start': current.isoformat(),
+            'End': following.isoformat(),
+        })
+        current = following
+
+    return months
+
+
+def _is_closed(month):
+    """
+    Determine if a month has ended, so that its results can be cached once
+    cost explorer no longer marks them as estimated
+    """
+
+    return date.fromisoformat(month['End']) <= datetime.now().date()
+
+
+def _cache_name(operation, month, kwargs):
+    """
+    Build a content-addressed cache name from a canonical form of the request
+    for a single month
+    """
+
+    request = dict(kwargs, Operation=operation, TimePeriod=month)
+    canonical = json.dumps(request, sort_keys=True, separators=(',', ':'))
+    return 'ce-' + hashlib.sha256(canonical.encode()).hexdigest()
+
+
+def paginate_monthly(operation, period, **kwargs):
+    """
+    Like paginate(), but serve closed months from the response cache.
+    Consecutive months missing from the cache are fetched with a single
+    query. Each closed month in the results is written to the cache as each
+    page is passed through, as a list of the pages that include it, and
+    kept once all pages have been consumed unless cost explorer marked it
+    as estimated. An estimated month, e.g. the target month just after it
+    closes, is queried again on every run until its billing data is final.
+
+    The cache only lasts as long as the lambda's execution environment, so
+    in practice it serves retries and re-runs on the same day rather than
+    the next month's run. It can be disabled by setting the CE_CACHE
+    environment variable to 'False'.
+    """
+
+    enabled = os.environ.get('CE_CACHE', 'True') == 'True'
+
+    # Build a list of cached pages, and runs of consecutive uncached months
+    runs = []
+    for month in _split_months(period):
+        name = _cache_name(operation, month, kwargs)
+        final = enabled and _is_closed(month)
+
+        cached = cache.load(name) if final else None
+        if cached is not None:
+            cache_stats['hits'] += 1
+            runs.append({'cached': cached})
+            continue
+
+        cache_stats['misses'] += 1
+        if runs and 'months' in runs[-1]:
+            runs[-1]['months'].append(month)
+        else:
+            runs.append({'months': [month], 'final': {}})
+
+        if final:
+            runs[-1]['final'][month['Start']] = name
+
+    for run in runs:
+        if 'cached' in run:
+            yield from run['cached']
+            continue
+
+        writers = {start: cache.ListWriter(name) for start, name in run['final'].items()}
+        try:
+            for page in paginate(operation, TimePeriod=span_periods(*run['months']), **kwargs):
+                yield page
+
+                for start, writer in list(writers.items()):
+                    results = [r for r in page['ResultsByTime']
+                               if r['TimePeriod']['Start'] == start]
+                    if not results:
+                        continue
 
-def get_ce_email_costs(period):
+                    if any(result.get('Estimated') for result in results):
+                        LOG.info(f"Not caching estimated results for {start}")
+                        writer.discard()
+                        del writers[start]
+                        continue
+
+                    writer.append({
+                        'ResultsByTime': results,
+                        'DimensionValueAttributes': page.get('DimensionValueAttributes', []),
+                    })
+
+            for writer in writers.values():
+                writer.commit()
+        finally:
+            for writer in writers.values():
+                writer.discard()
+
+    LOG.info(f"Cost explorer cache: {cache_stats['hits']} months cached, "
+             f"{cache_stats['misses']} months queried")
+
+
+def get_ce_email_costs(target_period, compare_period):
     """
     Get cost information grouped by owner email then account
-    (i.e. email totals for each account)
+    (i.e. email totals for each account) for both the target and compare
+    periods, using a single monthly query spanning both periods. Final
+    months are served from the cache instead.
+
+    Return a generator yielding each page of results.
     """
 
-    response = ce_client.get_cost_and_usage(
-        TimePeriod=period,
+    pages = paginate_monthly(
+        'get_cost_and_usage',
+        span_periods(compare_period, target_period),
         Granularity='MONTHLY',
         Metrics=[
             cost_metric,
@@ -49,16 +253,21 @@ def get_ce_email_costs(period):
         }],
     )
 
-    return response
+    return pages
 
 
-def get_ce_account_costs(period):
+def get_ce_account_costs(target_period, compare_period):
     """
-    Get cost information grouped by account (i.e. account totals)
+    Get cost information grouped by account (i.e. account totals) for both
+    the target and compare periods, using a single monthly query spanning
+    both periods. Final months are served from the cache instead.
+
+    Return a generator yielding each page of results.
     """
 
-    response = ce_client.get_cost_and_usage(
-        TimePeriod=period,
+    pages = paginate_monthly(
+        'get_cost_and_usage',
+        span_periods(compare_period, target_period),
         Granularity='MONTHLY',
         Metrics=[
             cost_metric,
@@ -69,95 +278,138 @@ def get_ce_account_costs(period):
         }],
     )
 
-    return response
+    return pages
 
 
-def get_ce_invalid_tag_for_email(email):
+def _invalid_tag_filter(emails):
     """
-    Get cost category resource information for a given owner email and
-    grouped by account, filtered for resources where the CostCenterOther
-    is set and CostCenter is not 'Other / 000001'.
+    Build a filter for resources owned by any of the given emails where the
+    CostCenterOther is set and CostCenter is not 'Other / 000001'.
     """
 
-    response = ce_client.get_cost_and_usage_with_resources(
-        TimePeriod=yesterday,
-        Granularity='MONTHLY',
-        Metrics=[
-            cost_metric,
-        ],
-        Filter={
-            'And': [{
-                'CostCategories': {
-                    'Key': 'Owner Email',
-                    'Values': [email, ],
+    return {
+        'And': [{
+            'CostCategories': {
+                'Key': 'Owner Email',
+                'Values': list(emails),
+                'MatchOptions': ['EQUALS', ],
+            }
+        }, {
+            'Not': {
+                'Tags': {
+                    'Key': 'CostCenter',
+                    'Values': ['Other / 000001', ],
                     'MatchOptions': ['EQUALS', ],
                 }
-            }, {
-                'Not': {
-                    'Tags': {
-                        'Key': 'CostCenter',
-                        'Values': ['Other / 000001', ],
-                        'MatchOptions': ['EQUALS', ],
-                    }
-                }
-            }, {
-                'Not': {
-                    'Tags': {
-                        'Key': 'CostCenterOther',
-                        'MatchOptions': ['ABSENT', ],
-                    }
-                }
             }
-        ]},
-        GroupBy=[{
-            'Type': 'DIMENSION',
-            'Key': 'LINKED_ACCOUNT',
         }, {
-            'Type': 'DIMENSION',
-            'Key': 'RESOURCE_ID',
-        }],
-    )
+            'Not': {
+                'Tags': {
+                    'Key': 'CostCenterOther',
+                    'MatchOptions': ['ABSENT', ],
+                }
+            }
+        }
+    ]}
 
-    return response
 
+def _missing_tag_filter(emails):
+    """
+    Build a filter for resources owned by any of the given emails where the
+    CostCenter tag is 'Other / 000001' but the CostCenterOther tag is absent.
+    """
 
-def get_ce_missing_tag_for_email(email):
+    return {"And": [
+        {'CostCategories': {
+            'Key': 'Owner Email',
+            'Values': list(emails),
+            'MatchOptions': ['EQUALS', ],
+        }
+        }, {'Tags': {
+            'Key': 'CostCenter',
+            'Values': ['Other / 000001', ],
+            'MatchOptions': ['EQUALS', ],
+        }
+        }, {'Tags': {
+            'Key': 'CostCenterOther',
+            'MatchOptions': ['ABSENT', ],
+        }
+        }
+    ]}
+
+
+def _get_ce_tag_resources(tag_filter, group_by):
     """
-    Get cost category resource information for a given owner email and
-    grouped by account, filtered for resources where the CostCenter tag
-    is 'Other / 000001' but the CostCenterOther tag is absent.
+    Get resource information for yesterday matching the given filter,
+    grouped by the given group definition and then resource ID.
+
+    Return a generator yielding each page of results.
     """
 
-    response = ce_client.get_cost_and_usage_with_resources(
-        TimePeriod=yesterday,
+    pages = paginate(
+        'get_cost_and_usage_with_resources',
+        TimePeriod=yesterday_period(),
         Granularity='MONTHLY',
         Metrics=[
             cost_metric,
         ],
-        Filter={"And": [
-            {'CostCategories': {
-                'Key': 'Owner Email',
-                'Values': [email, ],
-                'MatchOptions': ['EQUALS', ],
-            }
-            }, {'Tags': {
-                'Key': 'CostCenter',
-                'Values': ['Other / 000001', ],
-                'MatchOptions': ['EQUALS', ],
-            }
-            }, {'Tags': {
-                'Key': 'CostCenterOther',
-                'MatchOptions': ['ABSENT', ],
-            }
-            }
-        ]},
-        GroupBy=[{
-            'Type': 'DIMENSION',
-            'Key': 'LINKED_ACCOUNT',
-        }, {
+        Filter=tag_filter,
+        GroupBy=[group_by, {
             'Type': 'DIMENSION',
             'Key': 'RESOURCE_ID',
         }],
     )
 
-    return response
+    return pages
+
+
+def get_ce_invalid_tag_for_email(email):
+    """
+    Get cost category resource information for a given owner email and
+    grouped by account, filtered for resources where the CostCenterOther
+    is set and CostCenter is not 'Other / 000001'.
+    """
+
+    return _get_ce_tag_resources(_invalid_tag_filter([email, ]), account_group)
+
+
+def get_ce_missing_tag_for_email(email):
+    """
+    Get cost category resource information for a given owner email and
+    grouped by account, filtered for resources where the CostCenter tag
+    is 'Other / 000001' but the CostCenterOther tag is absent.
+    """
+
+    return _get_ce_tag_resources(_missing_tag_filter([email, ]), account_group)
+
+
+def get_ce_invalid_tag_for_emails(emails):
+    """
+    Batched version of get_ce_invalid_tag_for_email() covering many owner
+    emails at once.
+
+    A resource query can only group on two keys, so return a tuple of two
+    page generators: the first grouped by owner then resource, and the second
+    grouped by account then resource, to be joined on the resource ID.
+    """
+
+    tag_filter = _invalid_tag_filter(emails)
+    by_owner = _get_ce_tag_resources(tag_filter, owner_group)
+    by_account = _get_ce_tag_resources(tag_filter, account_group)
+    return by_owner, by_account
+
+
+def get_ce_missing_tag_for_emails(emails):
+    """
+    Batched version of get_ce_missing_tag_for_email() covering many owner
+    emails at once.
+
+    A resource query can only group on two keys, so return a tuple of two
+    page generators: the first grouped by owner then resource, and the second
+    grouped by account then resource, to be joined on the resource ID.
+    """
+
+    tag_filter = _missing_tag_filter(emails)
+    by_owner = _get_ce_tag_resources(tag_filter, owner_group)
+    by_account = _get_ce_tag_resources(tag_filter, account_group)
+    return by_owner, by_account
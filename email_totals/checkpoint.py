@@ -0,0 +1,312 @@
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+
+from email_totals import cache, model
+
+LOG = logging.getLogger(__name__)
+LOG.setLevel(logging.DEBUG)
+
+# Checkpoints are kept alongside cached data, in a subdirectory per backend
+checkpoint_dir = 'checkpoints'
+
+# The unowned report is recorded under the empty-string owner, which is
+# never a valid recipient
+unowned_recipient = ''
+
+# Default backend, see open_run()
+default_backend = 'file'
+
+# Run IDs become part of checkpoint file names, see run_key()
+run_id_pattern = re.compile(r'[A-Za-z0-9_.-]+')
+
+# Separates a run's key from the keys of checkpoints it owns, e.g. shards.
+# Run IDs can't contain it, so these never collide with another run's key.
+sub_key_separator = '+'
+
+
+def _checkpoint_root():
+    # Look up the cache root on each call so that it can be changed for tests
+    return os.path.join(cache.cache_root, checkpoint_dir)
+
+
+def _encode(value):
+    if isinstance(value, model.UsageTable):
+        return value.to_dict()
+    raise TypeError(f"Not JSON serializable: {type(value).__name__}")
+
+
+def encode_summary(summary):
+    """
+    Serialize a summary from build_summary() to a JSON string, converting
+    usage tables to plain dictionaries
+    """
+
+    return json.dumps(summary, default=_encode, separators=(',', ':'))
+
+
+def decode_summary(text):
+    """
+    Deserialize a summary serialized by encode_summary(), restoring usage
+    tables so that it has the same shape as the output of build_summary()
+    """
+
+    summary = json.loads(text)
+
+    for entry in summary['per_user_summary'].values():
+        for key in ('resources', 'accounts'):
+            if key in entry:
+                entry[key] = model.UsageTable(entry[key])
+
+    summary['unowned'] = model.UsageTable(summary['unowned'])
+
+    return summary
+
+
+class NullBackend:
+    """
+    Backend that records nothing, for runs without checkpoints
+    """
+
+    def load_summary(self, period):
+        return None
+
+    def save_summary(self, period, text):
+        pass
+
+    def load_sends(self, period):
+        return {}
+
+    def record_send(self, period, result):
+        pass
+
+
+class FileBackend:
+    """
+    Backend keeping checkpoints in files under /tmp. The summary for a period
+    is written atomically to a JSON file, and send results are appended to a
+    JSON-lines file as they happen, so a run killed part-way through a write
+    loses at most its last send result.
+    """
+
+    def __init__(self, root=None):
+        self.root = root or _checkpoint_root()
+
+    def _path(self, period, suffix):
+        return os.path.join(self.root, f"{period}-{suffix}")
+
+    def load_summary(self, period):
+        try:
+            with open(self._path(period, 'summary.json')) as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def save_summary(self, period, text):
+        path = self._path(period, 'summary.json')
+        os.makedirs(self.root, exist_ok=True)
+        with open(f"{path}.tmp", 'w') as f:
+            f.write(text)
+        os.replace(f"{path}.tmp", path)
+
+    def load_sends(self, period):
+        sends = {}
+        try:
+            with open(self._path(period, 'sends.jsonl')) as f:
+                for line in f:
+                    try:
+                        result = json.loads(line)
+                    except ValueError:
+                        LOG.warning(f"Ignoring partial send record: {line!r}")
+                        continue
+                    sends[result['recipient']] = result
+        except FileNotFoundError:
+            pass
+        return sends
+
+    def record_send(self, period, result):
+        os.makedirs(self.root, exist_ok=True)
+        with open(self._path(period, 'sends.jsonl'), 'a') as f:
+            f.write(json.dumps(result, separators=(',', ':')) + '\n')
+
+
+class SQLiteBackend:
+    """
+    Backend keeping checkpoints in a SQLite database under /tmp, with one
+    row per period summary and one row per recipient send result.
+    """
+
+    def __init__(self, path=None):
+        self.path = path or os.path.join(_checkpoint_root(), 'checkpoints.sqlite3')
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+
+        # Sends are recorded from worker threads, share one connection
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(self.path, check_same_thread=False)
+        with self._db:
+            self._db.execute("CREATE TABLE IF NOT EXISTS summaries "
+                             "(period TEXT PRIMARY KEY, summary TEXT)")
+            self._db.execute("CREATE TABLE IF NOT EXISTS sends "
+                             "(period TEXT, recipient TEXT, result TEXT, "
+                             "PRIMARY KEY (period, recipient))")
+
+    def load_summary(self, period):
+        with self._lock:
+            row = self._db.execute("SELECT summary FROM summaries WHERE period = ?",
+                                   (period,)).fetchone()
+        return row[0] if row else None
+
+    def save_summary(self, period, text):
+        with self._lock, self._db:
+            self._db.execute("INSERT OR REPLACE INTO summaries VALUES (?, ?)",
+                             (period, text))
+
+    def load_sends(self, period):
+        with self._lock:
+            rows = self._db.execute("SELECT result FROM sends WHERE period = ?",
+                                    (period,)).fetchall()
+
+        sends = {}
+        for (text,) in rows:
+            result = json.loads(text)
+            sends[result['recipient']] = result
+        return sends
+
+    def record_send(self, period, result):
+        text = json.dumps(result, separators=(',', ':'))
+        with self._lock, self._db:
+            self._db.execute("INSERT OR REPLACE INTO sends VALUES (?, ?, ?)",
+                             (period, result['recipient'], text))
+
+
+backends = {
+    'none': NullBackend,
+    'file': FileBackend,
+    'sqlite': SQLiteBackend,
+}
+
+
+class Run:
+    """
+    Checkpoint for a run of the lambda, keyed by report period. Records the
+    fetched summary, and the send result for each recipient, so that a
+    retried run can resume from the saved summary and skip recipients that
+    were already sent a report.
+    """
+
+    def __init__(self, backend, period):
+        self.backend = backend
+        self.period = period
+        self._lock = threading.Lock()
+        self._sends = backend.load_sends(period)
+
+    def load_summary(self):
+        """
+        Get the saved summary for this period, or None if there isn't one
+        """
+
+        text = self.backend.load_summary(self.period)
+        if text is None:
+            return None
+
+        try:
+            return decode_summary(text)
+        except (KeyError, TypeError, ValueError) as e:
+            LOG.warning(f"Ignoring unreadable checkpoint summary: {e}")
+            return None
+
+    def save_summary(self, summary):
+        try:
+            self.backend.save_summary(self.period, encode_summary(summary))
+        except (OSError, sqlite3.Error) as e:
+            LOG.warning(f"Unable to save checkpoint summary: {e}")
+
+    def dispatches(self):
+        """
+        Get a run for recording the shards this run dispatched, checkpointed
+        under its own key so that shards are kept apart from recipients
+        """
+
+        return Run(self.backend, sub_key(self.period, 'dispatched'))
+
+    def sent(self):
+        """
+        Get a frozen set of recipients that were sent a report this period
+        """
+
+        with self._lock:
+            return frozenset(r for r, result in self._sends.items()
+                             if result['status'] == 'sent')
+
+    def record(self, result):
+        """
+        Record a per-recipient send result, see ses.report_sender(). Safe to
+        call from concurrent senders.
+        """
+
+        with self._lock:
+            self._sends[result['recipient']] = result
+            try:
+                self.backend.record_send(self.period, result)
+            except (OSError, sqlite3.Error) as e:
+                LOG.warning(f"Unable to record send to {result['recipient']}: {e}")
+
+
+def run_key(period, run_id=None):
+    """
+    Get the checkpoint key for a run of a report period. Runs given a run ID,
+    e.g. a manual re-run, are checkpointed separately from the scheduled run
+    and from runs with other IDs, so they don't skip recipients that an
+    earlier run already sent a report.
+    """
+
+    if not run_id:
+        return period
+
+    run_id = str(run_id)
+    if not run_id_pattern.fullmatch(run_id):
+        raise ValueError(f"Invalid run_id '{run_id}', expected letters, digits, '.', '_' or '-'")
+
+    return f"{period}-{run_id}"
+
+
+def sub_key(key, name):
+    """
+    Get the checkpoint key for part of a run, e.g. a shard, see run_key()
+    """
+
+    return f"{key}{sub_key_separator}{name}"
+
+
+def open_run(period, backend=None):
+    """
+    Open the checkpoint for a report period, using the backend named by the
+    CHECKPOINT environment variable ('file', 'sqlite' or 'none') by default
+    """
+
+    if backend is None:
+        backend = os.environ.get('CHECKPOINT', default_backend)
+
+    if backend not in backends:
+        LOG.warning(f"Unknown checkpoint backend '{backend}', disabling checkpoints")
+        backend = 'none'
+
+    try:
+        run = Run(backends[backend](), period)
+    except (OSError, sqlite3.Error) as e:
+        LOG.warning(f"Unable to open checkpoint, disabling checkpoints: {e}")
+        run = Run(NullBackend(), period)
+
+    sent = run.sent()
+    if sent:
+        skipped = sorted(sent - {unowned_recipient})
+        LOG.warning(f"Resuming checkpoint {period}, skipping {len(skipped)} recipients "
+                    f"already sent a report: {skipped}")
+        if unowned_recipient in sent:
+            LOG.warning(f"Resuming checkpoint {period}, skipping the unowned report")
+        LOG.warning("Invoke with a new run_id to send these reports again")
+
+    return run
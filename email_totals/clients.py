@@ -0,0 +1,72 @@
+import logging
+import threading
+
+from email_totals import cassette, metrics, tracing
+
+LOG = logging.getLogger(__name__)
+LOG.setLevel(logging.DEBUG)
+
+# Shared clients by name, created on first use and reused across warm
+# invocations; clients are thread-safe once created
+shared = {}
+_lock = threading.Lock()
+
+
+def _create_boto_client(service, retries):
+    # Importing boto3 is a large part of a cold start, only import it when
+    # a client is first needed
+    import boto3
+    from botocore.config import Config as BotoConfig
+
+    client = boto3.client(service, config=BotoConfig(retries=retries))
+    metrics.instrument(client)
+    tracing.instrument(client)
+    return client
+
+
+def _create_synapse_client():
+    import synapseclient as syn
+
+    # The lambda homedir is not writeable, put the cache in /tmp
+    return syn.Synapse(cache_root_dir='/tmp/synapse')
+
+
+def get_client(name, factory):
+    """
+    Get a shared client by name, calling the factory function to create it
+    if it doesn't exist yet. When recording or replaying a cassette, the
+    client is wrapped or replaced, see cassette.wrap().
+    """
+
+    # Client creation is not thread-safe, hold the lock while creating
+    with _lock:
+        if name not in shared:
+            LOG.debug(f"Creating {name} client")
+            shared[name] = cassette.wrap(name, factory)
+        return shared[name]
+
+
+def get_boto_client(service, retries=None):
+    """
+    Get a shared boto3 client for an AWS service, configured with the given
+    retry options on first use
+    """
+
+    return get_client(service, lambda: _create_boto_client(service, retries))
+
+
+def get_synapse_client():
+    """
+    Get a shared Synapse client
+    """
+
+    return get_client('synapse', _create_synapse_client)
+
+
+def set_client(name, client):
+    """
+    Replace the shared client by name, e.g. with a stand-in for testing
+    """
+
+    with _lock:
+        shared[name] = client
@@ -0,0 +1,80 @@
+import logging
+import os
+import time
+
+LOG = logging.getLogger(__name__)
+LOG.setLevel(logging.DEBUG)
+
+# Seconds kept in reserve before the lambda timeout, see reserve()
+default_reserve = 10.0
+
+# Monotonic time at which no new work should be started, None when the run
+# has no deadline, e.g. when running locally
+_deadline = None
+
+
+def reserve():
+    """
+    Get the number of seconds to keep in reserve before the lambda timeout,
+    from the DEADLINE_RESERVE environment variable. The reserve covers work
+    already in progress when the deadline passes, and flushing checkpoints,
+    metrics and reports.
+    """
+
+    return float(os.environ.get('DEADLINE_RESERVE', default_reserve))
+
+
+def start(context):
+    """
+    Start the deadline for a run from the lambda context, the remaining
+    time less the reserve. There is no deadline if the context is None, e.g.
+    when running locally.
+    """
+
+    global _deadline
+
+    _deadline = None
+    if context is not None:
+        remaining = context.get_remaining_time_in_millis() / 1000
+        _deadline = time.monotonic() + remaining - reserve()
+        LOG.info(f"Deadline in {remaining - reserve():.1f}s")
+
+
+def finish():
+    """
+    Finish a run started with start()
+    """
+
+    global _deadline
+
+    _deadline = None
+
+
+def remaining():
+    """
+    Get the number of seconds until the deadline, or None if there is no
+    deadline
+    """
+
+    if _deadline is None:
+        return None
+    return _deadline - time.monotonic()
+
+
+def expired():
+    """
+    Determine if the deadline has passed, and no new work should be started
+    """
+
+    left = remaining()
+    return left is not None and left <= 0
+
+
+def allows(seconds):
+    """
+    Determine if work expected to take the given number of seconds, e.g. a
+    retry delay, would finish before the deadline
+    """
+
+    left = remaining()
+    return left is None or seconds < left
@@ -0,0 +1,161 @@
+import json
+import logging
+import os
+import threading
+import time
+import tracemalloc
+
+LOG = logging.getLogger(__name__)
+LOG.setLevel(logging.DEBUG)
+
+# Default file for the memory report, see finish()
+default_report_file = '/tmp/email_totals/memory.json'
+
+# Number of allocation sites listed at each phase boundary
+default_top_sites = 10
+
+# Boundaries recorded for the current run, None when not profiling
+_boundaries = None
+
+# Whether tracing was started by start(), and should be stopped by finish()
+_started = False
+
+_lock = threading.Lock()
+
+# Allocations made by the profiler itself are not interesting
+_ignore = (
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, __file__),
+)
+
+
+def enabled():
+    """
+    Determine if memory profiling is enabled by the MEMORY_PROFILE
+    environment variable
+    """
+
+    return os.environ.get('MEMORY_PROFILE', 'False') == 'True'
+
+
+def active():
+    return _boundaries is not None
+
+
+def start():
+    """
+    Start tracing memory allocations for a run, if enabled.
+
+    The number of frames kept for each allocation is set by the
+    MEMORY_FRAMES environment variable, by default 1.
+    """
+
+    global _boundaries, _started
+
+    if not enabled():
+        return
+
+    with _lock:
+        _boundaries = []
+        _started = not tracemalloc.is_tracing()
+        if _started:
+            tracemalloc.start(int(os.environ.get('MEMORY_FRAMES', '1')))
+        tracemalloc.reset_peak()
+
+
+def top_sites(limit=default_top_sites):
+    """
+    List the allocation sites currently holding the most memory
+    """
+
+    snapshot = tracemalloc.take_snapshot().filter_traces(_ignore)
+    key_type = 'traceback' if tracemalloc.get_traceback_limit() > 1 else 'lineno'
+
+    sites = []
+    for stat in snapshot.statistics(key_type)[:limit]:
+        sites.append({
+            'site': [str(frame) for frame in stat.traceback],
+            'bytes': stat.size,
+            'blocks': stat.count,
+        })
+    return sites
+
+
+def record(name):
+    """
+    Record current and peak traced memory at the end of a phase, along with
+    the top allocation sites. The peak is the highest point since the
+    previous boundary, so inner phases reset the peak for outer phases.
+    """
+
+    if _boundaries is None:
+        return
+
+    with _lock:
+        if _boundaries is None:
+            return
+
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+
+        _boundaries.append({
+            'phase': name,
+            'time': time.time(),
+            'current': current,
+            'peak': peak,
+            'top': top_sites(),
+        })
+
+    LOG.info(f"Memory after {name}: {current / 2**20:.1f} MiB, "
+             f"peak {peak / 2**20:.1f} MiB")
+
+
+def finish():
+    """
+    Finish profiling a run started with start(), write the report to the
+    file from the MEMORY_REPORT environment variable (by default under
+    /tmp), and return it. Return None if nothing was profiled.
+
+    Example report:
+    ```
+    peak: 31457280
+    boundaries:
+      - phase: summary
+        time: 1700000000.0
+        current: 10485760
+        peak: 31457280
+        top:
+          - site: ['email_totals/app.py:548']
+            bytes: 4194304
+            blocks: 2
+    ```
+    """
+
+    global _boundaries
+
+    with _lock:
+        if _boundaries is None:
+            return None
+
+        _, peak = tracemalloc.get_traced_memory()
+        boundaries = _boundaries
+        _boundaries = None
+
+        if _started:
+            tracemalloc.stop()
+
+    report = {
+        'peak': max([peak] + [b['peak'] for b in boundaries]),
+        'boundaries': boundaries,
+    }
+
+    path = os.environ.get('MEMORY_REPORT', default_report_file)
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as f:
+            json.dump(report, f, indent=1)
+    except OSError as e:
+        LOG.warning(f"Unable to write memory report: {e}")
+
+    LOG.info(f"Peak traced memory: {report['peak'] / 2**20:.1f} MiB, report: {path}")
+    return report
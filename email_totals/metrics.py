@@ -0,0 +1,183 @@
+import contextlib
+import json
+import logging
+import os
+import threading
+import time
+
+from email_totals import memory
+
+LOG = logging.getLogger(__name__)
+LOG.setLevel(logging.DEBUG)
+
+# CloudWatch namespace for run metrics, see flush()
+default_namespace = 'EmailTotals'
+
+# Units for each metric recorded per phase
+units = {
+    'Duration': 'Milliseconds',
+    'ApiCalls': 'Count',
+    'Retries': 'Count',
+    'BytesReceived': 'Bytes',
+}
+
+# Metrics for the current run, by phase then metric name. None when no run
+# is being recorded, so that recording is skipped with a single check.
+_phases = None
+
+# Stack of active phase names, API calls are counted in the innermost phase
+_active = []
+
+_lock = threading.Lock()
+
+# Shared do-nothing context for phases when disabled
+_disabled = contextlib.nullcontext()
+
+
+def enabled():
+    """
+    Determine if metrics are enabled by the METRICS environment variable
+    """
+
+    return os.environ.get('METRICS', 'True') == 'True'
+
+
+def start():
+    """
+    Start recording metrics for a run, if enabled
+    """
+
+    global _phases
+
+    if not enabled():
+        return
+
+    with _lock:
+        _phases = {}
+        _active.clear()
+
+
+def add(metric, value=1):
+    """
+    Add to a metric in the innermost active phase, safe to call from any
+    thread. Does nothing unless a run is being recorded.
+    """
+
+    if _phases is None:
+        return
+
+    with _lock:
+        if _phases is None or not _active:
+            return
+        counts = _phases.setdefault(_active[-1], {})
+        counts[metric] = counts.get(metric, 0) + value
+
+
+@contextlib.contextmanager
+def _phase(name):
+    with _lock:
+        _active.append(name)
+    start_time = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = (time.perf_counter() - start_time) * 1000
+        with _lock:
+            _active.remove(name)
+            if _phases is not None:
+                counts = _phases.setdefault(name, {})
+                counts['Duration'] = counts.get('Duration', 0) + elapsed
+
+        memory.record(name)
+
+
+def phase(name):
+    """
+    Get a context manager that records the duration of a phase of the run,
+    and counts API calls made while it is the innermost active phase.
+    Phases may nest, the duration of a phase includes its inner phases.
+
+    Phase boundaries are also recorded by the memory profiler when enabled,
+    see memory.record().
+    """
+
+    if _phases is None and not memory.active():
+        return _disabled
+    return _phase(name)
+
+
+def build_document(phases, namespace, function_name):
+    """
+    Build a CloudWatch Embedded Metric Format document with a metric for
+    each phase and metric name, e.g. 'summary.Duration'
+    """
+
+    definitions = []
+    document = {'FunctionName': function_name}
+
+    for name in sorted(phases):
+        for metric, value in sorted(phases[name].items()):
+            key = f"{name}.{metric}"
+            definitions.append({'Name': key, 'Unit': units.get(metric, 'None')})
+            document[key] = round(value, 3)
+
+    document['_aws'] = {
+        'Timestamp': int(time.time() * 1000),
+        'CloudWatchMetrics': [{
+            'Namespace': namespace,
+            'Dimensions': [['FunctionName']],
+            'Metrics': definitions,
+        }],
+    }
+
+    return document
+
+
+def flush():
+    """
+    Finish recording a run started with start(), and write its metrics as a
+    single Embedded Metric Format line to stdout, where CloudWatch Logs
+    extracts them. Return the document, or None if nothing was recorded.
+    """
+
+    global _phases
+
+    with _lock:
+        if _phases is None:
+            return None
+
+        phases = _phases
+        _phases = None
+
+    namespace = os.environ.get('METRICS_NAMESPACE', default_namespace)
+    function_name = os.environ.get('AWS_LAMBDA_FUNCTION_NAME', 'email-totals')
+    document = build_document(phases, namespace, function_name)
+
+    # EMF lines must be plain JSON, bypass the log formatter
+    print(json.dumps(document, separators=(',', ':')), flush=True)
+    return document
+
+
+def _after_call(http_response=None, parsed=None, **kwargs):
+    if _phases is None:
+        return
+
+    add('ApiCalls')
+
+    if parsed:
+        retries = parsed.get('ResponseMetadata', {}).get('RetryAttempts', 0)
+        if retries:
+            add('Retries', retries)
+
+    # Stubbed responses have no raw body
+    if http_response is not None and http_response.raw is not None:
+        add('BytesReceived', len(http_response.content or b''))
+
+
+def instrument(client):
+    """
+    Count API calls, botocore retries and response bytes for a boto3 client
+    in the active phase
+    """
+
+    client.meta.events.register('after-call', _after_call)
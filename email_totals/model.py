@@ -0,0 +1,196 @@
+import math
+import sys
+from array import array
+from collections.abc import ItemsView, Mapping, MutableMapping
+
+# Tables with more rows than this keep an index of account IDs to rows,
+# smaller tables are searched in order, which is faster and uses less memory
+index_after_rows = 8
+
+
+def intern_id(value):
+    """
+    Intern an account ID or email, so that every summary referring to it
+    shares a single string
+    """
+    return sys.intern(value)
+
+
+class Usage(Mapping):
+    """
+    Read-only view of a single row in a UsageTable, with the same shape as
+    the original usage dictionary: a 'total' key, and a 'change' key if
+    there was a total to compare against. A view is only valid until a row
+    is removed from its table.
+    """
+
+    __slots__ = ('_table', '_row')
+
+    def __init__(self, table, row):
+        self._table = table
+        self._row = row
+
+    def __getitem__(self, key):
+        if key == 'total':
+            return self._table.totals[self._row]
+        if key == 'change':
+            change = self._table.changes[self._row]
+            if not math.isnan(change):
+                return change
+        raise KeyError(key)
+
+    def __contains__(self, key):
+        if key == 'change':
+            return not math.isnan(self._table.changes[self._row])
+        return key == 'total'
+
+    def __iter__(self):
+        yield 'total'
+        if 'change' in self:
+            yield 'change'
+
+    def __len__(self):
+        return 2 if 'change' in self else 1
+
+    def __repr__(self):
+        return repr(dict(self))
+
+
+class _UsageItems(ItemsView):
+    """
+    Iterate over table rows directly rather than looking up each account
+    """
+
+    def __iter__(self):
+        table = self._mapping
+        for row, account_id in enumerate(table.ids):
+            yield account_id, Usage(table, row)
+
+
+class UsageTable(MutableMapping):
+    """
+    Compact table of account usage, mapping account IDs to a total and an
+    optional month-over-month change. Rows are stored in parallel arrays of
+    interned account IDs, totals, and changes (NaN if there is no change),
+    rather than a dictionary per account.
+
+    Behaves like the original usage dictionary:
+    ```
+    111122223333:
+        total: 10.0
+    222233334444:
+        total: 20.0
+        change: 0.5
+    ```
+    """
+
+    __slots__ = ('ids', 'totals', 'changes', '_index')
+
+    def __init__(self, usage=None):
+        self.ids = []
+        self.totals = array('d')
+        self.changes = array('d')
+        self._index = None
+
+        if usage is not None:
+            for account_id, entry in usage.items():
+                self[account_id] = entry
+
+    def add(self, account_id, total, change=None):
+        """
+        Add a row for an account that is not already in the table
+        """
+
+        self.ids.append(intern_id(account_id))
+        self.totals.append(total)
+        self.changes.append(math.nan if change is None else change)
+        if self._index is not None:
+            self._index[self.ids[-1]] = len(self.ids) - 1
+
+    def rows(self):
+        """
+        Iterate over rows as tuples of account ID, total, and change (or None)
+        """
+
+        for account_id, total, change in zip(self.ids, self.totals, self.changes):
+            yield account_id, total, None if math.isnan(change) else change
+
+    def _find(self, account_id):
+        if len(self.ids) <= index_after_rows:
+            try:
+                return self.ids.index(account_id)
+            except ValueError:
+                raise KeyError(account_id) from None
+
+        if self._index is None:
+            self._index = {a: row for row, a in enumerate(self.ids)}
+
+        return self._index[account_id]
+
+    def __getitem__(self, account_id):
+        return Usage(self, self._find(account_id))
+
+    def __setitem__(self, account_id, entry):
+        total = entry['total']
+        change = entry.get('change')
+
+        try:
+            row = self._find(account_id)
+        except KeyError:
+            self.add(account_id, total, change)
+            return
+
+        self.totals[row] = total
+        self.changes[row] = math.nan if change is None else change
+
+    def __delitem__(self, account_id):
+        row = self._find(account_id)
+        del self.ids[row]
+        del self.totals[row]
+        del self.changes[row]
+        self._index = None
+
+    def __contains__(self, account_id):
+        try:
+            self._find(account_id)
+        except KeyError:
+            return False
+        return True
+
+    def __iter__(self):
+        return iter(self.ids)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def items(self):
+        return _UsageItems(self)
+
+    def to_dict(self):
+        """
+        Convert to the original usage dictionary
+        """
+
+        output = {}
+        for account_id, total, change in self.rows():
+            output[account_id] = {'total': total}
+            if change is not None:
+                output[account_id]['change'] = change
+        return output
+
+    def __repr__(self):
+        return repr(self.to_dict())
+
+
+def iter_usage(usage):
+    """
+    Iterate over rows of a usage table or dictionary as tuples of account
+    ID, total, and change (or None)
+    """
+
+    if isinstance(usage, UsageTable):
+        yield from usage.rows()
+        return
+
+    for account_id, entry in usage.items():
+        yield account_id, entry['total'], entry.get('change')
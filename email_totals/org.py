@@ -1,18 +1,132 @@
 import logging
+import os
+import time
 
-import boto3
+from email_totals import cache, clients, workers
 
 LOG = logging.getLogger(__name__)
 LOG.setLevel(logging.DEBUG)
 
-# Create organizations client for getting account tags
-org_client = boto3.client('organizations')
+# Use adaptive mode so that concurrent tag lookups back off based on the
+# rate of TooManyRequestsException responses
+org_retries = {
+    'mode': 'adaptive',  # default mode is legacy
+}
 
 # Name of the account tag containing an account owner
 account_owner_tag = 'AccountOwner'
 
+# Organizations throttles at a few requests per second per account,
+# so only a handful of concurrent tag lookups are useful
+default_max_workers = 4
 
-def get_account_owners():
+# Account metadata is cached under this name, see load_account_cache()
+account_cache_name = 'accounts'
+
+# Account owners and names rarely change, by default cache them for a day
+default_account_cache_ttl = 86400
+
+
+def get_org_client():
+    """
+    Get the shared organizations client for getting account tags, creating
+    it on first use
+    """
+
+    return clients.get_boto_client('organizations', org_retries)
+
+
+def get_account_owner(account_id):
+    """
+    Get the account owner tag for a single account, or None if the account
+    is not tagged with an owner
+    """
+
+    tag_pager = get_org_client().get_paginator('list_tags_for_resource')
+    tag_pages = tag_pager.paginate(ResourceId=account_id)
+
+    for tag_page in tag_pages:
+        for tag in tag_page['Tags']:
+            if tag['Key'] == account_owner_tag:
+                # stop processing tags and tag pages for this account
+                return tag['Value']
+
+    return None
+
+
+def load_account_cache():
+    """
+    Load the account metadata cache, with the structure:
+    ```
+    listed: 1700000000.0
+    accounts:
+        111122223333:
+            name: account-one
+            owner: owner1@example.com
+            fetched: 1700000000.0
+    ```
+
+    Where 'listed' is when the list of accounts was last fetched, and
+    'fetched' is when the owner tag for each account was last fetched.
+    """
+
+    data = cache.load(account_cache_name)
+    if data is None:
+        data = {'listed': None, 'accounts': {}}
+    return data
+
+
+def get_account_names():
+    """
+    Get a mapping of account IDs to account names from the account cache
+    """
+
+    accounts = load_account_cache()['accounts']
+    return {a: accounts[a]['name'] for a in accounts if accounts[a]['name']}
+
+
+def update_account_names(account_names):
+    """
+    Update account names in the account cache, e.g. from cost explorer
+    dimension attributes
+    """
+
+    data = load_account_cache()
+    changed = False
+
+    for account_id, name in account_names.items():
+        entry = data['accounts'].get(account_id)
+        if entry is not None and entry['name'] != name:
+            entry['name'] = name
+            changed = True
+
+    if changed:
+        cache.store(account_cache_name, data)
+
+
+def _refresh_account_list(data):
+    """
+    Fetch the list of accounts in the organization into the account cache,
+    keeping cached owners for known accounts and dropping removed accounts
+    """
+
+    accounts = {}
+
+    # paginate list of accounts
+    account_pages = get_org_client().get_paginator('list_accounts').paginate()
+    for account_page in account_pages:
+        for account in account_page['Accounts']:
+            account_id = account['Id']
+
+            entry = data['accounts'].get(account_id, {'owner': None, 'fetched': None})
+            entry['name'] = account.get('Name')
+            accounts[account_id] = entry
+
+    data['accounts'] = accounts
+    data['listed'] = time.time()
+
+
+def get_account_owners(max_workers=None):
     """
     Get account owner tags from organizations client and return a mapping
     of owners to accounts:
@@ -23,38 +137,51 @@ def get_account_owners():
     owner2@example.com:
         - 333344445555
     ```
+
+    Account tags are looked up concurrently, using up to `max_workers`
+    threads (by default from the ORG_CONCURRENCY environment variable).
+
+    Account metadata is cached with a time-to-live from the ACCOUNT_CACHE_TTL
+    environment variable, in seconds. The list of accounts is only fetched
+    when stale, and then only accounts with stale or missing owners are
+    looked up again. A time-to-live of 0 disables caching.
     """
 
-    account_owners = {}
+    if max_workers is None:
+        max_workers = int(os.environ.get('ORG_CONCURRENCY', default_max_workers))
 
-    # paginate list of accounts
-    account_pages = org_client.get_paginator('list_accounts').paginate()
+    ttl = int(os.environ.get('ACCOUNT_CACHE_TTL', default_account_cache_ttl))
 
-    # check for tags on each account
-    for account_page in account_pages:
-        for account in account_page['Accounts']:
-            account_id = account['Id']
+    data = load_account_cache()
 
-            tag_pager = org_client.get_paginator('list_tags_for_resource')
-            tag_pages = tag_pager.paginate(ResourceId=account_id)
+    if not cache.is_fresh(data['listed'], ttl):
+        _refresh_account_list(data)
 
-            owner = None
-            for tag_page in tag_pages:
-                for tag in tag_page['Tags']:
-                    if tag['Key'] == account_owner_tag:
-                        owner = tag['Value']
+    # check for tags on each account that isn't cached
+    accounts = data['accounts']
+    stale = [a for a in accounts if not cache.is_fresh(accounts[a]['fetched'], ttl)]
+    LOG.info(f"Looking up owners for {len(stale)} of {len(accounts)} accounts")
 
-                        if owner not in account_owners:
-                            account_owners[owner] = []
+    owners = workers.map_bounded(get_account_owner, stale, max_workers)
 
-                        account_owners[owner].append(account_id)
+    now = time.time()
+    for account_id, owner in zip(stale, owners):
+        accounts[account_id]['owner'] = owner
+        accounts[account_id]['fetched'] = now
+
+    if ttl > 0:
+        cache.store(account_cache_name, data)
+
+    account_owners = {}
+    for account_id in accounts:
+        owner = accounts[account_id]['owner']
+        if owner is None:
+            continue
 
-                        # stop processing tags for this page
-                        break
+        if owner not in account_owners:
+            account_owners[owner] = []
 
-                if owner is not None:
-                    # stop processing tag pages for this account
-                    break
+        account_owners[owner].append(account_id)
 
     LOG.debug(account_owners)
     return account_owners
@@ -0,0 +1,248 @@
+import functools
+import json
+import logging
+
+from email_totals import model
+
+LOG = logging.getLogger(__name__)
+LOG.setLevel(logging.DEBUG)
+
+# Static text used in user reports
+user_title = 'AWS Monthly Cost Report Summary'
+user_intro = ('You are receiving this summary because you are tagged as '
+              'the owner of AWS resources.')
+
+accounts_descr = 'You are tagged as owning the following accounts:'
+resources_descr = ('You are tagged as owning resources in the following '
+                   'accounts: ')
+
+tags_descr_missing = ('Some of the above resources have a "CostCenter" tag '
+                      'value of "Other / 000001" but do not have a required '
+                      '"CostCenterOther" tag. ')
+tags_descr_invalid = ('Some of the above resources have a "CostCenterOther" '
+                      'tag, but do not have "CostCenter" set to "Other / 000001". ')
+tags_descr_help = ('To accurately track project-related costs, a cost center must '
+                   'be specified. If you need help updating tags, contact Sage IT.')
+
+docs_prose = ('You can use AWS Cost Explorer to analyze these expenses by '
+              'filtering on the "Owner Email" category and/or account ID')
+docs_name = 'Using AWS Cost Explorer'
+docs_url = 'https://sagebionetworks.jira.com/wiki/spaces/IT/pages/2756935685/Using+AWS+Cost+Explorer'
+
+# Static text used in the unowned report
+unowned_title = 'AWS Monthly Unowned Cost Summary'
+unowned_prose = 'The following costs do not have a tagged owner to notify:'
+
+# Alternating table row background colors, by row index modulo 2
+row_styles = ("style='background-color: WhiteSmoke;'", "")
+
+# Put paragraphs in an invisible table to wrap long lines; give the table a
+# single row with two cells, put the text in the first cell and let the
+# second cell fill any extra space
+_paragraph_open = ("<table border='0' width='100%' "
+                   "style='border-collapse: collapse;'><tr>"
+                   "<td width='600'>")
+_paragraph_close = "</td><td></td></tr></table>"
+
+_table_open = ("<table border='1' padding='10' width='600' "
+               "style='border-collapse: collapse; text-align: center;'>"
+               "<tr style='background-color: LightSteelBlue'>"
+               "<th>Account Name (Account ID)</th>")
+_table_close = "</table><br/>"
+
+
+def row_style(i):
+    """
+    Alternating table row background colors
+    """
+    return row_styles[i % 2]
+
+
+@functools.lru_cache(maxsize=None)
+def usage_layout(total):
+    """
+    Compile the static headers and footers of a usage table, once per process
+    for each total column header. Return a tuple of HTML header, HTML footer,
+    text header, and text footer.
+    """
+
+    html_header = f"{_table_open}<th>{total}</th><th>Month-over-Month Change</th></tr>"
+    text_header = '\t'.join(['Account Name (Account ID)', total, 'Month-over-Month Change']) + '\n'
+    return html_header, _table_close, text_header, ''
+
+
+@functools.lru_cache(maxsize=None)
+def tags_layout(missing, invalid):
+    """
+    Compile the static headers and footers of a tags table, once per process
+    for each combination of missing and invalid tag columns. Return a tuple
+    of HTML header, HTML footer, text header, and text footer.
+    """
+
+    html_header = _table_open
+    text_header = 'Account Name (Account ID)'
+    if missing:
+        html_header += "<th>Resources missing CostCenterOther tags</th>"
+        text_header += '\tResources missing CostCenterOther tags'
+    if invalid:
+        html_header += "<th>Resources with unexpected CostCenterOther tags</th></tr>"
+        text_header += '\tResources with unexpected CostCenterOther tags'
+
+    return html_header, _table_close, text_header + '\n', ''
+
+
+def format_amounts(total, change=None):
+    """
+    Format a total and month-over-month change (or None), shared by all
+    output formats
+    """
+
+    # Round dollar total to 2 decimal places, and convert change to a
+    # percentage
+    return f"${total:.2f}", '' if change is None else f"{change:.2%}"
+
+
+def write_paragraph(html_out, text_out, text):
+    """
+    Append a paragraph of text to lists of HTML and plain-text fragments
+    """
+
+    html_out.extend((_paragraph_open, text, _paragraph_close))
+    text_out.extend((text, '\n'))
+
+
+def write_usage_table(html_out, text_out, usage, account_names, total=None):
+    """
+    Append a table of account usage to lists of HTML and plain-text
+    fragments, formatting each row once for both
+
+    Example usage block:
+    ```
+    111122223333:
+        total: 10.0
+    222233334444:
+        total: 20.0
+        change: 0.5
+    ```
+    """
+
+    # customize total header in unowned report
+    if total is None:
+        total = 'Your Total'
+
+    html_header, html_footer, text_header, text_footer = usage_layout(total)
+    html_out.append(html_header)
+    text_out.append(text_header)
+
+    for i, (account_id, total, change) in enumerate(model.iter_usage(usage)):
+        account_name = account_names[account_id]
+        amount, change = format_amounts(total, change)
+
+        html_out.append(f"<tr {row_styles[i % 2]}><td>{account_name} ({account_id})</td>"
+                        f"<td>{amount}</td><td>{change}</td></tr>")
+        text_out.append(f"{account_name}\t{account_id}\t{amount}\t{change}\n")
+
+    html_out.append(html_footer)
+    text_out.append(text_footer)
+
+
+def write_tags_table(html_out, text_out, missing, invalid, account_names):
+    """
+    Append a table about missing or invalid CostCenterOther tags to lists of
+    HTML and plain-text fragments, formatting each row once for both
+    """
+
+    html_header, html_footer, text_header, text_footer = tags_layout(bool(missing), bool(invalid))
+    html_out.append(html_header)
+    text_out.append(text_header)
+
+    accounts = list(missing) + list(invalid)
+    LOG.debug(f"Accounts: {accounts}")
+
+    for i, account_id in enumerate(accounts):
+        cells = [f"{account_names[account_id]} ({account_id})"]
+
+        # Convert list to string
+        if missing:
+            cells.append(json.dumps(missing[account_id]) if account_id in missing else '')
+        if invalid:
+            cells.append(json.dumps(invalid[account_id]) if account_id in invalid else '')
+
+        html_out.append(f"<tr {row_styles[i % 2]}><td>" + "</td><td>".join(cells) + "</td></tr>")
+        text_out.append('\t'.join(cells) + '\n')
+
+    html_out.append(html_footer)
+    text_out.append(text_footer)
+
+
+def owned_resources(summary):
+    """
+    Get the resource usage for a user summary entry, omitting any resources
+    that are in accounts owned by the user
+    """
+
+    resources = summary.get('resources') or {}
+    accounts = summary.get('accounts') or {}
+    if not accounts:
+        return resources
+
+    return {a: resources[a] for a in resources if a not in accounts}
+
+
+def user_report(summary, account_names):
+    """
+    Render the HTML and plain-text report bodies for a user summary entry in
+    a single pass over the summary, and return them as a tuple. The summary
+    entry is not modified.
+    """
+
+    html_out = [f"<h3>{user_title}</h3>", _paragraph_open, f"<p>{user_intro}</p>", _paragraph_close]
+    text_out = [f"{user_title}\n{user_intro}\n"]
+
+    # Don't report resources if we also own the account
+    resources = owned_resources(summary)
+    if resources:
+        write_paragraph(html_out, text_out, resources_descr)
+        write_usage_table(html_out, text_out, resources, account_names)
+
+    if 'accounts' in summary:
+        write_paragraph(html_out, text_out, accounts_descr)
+        write_usage_table(html_out, text_out, summary['accounts'], account_names, 'Account Total')
+
+    missing = summary.get('missing_other_tag', {})
+    invalid = summary.get('invalid_other_tag', {})
+
+    if missing or invalid:
+        descr = ''
+        if missing:
+            descr += tags_descr_missing
+        if invalid:
+            descr += tags_descr_invalid
+        descr += tags_descr_help
+
+        write_paragraph(html_out, text_out, descr)
+        write_tags_table(html_out, text_out, missing, invalid, account_names)
+    else:
+        LOG.debug("Skipping CostCenterOther section")
+
+    html_out.extend((_paragraph_open,
+                     f"{docs_prose}: <a href='{docs_url}'>{docs_name}</a>",
+                     _paragraph_close))
+    text_out.append(f"\n{docs_prose}. See '{docs_name}' at: {docs_url}")
+
+    return ''.join(html_out), ''.join(text_out)
+
+
+def unowned_report(unowned_data, account_names):
+    """
+    Render the HTML and plain-text report bodies summarizing unowned costs
+    in a single pass, and return them as a tuple
+    """
+
+    html_out = [f"<h3>{unowned_title}</h3>"]
+    text_out = [f"{unowned_title}\n\n"]
+
+    write_paragraph(html_out, text_out, unowned_prose)
+    write_usage_table(html_out, text_out, unowned_data, account_names, 'Unowned Costs')
+
+    return ''.join(html_out), ''.join(text_out)
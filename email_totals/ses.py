@@ -3,10 +3,10 @@ import logging
 import os
 import time
 
-import boto3
-from botocore.config import Config as BotoConfig
 from botocore.exceptions import ClientError
 
+from email_totals import clients, deadline, model, render, workers
+
 LOG = logging.getLogger(__name__)
 LOG.setLevel(logging.DEBUG)
 
@@ -16,167 +16,59 @@ synapse_email = '@synapse.org'
 
 # Use standard mode in order to retry on RequestLimitExceeded
 # and increase the default number of retries to 10
-ses_config = BotoConfig(
-    retries = {
-        'mode': 'standard',  # default mode is legacy
-        'max_attempts': 10,  # default for standard mode is 3
-    }
-)
-ses_client = boto3.client('ses', config=ses_config)
+ses_retries = {
+    'mode': 'standard',  # default mode is legacy
+    'max_attempts': 10,  # default for standard mode is 3
+}
 
 
-def _table_row_style(i):
-    """
-    Alternating table row background colors
-    """
-    if i % 2 == 0:
-        return "style='background-color: WhiteSmoke;'"
-    else:
-        return ""
+# Name of the SES template used for bulk sending user reports
+report_template_name = 'email-totals-user-report'
 
+# SendBulkTemplatedEmail accepts at most 50 destinations per call
+bulk_batch_size = 50
 
-def build_paragraph(text, html=False):
-    output = ''
+# Set once the report template has been created or updated in this process
+_report_template_ready = False
 
-    if html:
-        # Put the paragraph in an invisible table to wrap long lines;
-        # give the table a single row with two cells, put the text in
-        # the first cell and let the second cell fill any extra space
-        output += ("<table border='0' width='100%' "
-                   "style='border-collapse: collapse;'><tr>"
-                   f"<td width='600'>{text}</td><td></td>"
-                   "</tr></table>")
-    else:
-        output += text + '\n'
+# Default number of concurrent senders, sends are also paced to the
+# account's maximum send rate
+default_send_concurrency = 4
 
-    return output
 
-
-def build_tags_table(missing, invalid, account_names, html=False):
+def get_ses_client():
     """
-    Build a table about missing or invalid CostCenterOther tags
+    Get the shared SES client, creating it on first use
     """
-    output = ''
-    row_i = 0  # row index for coloring table rows
-
-    if html:
-        output += ("<table border='1' padding='10' width='600' "
-                   "style='border-collapse: collapse; text-align: center;'>"
-                   "<tr style='background-color: LightSteelBlue'>"
-                   "<th>Account Name (Account ID)</th>")
-        if missing:
-            output += "<th>Resources missing CostCenterOther tags</th>"
-        if invalid:
-            output += "<th>Resources with unexpected CostCenterOther tags</th></tr>"
-    else:
-        output += 'Account Name (Account ID)'
-        if missing:
-            output += '\tResources missing CostCenterOther tags'
-        if invalid:
-            output += '\tResources with unexpected CostCenterOther tags'
-        output += '\n'
-
-    accounts = []
-    for account_id in missing:
-        accounts.append(account_id)
-    for account_id in invalid:
-        accounts.append(account_id)
-    LOG.debug(f"Accounts: {accounts}")
-
-    for account_id in accounts:
-        account_name = account_names[account_id]
-
-        # Convert list to string
-        untagged = ''
-        if account_id in missing:
-            untagged = json.dumps(missing[account_id])
-        unexpected = ''
-        if account_id in invalid:
-            unexpected = json.dumps(invalid[account_id])
-
-        if html:
-            _td = f"<td>{account_name} ({account_id})</td>"
-            if missing:
-                _td += f"<td>{untagged}</td>"
-            if invalid:
-                _td += f"<td>{unexpected}</td>"
-
-            _style = _table_row_style(row_i)
-            output += f"<tr {_style}>{_td}</tr>"
-            row_i += 1
-
-        else:
-            _td = f"{account_name} ({account_id})"
-            if missing:
-                _td += f"\t{untagged}"
-            if invalid:
-                _td += f"\t{unexpected}"
-            output += f"{_td}\n"
-
-    if html:
-        output += "</table><br/>"
 
-    return output
+    return clients.get_boto_client('ses', ses_retries)
 
 
-def build_usage_table(usage, account_names, total=None, html=False):
+def _render(writer, html, *args):
     """
-    Build table about directly-tagged resources
-
-    Example usage block:
-    ```
-    111122223333:
-        total: 10.0
-    222233334444:
-        total: 20.0
-        change: 0.5
-    ```
+    Call a render writer function and join the fragments for one format
     """
+    html_out, text_out = [], []
+    writer(html_out, text_out, *args)
+    return ''.join(html_out if html else text_out)
 
-    output = ''
 
-    # customize total header in unowned report
-    if total is None:
-        total = 'Your Total'
-
-    if html:
-        output += ("<table border='1' padding='10' width='600' "
-                   "style='border-collapse: collapse; text-align: center;'>"
-                   "<tr style='background-color: LightSteelBlue'>"
-                   "<th>Account Name (Account ID)</th>"
-                   f"<th>{total}</th><th>Month-over-Month Change</th></tr>")
-        row_i = 0  # row index for coloring table rows
-    else:
-        output += '\t'.join(['Account Name (Account ID)',
-                             total, 'Month-over-Month Change']) + '\n'
-
-    for account_id in usage:
-        account_name = account_names[account_id]
-
-        # Round dollar total to 2 decimal places
-        total = f"${usage[account_id]['total']:.2f}"
-
-        change = ''
-        if 'change' in usage[account_id]:
-            # Convert to a percentage
-            change = f"{usage[account_id]['change']:.2%}"
-
-        if html:
-            _td = (f"<td>{account_name} ({account_id})</td>"
-                   f"<td>{total}</td><td>{change}</td>")
+def build_paragraph(text, html=False):
+    return _render(render.write_paragraph, html, text)
 
-            _style = _table_row_style(row_i)
-            output += f"<tr {_style}>{_td}</tr>"
-            row_i += 1
 
-        else:
-            _td = [account_name, account_id, total, change]
-            output += '\t'.join(_td) + '\n'
+def build_tags_table(missing, invalid, account_names, html=False):
+    """
+    Build a table about missing or invalid CostCenterOther tags
+    """
+    return _render(render.write_tags_table, html, missing, invalid, account_names)
 
-    if html:
-        output += "</table><br/>"
 
-    return output
+def build_usage_table(usage, account_names, total=None, html=False):
+    """
+    Build table about directly-tagged resources, see render.write_usage_table()
+    """
+    return _render(render.write_usage_table, html, usage, account_names, total)
 
 
 def valid_recipient(email, team_sage):
@@ -223,146 +115,7 @@ def build_user_email_body(summary, account_names):
     Generate an HTML and a plain-text message body for a user summary entry
     """
 
-    def _build_accounts_usage(usage, html=False):
-        """
-        Build paragraph about owned accounts
-
-        Example usage block:
-        ```
-        333344445555:
-            total: 200.0
-            change: -0.05
-        444455556666:
-            total: 1.0
-        ```
-        """
-
-        output = ''
-
-        descr = 'You are tagged as owning the following accounts:'
-
-        output += build_paragraph(descr, html)
-        output += build_usage_table(usage, account_names, total='Account Total', html=html)
-
-        return output
-
-    def _build_resource_usage(resource_usage, account_usage=None, html=False):
-        """
-        Build paragraph about directly-tagged resources, omitting any resources
-        that are in accounts owned by the user.
-
-        Example usage block:
-        ```
-        111122223333:
-            total: 10.0
-        222233334444:
-            total: 20.0
-            change: 0.5
-        ```
-        """
-
-        output = ''
-
-        descr = ('You are tagged as owning resources in the following '
-                 'accounts: ')
-
-        # Don't report resources if we also own the account
-        if account_usage is not None:
-            for account_id in account_usage:
-                if account_id in resource_usage:
-                    del resource_usage[account_id]
-
-        # Only generate output if we still have resource usage
-        if resource_usage:
-            output += build_paragraph(descr, html)
-            output += build_usage_table(resource_usage, account_names, html=html)
-
-        return output
-
-    def _build_tags(missing, invalid, html=False):
-        """
-        Build paragraph about missing or invalid CostCenterOther tags
-
-        Example input block:
-        ```
-        111122223333:
-            - i-0abcdefg
-        333344445555:
-            - i-1hijklmnop
-        ```
-        """
-
-        descr_missing = ('Some of the above resources have a "CostCenter" tag '
-                         'value of "Other / 000001" but do not have a required '
-                         '"CostCenterOther" tag. ')
-
-        descr_invalid = ('Some of the above resources have a "CostCenterOther" '
-                         'tag, but do not have "CostCenter" set to "Other / 000001". ')
-
-        descr_help = ('To accurately track project-related costs, a cost center must '
-                      'be specified. If you need help updating tags, contact Sage IT.')
-        descr = ''
-        if missing:
-            descr += descr_missing
-        if invalid:
-            descr += descr_invalid
-        descr += descr_help
-
-        output = ''
-        output += build_paragraph(descr, html)
-        output += build_tags_table(missing, invalid, account_names, html)
-
-        return output
-
-    title = 'AWS Monthly Cost Report Summary'
-    intro = ('You are receiving this summary because you are tagged as '
-             'the owner of AWS resources.')
-
-    html_body = f"<h3>{title}</h3>"
-    html_body += build_paragraph(f"<p>{intro}</p>", True)
-
-    text_body = f"{title}\n{intro}\n"
-
-    if 'resources' in summary and summary['resources']:
-        if 'accounts' in summary and summary['accounts']:
-            html_body += _build_resource_usage(summary['resources'],
-                                               summary['accounts'],
-                                               html=True)
-            text_body += _build_resource_usage(summary['resources'],
-                                               summary['accounts'],
-                                               html=False)
-        else:
-            html_body += _build_resource_usage(summary['resources'],
-                                               html=True)
-            text_body += _build_resource_usage(summary['resources'],
-                                               html=False)
-
-    if 'accounts' in summary:
-        html_body += _build_accounts_usage(summary['accounts'], True)
-        text_body += _build_accounts_usage(summary['accounts'], False)
-
-    invalid_summary = {}
-    missing_summary = {}
-    if 'missing_other_tag' in summary:
-        missing_summary = summary['missing_other_tag']
-        LOG.debug(f"Missing CostCenterOther: {missing_summary}")
-    if 'invalid_other_tag' in summary:
-        invalid_summary = summary['invalid_other_tag']
-        LOG.debug(f"Unexpected CostCenterOther: {invalid_summary}")
-
-    if invalid_summary or missing_summary:
-        html_body += _build_tags(missing_summary, invalid_summary, True)
-        text_body += _build_tags(missing_summary, invalid_summary, False)
-    else:
-        LOG.debug("Skipping CostCenterOther section")
-
-    docs_prose = ('You can use AWS Cost Explorer to analyze these expenses by '
-                  'filtering on the "Owner Email" category and/or account ID')
-    docs_name = 'Using AWS Cost Explorer'
-    docs_url = 'https://sagebionetworks.jira.com/wiki/spaces/IT/pages/2756935685/Using+AWS+Cost+Explorer'
-
-    html_body += build_paragraph(f"{docs_prose}: <a href='{docs_url}'>{docs_name}</a>", True)
-    text_body += f"\n{docs_prose}. See '{docs_name}' at: {docs_url}"
+    html_body, text_body = render.user_report(summary, account_names)
 
     LOG.debug(html_body)
     LOG.debug(text_body)
@@ -374,28 +127,271 @@ def build_unowned_email_body(unowned_data, account_names):
     Generate an email body summarizing unowned costs
     """
 
-    title = 'AWS Monthly Unowned Cost Summary'
-    prose = 'The following costs do not have a tagged owner to notify:'
+    html_body, text_body = render.unowned_report(unowned_data, account_names)
+
+    LOG.debug(html_body)
+    LOG.debug(text_body)
+    return html_body, text_body
+
+
+def _build_report_template():
+    """
+    Build an SES template for user reports with the same layout as
+    build_user_email_body(), using Handlebars placeholders for the per-user
+    table data generated by build_report_template_data().
+    """
+
+    def _usage_table(key, total, html):
+        # An empty usage table gives us the header and footer
+        table = build_usage_table({}, {}, total=total, html=html)
+
+        if html:
+            rows = ("{{#each " + key + "}}<tr {{{style}}}>"
+                    "<td>{{{name}}} ({{{id}}})</td>"
+                    "<td>{{{total}}}</td><td>{{{change}}}</td>"
+                    "</tr>{{/each}}")
+            footer = "</table><br/>"
+            return table[:-len(footer)] + rows + footer
+
+        rows = ("{{#each " + key + "}}"
+                "{{{name}}}\t{{{id}}}\t{{{total}}}\t{{{change}}}\n"
+                "{{/each}}")
+        return table + rows
+
+    def _tags_table(html):
+        if html:
+            return ("<table border='1' padding='10' width='600' "
+                    "style='border-collapse: collapse; text-align: center;'>"
+                    "<tr style='background-color: LightSteelBlue'>"
+                    "<th>Account Name (Account ID)</th>"
+                    "{{#if tags_missing}}<th>Resources missing CostCenterOther tags</th>{{/if}}"
+                    "{{#if tags_invalid}}<th>Resources with unexpected CostCenterOther tags"
+                    "</th></tr>{{/if}}"
+                    "{{#each tags}}<tr {{{style}}}><td>{{{name}}} ({{{id}}})</td>"
+                    "{{#if ../tags_missing}}<td>{{{missing}}}</td>{{/if}}"
+                    "{{#if ../tags_invalid}}<td>{{{invalid}}}</td>{{/if}}"
+                    "</tr>{{/each}}</table><br/>")
+
+        return ("Account Name (Account ID)"
+                "{{#if tags_missing}}\tResources missing CostCenterOther tags{{/if}}"
+                "{{#if tags_invalid}}\tResources with unexpected CostCenterOther tags{{/if}}"
+                "\n{{#each tags}}{{{name}}} ({{{id}}})"
+                "{{#if ../tags_missing}}\t{{{missing}}}{{/if}}"
+                "{{#if ../tags_invalid}}\t{{{invalid}}}{{/if}}"
+                "\n{{/each}}")
+
+    tags_descr = ("{{#if tags_missing}}" + render.tags_descr_missing + "{{/if}}"
+                  "{{#if tags_invalid}}" + render.tags_descr_invalid + "{{/if}}" +
+                  render.tags_descr_help)
+
+    def _body(html):
+        if html:
+            body = f"<h3>{render.user_title}</h3>"
+            body += build_paragraph(f"<p>{render.user_intro}</p>", True)
+        else:
+            body = f"{render.user_title}\n{render.user_intro}\n"
+
+        body += "{{#if resources}}"
+        body += build_paragraph(render.resources_descr, html)
+        body += _usage_table('resources', 'Your Total', html)
+        body += "{{/if}}{{#if accounts}}"
+        body += build_paragraph(render.accounts_descr, html)
+        body += _usage_table('accounts', 'Account Total', html)
+        body += "{{/if}}{{#if tags}}"
+        body += build_paragraph(tags_descr, html)
+        body += _tags_table(html)
+        body += "{{/if}}"
 
-    html_body = f"<h3>{title}</h3>"
-    text_body = f"{title}\n\n"
+        if html:
+            docs_link = f"<a href='{render.docs_url}'>{render.docs_name}</a>"
+            body += build_paragraph(f"{render.docs_prose}: {docs_link}", True)
+        else:
+            body += f"\n{render.docs_prose}. See '{render.docs_name}' at: {render.docs_url}"
 
-    html_body += build_paragraph(prose, True)
-    text_body += build_paragraph(prose, False)
+        return body
 
-    html_body += build_usage_table(unowned_data,
-                                   account_names,
-                                   'Unowned Costs',
-                                   True)
+    return {
+        'TemplateName': report_template_name,
+        'SubjectPart': "AWS Monthly Cost Report ({{period}})",
+        'HtmlPart': _body(True),
+        'TextPart': _body(False),
+    }
 
-    text_body += build_usage_table(unowned_data,
-                                   account_names,
-                                   'Unowned Costs',
-                                   False)
 
-    LOG.debug(html_body)
-    LOG.debug(text_body)
-    return html_body, text_body
+def build_report_template_data(summary, account_names, period):
+    """
+    Generate the replacement data for the user report template from a user
+    summary entry, containing only the per-user table rows
+    """
+
+    def _usage_rows(usage):
+        rows = []
+        for i, (account_id, total, change) in enumerate(model.iter_usage(usage)):
+            total, change = render.format_amounts(total, change)
+
+            rows.append({
+                'name': account_names[account_id],
+                'id': account_id,
+                'total': total,
+                'change': change,
+                'style': render.row_style(i),
+            })
+        return rows
+
+    accounts = summary.get('accounts', {})
+
+    # Don't report resources if we also own the account
+    resources = render.owned_resources(summary)
+
+    missing = summary.get('missing_other_tag', {})
+    invalid = summary.get('invalid_other_tag', {})
+
+    tags = []
+    for i, account_id in enumerate(list(missing) + list(invalid)):
+        tags.append({
+            'name': account_names[account_id],
+            'id': account_id,
+            'missing': json.dumps(missing[account_id]) if account_id in missing else '',
+            'invalid': json.dumps(invalid[account_id]) if account_id in invalid else '',
+            'style': render.row_style(i),
+        })
+
+    return {
+        'period': period,
+        'resources': _usage_rows(resources),
+        'accounts': _usage_rows(accounts),
+        'tags': tags,
+        'tags_missing': bool(missing),
+        'tags_invalid': bool(invalid),
+    }
+
+
+def ensure_report_template():
+    """
+    Create or update the SES template for user reports, once per process
+    """
+
+    global _report_template_ready
+    if _report_template_ready:
+        return
+
+    template = _build_report_template()
+    ses_client = get_ses_client()
+
+    try:
+        ses_client.update_template(Template=template)
+    except ClientError as e:
+        if e.response['Error']['Code'] != 'TemplateDoesNotExist':
+            raise
+        ses_client.create_template(Template=template)
+
+    LOG.info(f"SES template ready: {report_template_name}")
+    _report_template_ready = True
+
+
+def send_bulk_report_emails(per_user, account_names, period, on_result=None, rate_share=1.0):
+    """
+    Send per-user reports in batches through the SES report template, passing
+    only per-user table data for each recipient. Any recipient that could not
+    be sent this way falls back to a separate send_report_email() call.
+
+    Like report_sender(), sends are paced with a token bucket to the account's
+    SES maximum send rate, or `rate_share` of it, counting every destination
+    address in a batch.
+
+    Return a list of per-recipient results like report_sender(), in the order
+    they were sent. If given, `on_result` is called with each result as soon
+    as it is known. The run deadline is checked before each batch and again
+    after waiting for the send rate, once it has passed no more batches are
+    sent, and the remaining recipients have pending results.
+    """
+
+    sender = os.environ['SENDER']
+    recipients = list(per_user)
+    failed = []
+    results = []
+
+    def _result(recipient, message_id, error=None):
+        if message_id is None:
+            result = {'recipient': recipient, 'status': 'failed', 'error': error}
+        else:
+            result = {'recipient': recipient, 'status': 'sent', 'message_id': message_id}
+
+        results.append(result)
+        if on_result is not None:
+            on_result(result)
+
+    try:
+        ensure_report_template()
+    except ClientError as e:
+        LOG.exception(e)
+        LOG.error("Unable to set up report template, sending emails separately")
+        failed = recipients
+        recipients = []
+
+    bucket = workers.TokenBucket(get_max_send_rate() * rate_share)
+
+    for i in range(0, len(recipients), bulk_batch_size):
+        batch = recipients[i:i + bulk_batch_size]
+
+        if deadline.expired():
+            results.extend(pending_result(r) for r in batch)
+            continue
+
+        destinations = []
+        for recipient in batch:
+            data = build_report_template_data(per_user[recipient], account_names, period)
+            destinations.append({
+                'Destination': {
+                    'ToAddresses': add_cc_list(recipient),
+                },
+                'ReplacementTemplateData': json.dumps(data),
+            })
+
+        # The send rate counts every recipient, including CC addresses
+        bucket.acquire_many(sum(len(d['Destination']['ToAddresses']) for d in destinations))
+
+        # The deadline may have passed while waiting for the send rate
+        if deadline.expired():
+            results.extend(pending_result(r) for r in batch)
+            continue
+
+        try:
+            response = get_ses_client().send_bulk_templated_email(
+                Source=sender,
+                Template=report_template_name,
+                DefaultTemplateData=json.dumps({'period': period}),
+                Destinations=destinations,
+            )
+        except ClientError as e:
+            LOG.exception(e)
+            failed.extend(batch)
+            continue
+
+        for recipient, status in zip(batch, response['Status']):
+            if status['Status'] == 'Success':
+                LOG.info(f"Email sent to {recipient}! Message ID: {status['MessageId']}")
+                _result(recipient, status['MessageId'])
+            else:
+                LOG.error(f"Bulk send failed for {recipient}: {status['Status']} "
+                          f"{status.get('Error', '')}")
+                failed.append(recipient)
+
+    for recipient in failed:
+        if deadline.expired():
+            results.append(pending_result(recipient))
+            continue
+
+        user_html, user_text = build_user_email_body(per_user[recipient], account_names)
+        bucket.acquire(len(add_cc_list(recipient)))
+        if deadline.expired():
+            results.append(pending_result(recipient))
+            continue
+
+        message_id = send_report_email(recipient, user_html, user_text, period)
+        _result(recipient, message_id, 'Unable to send report')
+
+    return results
 
 
 def add_cc_list(primary):
@@ -409,28 +405,154 @@ def add_cc_list(primary):
     return recipients
 
 
+def report_subject(period):
+    return f"AWS Monthly Cost Report ({period})"
+
+
 def send_report_email(recipient, body_html, body_text, period):
     """
-    Send a per-user report email
+    Send a per-user report email, and return the message ID if it was sent
     """
-    subject = f"AWS Monthly Cost Report ({period})"
+    subject = report_subject(period)
     recipients = add_cc_list(recipient)
-    send_email(recipients, subject, body_html, body_text)
+    return send_email(recipients, subject, body_html, body_text)
+
+
+def get_max_send_rate():
+    """
+    Get the maximum number of recipients per second allowed by the account's
+    SES sending quota, defaulting to 1 if the quota can't be read
+    """
+
+    try:
+        quota = get_ses_client().get_send_quota()
+    except ClientError as e:
+        LOG.exception(e)
+        return 1.0
+
+    rate = quota['MaxSendRate']
+    LOG.info(f"SES maximum send rate: {rate}/s")
+    return max(rate, 1.0)
+
+
+def report_sender(account_names, period, rate_share=1.0):
+    """
+    Build a function that renders and sends a single user report, and
+    returns a per-recipient result. Sends are paced with a token bucket
+    shared by every call, so that concurrent calls stay within the account's
+    SES maximum send rate, or `rate_share` of it if the rate is shared with
+    other senders.
+
+    Example result:
+    ```
+    recipient: user1@example.com
+    status: sent
+    message_id: 0123456789abcdef
+    ```
+    Or if the report could not be sent:
+    ```
+    recipient: user2@example.com
+    status: failed
+    error: An error occurred (MessageRejected) ...
+    ```
+    Or if the run deadline passed while waiting for the send rate, a pending
+    result, see pending_result().
+    """
+
+    subject = report_subject(period)
+    bucket = workers.TokenBucket(get_max_send_rate() * rate_share)
+
+    def _send(recipients, body_html, body_text):
+        # The send rate counts every recipient, including CC addresses
+        bucket.acquire(len(recipients))
+        if deadline.expired():
+            return None
+        return _send_email(recipients, subject, body_html, body_text)
+
+    def send_report(recipient, summary):
+        body_html, body_text = build_user_email_body(summary, account_names)
+        recipients = add_cc_list(recipient)
+
+        try:
+            message_id = workers.call_with_backoff(_send, recipients, body_html, body_text,
+                                                   label='send_email')
+        except ClientError as e:
+            LOG.error(f"Unable to send report to {recipient}: {e}")
+            return {'recipient': recipient, 'status': 'failed', 'error': str(e)}
+
+        if message_id is None:
+            LOG.warning(f"Deadline reached before sending report to {recipient}")
+            return pending_result(recipient)
+
+        LOG.info(f"Email sent to {recipient}! Message ID: {message_id}")
+        return {'recipient': recipient, 'status': 'sent', 'message_id': message_id}
+
+    return send_report
+
+
+def pending_result(recipient):
+    """
+    Build the result for a recipient whose report was not sent because the
+    run deadline passed first, see deadline.expired()
+    """
+
+    return {'recipient': recipient, 'status': 'pending'}
+
+
+def send_report_emails(per_user, account_names, period, max_workers=None, on_result=None,
+                       rate_share=1.0):
+    """
+    Render and send per-user reports concurrently with report_sender(), and
+    return a list of per-recipient results in recipient order.
+
+    Up to `max_workers` reports are sent at once (by default from the
+    SEND_CONCURRENCY environment variable). If given, `on_result` is called
+    with each result as soon as it is known, from the sending thread. Once
+    the run deadline has passed no new sends are started, and the remaining
+    recipients have pending results that are not passed to `on_result`.
+    """
+
+    if max_workers is None:
+        max_workers = send_concurrency()
+
+    send_report = report_sender(account_names, period, rate_share)
+
+    def _send_user_report(recipient):
+        if deadline.expired():
+            return pending_result(recipient)
+
+        result = send_report(recipient, per_user[recipient])
+        if on_result is not None and result['status'] != 'pending':
+            on_result(result)
+        return result
+
+    return workers.map_bounded(_send_user_report, list(per_user), max_workers)
+
+
+def send_concurrency():
+    """
+    Get the number of concurrent senders from the SEND_CONCURRENCY
+    environment variable
+    """
+
+    return int(os.environ.get('SEND_CONCURRENCY', default_send_concurrency))
 
 
 def send_unowned_email(body_html, body_text, period):
     """
-    Send a report on unowned costs to the admin recipient
+    Send a report on unowned costs to the admin recipient, and return the
+    message ID if it was sent
     """
     subject = f"AWS Unowned Costs ({period})"
     admin = os.environ['ADMIN_EMAIL']
     recipients = add_cc_list(admin)
-    send_email(recipients, subject, body_html, body_text)
+    return send_email(recipients, subject, body_html, body_text)
 
 
-def send_email(recipients, subject, body_html, body_text):
+def _send_email(recipients, subject, body_html, body_text):
     """
-    Send e-mail through SES
+    Send e-mail through SES and return the message ID, raising ClientError
+    if sending fails
     """
 
     sender = os.environ['SENDER']
@@ -438,9 +560,7 @@ def send_email(recipients, subject, body_html, body_text):
     # Python3 uses UTF-8
     charset = "UTF-8"
 
-    # Try to send the email.
-    try:
-        response = ses_client.send_email(
+    response = get_ses_client().send_email(
             Destination={
                 'ToAddresses': recipients,
             },
@@ -463,8 +583,22 @@ def send_email(recipients, subject, body_html, body_text):
             Source=sender,
         )
 
+    return response['MessageId']
+
+
+def send_email(recipients, subject, body_html, body_text):
+    """
+    Send e-mail through SES, and return the message ID if it was sent or
+    None if sending failed
+    """
+
+    try:
+        message_id = _send_email(recipients, subject, body_html, body_text)
+
     # Display an error if something goes wrong.
     except ClientError as e:
         LOG.exception(e)
-    else:
-        LOG.info(f"Email sent! Message ID: {response['MessageId']}")
+        return None
+
+    LOG.info(f"Email sent! Message ID: {message_id}")
+    return message_id
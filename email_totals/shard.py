@@ -0,0 +1,224 @@
+import json
+import logging
+import os
+import zlib
+
+from email_totals import checkpoint, clients, deadline, workers
+
+LOG = logging.getLogger(__name__)
+LOG.setLevel(logging.DEBUG)
+
+# Asynchronous lambda invocations accept at most this many payload bytes
+max_payload_bytes = 256 * 1024
+
+
+def shard_count():
+    """
+    Get the number of shards from the SHARD_COUNT environment variable,
+    where 1 (the default) disables sharding
+    """
+
+    return max(int(os.environ.get('SHARD_COUNT', '1')), 1)
+
+
+def shard_name(index, count):
+    return f"shard-{index}-of-{count}"
+
+
+def shard_index(recipient, count):
+    """
+    Get the shard for a recipient. A stable hash of the address is used, so a
+    recipient always lands in the same shard regardless of summary order.
+    """
+
+    return zlib.crc32(recipient.encode()) % count
+
+
+def split_summary(summary, count):
+    """
+    Split a summary from build_summary() into `count` shard summaries, each
+    with a subset of the per-user summary and only the account names it
+    refers to. Unowned costs are left out, they are reported by the
+    coordinator.
+    """
+
+    shards = [{} for _ in range(count)]
+    for recipient, entry in summary['per_user_summary'].items():
+        shards[shard_index(recipient, count)][recipient] = entry
+
+    names = summary['account_names']
+    output = []
+    for per_user in shards:
+        accounts = set()
+        for entry in per_user.values():
+            for key in ('resources', 'accounts', 'missing_other_tag', 'invalid_other_tag'):
+                accounts.update(entry.get(key, ()))
+
+        output.append({
+            'account_names': {a: names[a] for a in accounts if a in names},
+            'per_user_summary': per_user,
+            'unowned': {},
+        })
+
+    return output
+
+
+def payload_size(event):
+    """
+    Get the size in bytes of an event serialized for a lambda invocation
+    """
+
+    return len(json.dumps(event, separators=(',', ':')))
+
+
+def build_shard_events(summary, period, email_period, count, max_bytes=None):
+    """
+    Build an event payload for each shard of a summary, see lambda_handler()
+
+    If any payload is larger than `max_bytes` (by default the asynchronous
+    invocation limit), the summary is split into twice as many shards until
+    every payload fits. Raise ValueError if a shard with a single recipient
+    doesn't fit.
+
+    The period is the coordinator's checkpoint key, see checkpoint.run_key(),
+    so that shard checkpoints belong to the same run.
+
+    Example event:
+    ```
+    shard:
+        index: 0
+        count: 4
+        period: 2023-01-01
+        email_period: January 2023
+    summary: <summary serialized by checkpoint.encode_summary()>
+    ```
+    """
+
+    if max_bytes is None:
+        max_bytes = max_payload_bytes
+
+    while True:
+        events = []
+        oversized = []
+        for index, shard_summary in enumerate(split_summary(summary, count)):
+            event = {
+                'shard': {
+                    'index': index,
+                    'count': count,
+                    'period': period,
+                    'email_period': email_period,
+                },
+                'summary': checkpoint.encode_summary(shard_summary),
+            }
+            events.append(event)
+
+            size = payload_size(event)
+            if size > max_bytes:
+                oversized.append((size, len(shard_summary['per_user_summary'])))
+
+        if not oversized:
+            return events
+
+        size, recipients = max(oversized)
+        if recipients <= 1:
+            raise ValueError(f"Shard payload of {size} bytes for a single recipient "
+                             f"is larger than {max_bytes} bytes")
+
+        LOG.warning(f"Shard payload of {size} bytes is larger than {max_bytes} bytes "
+                    f"with {count} shards, splitting into {count * 2} shards")
+        count *= 2
+
+
+class LambdaDispatcher:
+    """
+    Dispatch shard events to the lambda with asynchronous invocations
+    """
+
+    def __init__(self, function_name):
+        self.function_name = function_name
+
+    def dispatch(self, event):
+        payload = json.dumps(event, separators=(',', ':'))
+        if len(payload) > max_payload_bytes:
+            raise ValueError(f"Payload for {shard_name(**_shard_id(event))} is "
+                             f"{len(payload)} bytes, more than {max_payload_bytes}")
+
+        response = clients.get_boto_client('lambda').invoke(
+            FunctionName=self.function_name,
+            InvocationType='Event',
+            Payload=payload,
+        )
+        return {'status': response['StatusCode']}
+
+
+class LocalDispatcher:
+    """
+    In-process stand-in for LambdaDispatcher, calling the handler directly
+    with a copy of the event that has been through the same serialization as
+    a lambda invocation, and returning the handler's result
+    """
+
+    def __init__(self, handler):
+        self.handler = handler
+
+    def dispatch(self, event):
+        return self.handler(json.loads(json.dumps(event)), None)
+
+
+def get_dispatcher(context, handler):
+    """
+    Get a dispatcher for invoking shards, using the lambda function from the
+    invocation context, or the in-process handler if there is no context
+    (e.g. when running locally)
+    """
+
+    function_name = getattr(context, 'invoked_function_arn', None)
+    if function_name is None:
+        return LocalDispatcher(handler)
+    return LambdaDispatcher(function_name)
+
+
+def _shard_id(event):
+    return {'index': event['shard']['index'], 'count': event['shard']['count']}
+
+
+def dispatch_shards(dispatcher, events, run):
+    """
+    Dispatch every shard event concurrently, and return a list of dispatch
+    results in shard order. Dispatched shards are recorded in the coordinator's
+    run checkpoint, apart from its sends (see checkpoint.Run.dispatches()),
+    and shards that were already dispatched by an earlier
+    attempt are skipped. Once the run deadline has passed no more shards are
+    dispatched, and their results are pending.
+    """
+
+    dispatches = run.dispatches()
+    dispatched = dispatches.sent()
+
+    def _dispatch(event):
+        name = shard_name(**_shard_id(event))
+        if name in dispatched:
+            LOG.info(f"Already dispatched {name}")
+            return {'status': 'skipped'}
+
+        if deadline.expired():
+            LOG.warning(f"Deadline reached before dispatching {name}")
+            return {'status': 'pending'}
+
+        result = dispatcher.dispatch(event)
+        dispatches.record({'recipient': name, 'status': 'sent'})
+        LOG.info(f"Dispatched {name}")
+        return result
+
+    return workers.map_bounded(_dispatch, events, len(events))
+
+
+def open_shard_run(event):
+    """
+    Open the run checkpoint for a shard worker, kept separately from the
+    coordinator and other shards of the same period
+    """
+
+    shard = event['shard']
+    name = shard_name(shard['index'], shard['count'])
+    return checkpoint.open_run(checkpoint.sub_key(shard['period'], name))
@@ -1,32 +1,77 @@
 import logging
 import os
+import time
 
-import synapseclient as syn
+from email_totals import cache, clients
 
 LOG = logging.getLogger(__name__)
 LOG.setLevel(logging.DEBUG)
 
-# Create a Synapse client
-# The lambda homedir is not writeable, put the cache in /tmp
-syn_client = syn.Synapse(cache_root_dir='/tmp/synapse')
+# Persist the Team Sage roster alongside the Synapse client cache
+roster_cache_root = '/tmp/synapse'
+roster_cache_name = 'team-sage'
+
+# Team membership changes occasionally, by default cache it for a day
+default_roster_cache_ttl = 86400
+
+
+def roster_info():
+    """
+    Report the age (in seconds) and size of the cached Team Sage roster,
+    or None if no roster is cached
+    """
+
+    data = cache.load(roster_cache_name, roster_cache_root)
+    if data is None:
+        return None
+
+    return {
+        'age': time.time() - data['fetched'],
+        'size': len(data['members']),
+    }
 
 
 def get_team_sage_members():
     """
-    Get a list of Team Sage emails from Synapse
+    Get a frozen set of Team Sage emails from Synapse
+
+    The roster is cached in memory and under /tmp/synapse with a time-to-live
+    from the SYNAPSE_CACHE_TTL environment variable, in seconds. A
+    time-to-live of 0 disables caching.
     """
 
     synapse_id = os.environ['SYNAPSE_TEAM_ID']
     synapse_domain = os.environ['SYNAPSE_TEAM_DOMAIN']
+    ttl = int(os.environ.get('SYNAPSE_CACHE_TTL', default_roster_cache_ttl))
+
+    data = cache.load(roster_cache_name, roster_cache_root)
+    if data is not None and data['team'] != synapse_id:
+        data = None
+
+    if data is None or not cache.is_fresh(data['fetched'], ttl):
+        members = []
+
+        syn_client = clients.get_synapse_client()
+        syn_team = syn_client.getTeam(synapse_id)
+        syn_members = syn_client.getTeamMembers(syn_team)
+        for m in syn_members:
+            email = m['member']['userName'] + synapse_domain
+            members.append(email)
+
+        data = {
+            'team': synapse_id,
+            'fetched': time.time(),
+            'members': sorted(members),
+        }
 
-    team_sage = []
+        if ttl > 0:
+            cache.store(roster_cache_name, data, roster_cache_root)
 
-    syn_team = syn_client.getTeam(synapse_id)
-    syn_members = syn_client.getTeamMembers(syn_team)
-    for m in syn_members:
-        email = m['member']['userName'] + synapse_domain
-        team_sage.append(email)
+    team_sage = frozenset(data['members'])
 
-    LOG.info(f"Members of Team Sage: {team_sage}")
+    info = roster_info() or {'age': 0, 'size': len(team_sage)}
+    LOG.info(f"Members of Team Sage: {len(team_sage)} "
+             f"(roster age {info['age']:.0f}s)")
+    LOG.debug(f"Members of Team Sage: {sorted(team_sage)}")
 
     return team_sage
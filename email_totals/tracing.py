@@ -0,0 +1,147 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+
+LOG = logging.getLogger(__name__)
+LOG.setLevel(logging.DEBUG)
+
+# Default file for spans when tracing to a file
+default_trace_file = '/tmp/email_totals/trace.jsonl'
+
+# The span for the API call in progress on each thread, every event for a
+# call is emitted on the thread that made it
+_local = threading.local()
+
+_lock = threading.Lock()
+
+
+def trace_mode():
+    """
+    Get the tracing mode from the TRACE environment variable: 'log' to log
+    each span, 'file' to append spans to a JSON-lines file, or 'none'
+    """
+
+    return os.environ.get('TRACE', 'none')
+
+
+def fingerprint(params):
+    """
+    Build a short, stable fingerprint of API call parameters, so that calls
+    with the same parameters can be grouped without logging the parameters
+    """
+
+    canonical = json.dumps(params, sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.sha256(canonical.encode()).hexdigest()[:12]
+
+
+def _before_parameter_build(params, model, **kwargs):
+    _local.span = {
+        'service': model.service_model.service_name,
+        'operation': model.name,
+        'fingerprint': fingerprint(params),
+        'started': time.time(),
+        'attempts': 0,
+        'clock': time.perf_counter(),
+        'sending': 0.0,
+    }
+
+
+def _before_send(**kwargs):
+    # Registered after the adaptive retry rate limiter, so any time spent
+    # waiting for it is counted as waiting rather than sending
+    span = getattr(_local, 'span', None)
+    if span is not None:
+        span['attempts'] += 1
+        span['sent'] = time.perf_counter()
+
+
+def _response_received(**kwargs):
+    span = getattr(_local, 'span', None)
+    if span is not None and 'sent' in span:
+        span['sending'] += time.perf_counter() - span.pop('sent')
+
+
+def _finish(status, size=None):
+    span = getattr(_local, 'span', None)
+    if span is None:
+        return
+    _local.span = None
+
+    latency = time.perf_counter() - span.pop('clock')
+    sending = span.pop('sending')
+    span.pop('sent', None)
+
+    span['latency_ms'] = round(latency * 1000, 3)
+    span['wait_ms'] = round(max(latency - sending, 0) * 1000, 3)
+    span['status'] = status
+    if size is not None:
+        span['bytes'] = size
+
+    write_span(span)
+
+
+def _after_call(http_response=None, parsed=None, **kwargs):
+    size = None
+    status = None
+    if http_response is not None:
+        status = http_response.status_code
+
+        # Stubbed responses have no raw body
+        if http_response.raw is not None:
+            size = len(http_response.content or b'')
+
+    if parsed:
+        error = parsed.get('Error', {}).get('Code')
+        if error:
+            status = error
+
+    _finish(status, size)
+
+
+def _after_call_error(exception=None, **kwargs):
+    _finish(type(exception).__name__)
+
+
+def write_span(span):
+    """
+    Write a finished span to the log or the trace file, per trace_mode()
+    """
+
+    line = json.dumps(span, separators=(',', ':'))
+
+    if trace_mode() != 'file':
+        LOG.info(f"Trace: {line}")
+        return
+
+    path = os.environ.get('TRACE_FILE', default_trace_file)
+    try:
+        with _lock:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'a') as f:
+                f.write(line + '\n')
+    except OSError as e:
+        LOG.warning(f"Unable to write trace span: {e}")
+
+
+def instrument(client):
+    """
+    Record a span for every API call made by a boto3 client, with the
+    operation, a parameter fingerprint, the number of HTTP attempts, the
+    total latency, the time spent waiting between attempts (retry back-off
+    and adaptive rate limiting), and the response size.
+
+    Does nothing if tracing is disabled, so there is no cost per call.
+    """
+
+    if trace_mode() not in ('log', 'file'):
+        return
+
+    events = client.meta.events
+    events.register('before-parameter-build', _before_parameter_build)
+    events.register('before-send', _before_send)
+    events.register('response-received', _response_received)
+    events.register('after-call', _after_call)
+    events.register('after-call-error', _after_call_error)
@@ -0,0 +1,125 @@
+import logging
+import math
+
+import numpy as np
+
+from email_totals import ce, model
+
+LOG = logging.getLogger(__name__)
+LOG.setLevel(logging.DEBUG)
+
+
+def pct_change(target, compare, has_compare):
+    """
+    Calculate the percent change from compare totals to target totals, as
+    an array with NaN where there is no compare total or it is zero
+    """
+
+    change = np.full(target.shape, np.nan)
+    valid = has_compare & (compare != 0)
+    np.divide(target, compare, out=change, where=valid)
+    change[valid] -= 1
+    return change
+
+
+def build_resource_totals(period_groups, target_start, minimum_total):
+    """
+    Vectorized equivalent of the resource totals built by
+    app.get_resource_totals(), from cost explorer groups keyed by owner
+    email and account.
+
+    Groups are loaded into arrays coded by (owner, account) pair, then
+    minimum-total filtering, merging of duplicate owners (differing only in
+    case), and percent change are calculated as array operations. Pairs are
+    returned in the order they first appear in the target period, matching
+    the pure-python path.
+    """
+
+    emails = {}
+    accounts = {}
+    email_codes = []
+    account_codes = []
+    amounts = []
+    is_target = []
+
+    for start, group in period_groups:
+        if len(group['Keys']) != 2:
+            LOG.error(f"Unexpected grouping: {group['Keys']}")
+            continue
+
+        # Downcase all emails to merge case-insensitive duplicates
+        email = group['Keys'][0].split('$', maxsplit=1)[1].lower()
+        account_id = group['Keys'][1]
+
+        email_codes.append(emails.setdefault(email, len(emails)))
+        account_codes.append(accounts.setdefault(account_id, len(accounts)))
+        amounts.append(float(group['Metrics'][ce.cost_metric]['Amount']))
+        is_target.append(start == target_start)
+
+    amounts = np.array(amounts, dtype=float)
+    is_target = np.array(is_target, dtype=bool)
+
+    # Skip insignificant totals
+    keep = amounts >= minimum_total
+    LOG.info(f"Skipping {np.count_nonzero(~keep)} totals less than ${minimum_total}")
+
+    amounts = amounts[keep]
+    is_target = is_target[keep]
+    pairs = (np.array(email_codes, dtype=np.int64)[keep] * max(len(accounts), 1) +
+             np.array(account_codes, dtype=np.int64)[keep])
+
+    # Sum each period per (owner, account) pair, summing in input order
+    unique, inverse = np.unique(pairs, return_inverse=True)
+    size = len(unique)
+    target = np.bincount(inverse[is_target], weights=amounts[is_target], minlength=size)
+    compare = np.bincount(inverse[~is_target], weights=amounts[~is_target], minlength=size)
+    has_target = np.bincount(inverse[is_target], minlength=size) > 0
+    has_compare = np.bincount(inverse[~is_target], minlength=size) > 0
+
+    # Order pairs by their first appearance in the target period
+    first = np.full(size, len(pairs))
+    np.minimum.at(first, inverse[is_target], np.flatnonzero(is_target))
+    selected = np.flatnonzero(has_target)
+    selected = selected[np.argsort(first[selected], kind='stable')]
+
+    change = pct_change(target[selected], compare[selected], has_compare[selected])
+
+    email_list = [model.intern_id(e) for e in emails]
+    account_list = [model.intern_id(a) for a in accounts]
+    account_count = max(len(accounts), 1)
+
+    resources = {}
+    for code, total, pct in zip(unique[selected].tolist(),
+                                target[selected].tolist(),
+                                change.tolist()):
+        email = email_list[code // account_count]
+        if email not in resources:
+            resources[email] = {'resources': model.UsageTable()}
+
+        # A NaN change is stored as no change
+        resources[email]['resources'].add(account_list[code % account_count], total, pct)
+
+    return resources
+
+
+def build_account_changes(target_totals, compare_totals, minimum_total):
+    """
+    Vectorized percent change for account totals, used by
+    app.get_account_totals(). Return a dictionary mapping each account with
+    a target total of at least the minimum to its percent change, or None.
+    """
+
+    account_ids = list(target_totals)
+    target = np.array([target_totals[a] for a in account_ids], dtype=float)
+    compare = np.array([compare_totals.get(a, 0.0) for a in account_ids], dtype=float)
+    has_compare = np.array([a in compare_totals for a in account_ids], dtype=bool)
+
+    keep = target >= minimum_total
+    change = pct_change(target, compare, has_compare)
+
+    changes = {}
+    for account_id, kept, pct in zip(account_ids, keep.tolist(), change.tolist()):
+        if kept:
+            changes[account_id] = None if math.isnan(pct) else pct
+
+    return changes
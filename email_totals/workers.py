@@ -0,0 +1,195 @@
+import logging
+import queue
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from botocore.exceptions import ClientError
+
+from email_totals import deadline, metrics
+
+LOG = logging.getLogger(__name__)
+LOG.setLevel(logging.DEBUG)
+
+# Error codes returned by AWS APIs when a request is throttled
+throttle_codes = (
+    'LimitExceededException',
+    'RequestLimitExceeded',
+    'Throttling',
+    'ThrottlingException',
+    'TooManyRequestsException',
+)
+
+
+def is_throttled(error):
+    """
+    Determine if a ClientError was caused by request throttling
+    """
+    return error.response.get('Error', {}).get('Code') in throttle_codes
+
+
+def call_with_backoff(func, *args, attempts=5, base_delay=0.5, max_delay=8.0, label=None):
+    """
+    Call a function, retrying with exponential back-off and full jitter if
+    the call is throttled. Botocore already retries throttled requests, this
+    covers the case where a task exhausts the client retries while sharing a
+    rate limit with other concurrent tasks.
+
+    Retries are budgeted against the run deadline: if the back-off delay
+    would pass the deadline the throttling error is raised instead.
+
+    Retries are logged with `label`, by default the function name. The
+    arguments are never logged, they may hold report bodies or recipients.
+    """
+
+    for attempt in range(1, attempts + 1):
+        try:
+            return func(*args)
+        except ClientError as e:
+            if not is_throttled(e) or attempt == attempts:
+                raise
+
+            if label is None:
+                label = getattr(func, '__name__', 'function')
+
+            delay = random.uniform(0, min(max_delay, base_delay * 2 ** attempt))
+            if not deadline.allows(delay):
+                LOG.warning(f"Throttled calling {label}, "
+                            f"no time left to retry before the deadline")
+                raise
+
+            metrics.add('Retries')
+            LOG.warning(f"Throttled calling {label}, "
+                        f"retrying in {delay:.2f}s ({attempt}/{attempts})")
+            time.sleep(delay)
+
+
+def map_bounded(func, items, max_workers):
+    """
+    Call a function on each item using a bounded pool of worker threads,
+    and return a list of results in the same order as the input items.
+
+    Throttled calls are retried per item with call_with_backoff(), any
+    other exception is raised to the caller.
+    """
+
+    items = list(items)
+
+    # Avoid the thread overhead when there is nothing to parallelize
+    if max_workers <= 1 or len(items) <= 1:
+        return [call_with_backoff(func, item) for item in items]
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = [pool.submit(call_with_backoff, func, item) for item in items]
+        return [f.result() for f in futures]
+
+
+# Marks the end of a pipeline queue
+_done = object()
+
+
+def pipeline(produce, items, consume, producers, consumers, queue_depth):
+    """
+    Run a two-stage pipeline of worker threads connected by a bounded queue,
+    and return a list of results from the second stage in completion order.
+
+    Up to `producers` threads call `produce` on each item, which returns a
+    list of outputs. Each output is put on the queue as soon as it is ready,
+    and passed to `consume` by one of `consumers` threads. The queue holds at
+    most `queue_depth` outputs, producers wait while it is full, so memory
+    use depends on the queue depth rather than the number of items.
+
+    Throttled calls are retried with call_with_backoff() in both stages. Any
+    other exception is raised to the caller once the pipeline has drained,
+    work that doesn't depend on the failed call still completes.
+    """
+
+    work = queue.Queue(maxsize=queue_depth)
+    results = []
+    errors = []
+
+    def _consumer():
+        while True:
+            output = work.get()
+            if output is _done:
+                return
+
+            try:
+                results.append(call_with_backoff(consume, output))
+            except Exception as e:
+                LOG.exception(e)
+                errors.append(e)
+
+    def _produce(item):
+        for output in produce(item):
+            work.put(output)
+
+    threads = [threading.Thread(target=_consumer) for _ in range(max(consumers, 1))]
+    for thread in threads:
+        thread.start()
+
+    try:
+        map_bounded(_produce, items, producers)
+    except Exception as e:
+        errors.append(e)
+    finally:
+        for _ in threads:
+            work.put(_done)
+        for thread in threads:
+            thread.join()
+
+    if errors:
+        raise errors[0]
+
+    return results
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket for pacing calls to a steady rate, e.g. to stay
+    within a service quota instead of relying on throttling and retries.
+    Tokens refill continuously at `rate` per second, up to `capacity`.
+    """
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(rate, 1)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire_many(self, tokens):
+        """
+        Block until the given number of tokens have been taken, a bucketful
+        at a time, so that a call counting more tokens than the bucket holds
+        is still paced to the average rate
+        """
+
+        while tokens > 0:
+            taken = min(tokens, self.capacity)
+            self.acquire(taken)
+            tokens -= taken
+
+    def acquire(self, tokens=1):
+        """
+        Block until the given number of tokens are available, then take them
+        """
+
+        # Never wait for more tokens than the bucket can hold
+        tokens = min(tokens, self.capacity)
+
+        while True:
+            with self._lock:
+                self._refill()
+                if self.tokens >= tokens:
+                    self.tokens -= tokens
+                    return
+                wait = (tokens - self.tokens) / self.rate
+
+            time.sleep(wait)
@@ -0,0 +1,22 @@
+import os
+
+import pytest
+
+
+# This needs to be set when the clients are created,
+# but its value is not used when running benchmarks
+os.environ['AWS_DEFAULT_REGION'] = 'test-region'
+from email_totals import cache, clients
+
+
+# Keep cached data and shared clients isolated to each benchmark
+
+@pytest.fixture(autouse=True)
+def mock_cache(mocker, tmp_path):
+    mocker.patch.object(cache, 'cache_root', str(tmp_path))
+    mocker.patch.object(cache, 'memory', {})
+
+
+@pytest.fixture(autouse=True)
+def mock_clients(mocker):
+    mocker.patch.object(clients, 'shared', {})
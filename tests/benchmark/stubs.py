@@ -0,0 +1,72 @@
+import threading
+import time
+
+
+class LatencyClient:
+    """
+    Stand-in for a boto3 client where every API call sleeps for a fixed
+    latency and then returns a canned response, counting calls per operation.
+    """
+
+    def __init__(self, latency, responses):
+        self.latency = latency
+        self.responses = responses
+        self.calls = {}
+        self._lock = threading.Lock()
+
+    def __getattr__(self, operation):
+        if operation not in self.responses:
+            raise AttributeError(operation)
+
+        def _call(**kwargs):
+            with self._lock:
+                self.calls[operation] = self.calls.get(operation, 0) + 1
+            time.sleep(self.latency)
+            return self.responses[operation]
+
+        return _call
+
+
+def timed(func, *args, **kwargs):
+    """
+    Call a function and return a tuple of its result and elapsed seconds
+    """
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def report(title, rows):
+    """
+    Print a small table of benchmark results, visible with `pytest -s`
+    """
+    print(f"\n{title}")
+    for row in rows:
+        print('  ' + '\t'.join(str(col) for col in row))
+
+
+class LatencyPaginatorClient:
+    """
+    Stand-in for a boto3 client where every page of a paginated operation
+    sleeps for a fixed latency. Pages are looked up by calling the `pages`
+    function with the operation name and paginate() arguments.
+    """
+
+    def __init__(self, latency, pages):
+        self.latency = latency
+        self.pages = pages
+        self.calls = {}
+        self._lock = threading.Lock()
+
+    def get_paginator(self, operation):
+        client = self
+
+        class _Paginator:
+            def paginate(self, **kwargs):
+                for page in client.pages(operation, **kwargs):
+                    with client._lock:
+                        client.calls[operation] = client.calls.get(operation, 0) + 1
+                    time.sleep(client.latency)
+                    yield page
+
+        return _Paginator()
@@ -0,0 +1,343 @@
+import random
+import threading
+import time
+import tracemalloc
+import zlib
+
+from email_totals import ce, org
+
+# Share of owners at each email domain, the rest have invalid tag values
+sagebase_share = 0.7
+synapse_share = 0.2
+
+# Share of synapse owners who are members of the synapse team
+team_share = 0.5
+
+# Share of accounts tagged with an account owner
+owned_account_share = 0.5
+
+# Share of resources missing a CostCenterOther tag, or with an unexpected one
+missing_tag_share = 0.05
+invalid_tag_share = 0.05
+
+# Owner tag value used by cost explorer for uncategorized costs
+uncategorized = f"{ce.owner_group['Key']}$"
+
+
+def _month_factor(key, month):
+    """
+    Deterministic month-over-month variation for a resource, between 0.5
+    and 1.5, so that any month can be queried without storing every month
+    """
+    return 0.5 + (zlib.crc32(f"{key}/{month}".encode()) % 1000) / 1000
+
+
+class SyntheticOrg:
+    """
+    Generate a reproducible organization of accounts, owners and resources
+    from a seed, with enough variety to exercise every part of a report:
+    owned accounts, unowned costs, synapse and invalid owners, and resources
+    with missing or invalid CostCenterOther tags.
+    """
+
+    def __init__(self, accounts=100, owners=500, resources=5, seed=0,
+                 team_id='273957', synapse_domain='@synapse.org'):
+        rng = random.Random(seed)
+
+        self.team_id = team_id
+        self.account_ids = [f"{i:012}" for i in range(accounts)]
+        self.account_names = {a: f"synthetic-{a[-4:]}" for a in self.account_ids}
+
+        self.owners = []
+        self.team_members = []
+        for i in range(owners):
+            kind = rng.random()
+            if kind < sagebase_share:
+                owner = f"owner{i}@sagebase.org"
+            elif kind < sagebase_share + synapse_share:
+                owner = f"owner{i}{synapse_domain}"
+                if rng.random() < team_share:
+                    self.team_members.append(f"owner{i}")
+            else:
+                owner = f"owner-{i}"
+            self.owners.append(owner)
+
+        self.account_owners = {}
+        for account_id in self.account_ids:
+            if rng.random() < owned_account_share:
+                self.account_owners[account_id] = rng.choice(self.owners)
+
+        # Each resource is a tuple of owner, account, ID, base cost and tag state,
+        # with some unowned resources in every account
+        self.resources = []
+        for owner in self.owners + [''] * accounts:
+            for n in range(resources):
+                account_id = rng.choice(self.account_ids)
+                tags = rng.random()
+                if tags < missing_tag_share:
+                    state = 'missing'
+                elif tags < missing_tag_share + invalid_tag_share:
+                    state = 'invalid'
+                else:
+                    state = 'valid'
+                resource_id = f"i-{len(self.resources):08x}"
+                cost = round(rng.lognormvariate(2, 1.5), 2)
+                self.resources.append((owner, account_id, resource_id, cost, state))
+
+    def cost(self, resource, month):
+        owner, account_id, resource_id, base, _ = resource
+        return base * _month_factor(resource_id, month)
+
+    def valid_owners(self):
+        """
+        Owners who should receive a report, assuming no recipient restrictions
+        """
+
+        members = {m + '@synapse.org' for m in self.team_members}
+        return {o for o in self.owners
+                if o.endswith('@sagebase.org') or o in members}
+
+
+class FakeClient:
+    """
+    Base class for in-process stand-ins for API clients, where every call
+    sleeps for a fixed latency, and calls are counted per operation
+    """
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.calls = {}
+        self._lock = threading.Lock()
+
+    def _call(self, operation):
+        with self._lock:
+            self.calls[operation] = self.calls.get(operation, 0) + 1
+        if self.latency:
+            time.sleep(self.latency)
+
+
+class FakeCostExplorer(FakeClient):
+    """
+    Cost explorer stand-in serving the queries made by email_totals.ce from
+    a synthetic organization, split into pages of `page_size` groups
+    """
+
+    def __init__(self, synthetic, latency=0.0, page_size=500):
+        super().__init__(latency)
+        self.synthetic = synthetic
+        self.page_size = page_size
+
+        # Groups generated for each query, so that paging through results
+        # doesn't count generating them again
+        self._groups = {}
+
+    def _page(self, operation, groups, token, attributes=None):
+        self._call(operation)
+
+        offset = int(token or 0)
+        chunk = groups[offset:offset + self.page_size]
+
+        results = {}
+        for month, group in chunk:
+            results.setdefault(month['Start'], {
+                'TimePeriod': month,
+                'Total': {},
+                'Groups': [],
+                'Estimated': False,
+            })['Groups'].append(group)
+
+        page = {
+            'GroupDefinitions': [],
+            'ResultsByTime': list(results.values()),
+            'DimensionValueAttributes': attributes or [],
+        }
+        if offset + self.page_size < len(groups):
+            page['NextPageToken'] = str(offset + self.page_size)
+        return page
+
+    @staticmethod
+    def _group(keys, amount):
+        return {
+            'Keys': keys,
+            'Metrics': {ce.cost_metric: {'Amount': str(amount), 'Unit': 'USD'}},
+        }
+
+    def get_cost_and_usage(self, TimePeriod, GroupBy, NextPageToken=None, **kwargs):
+        by_owner = GroupBy[0]['Type'] == 'COST_CATEGORY'
+
+        attributes = None
+        if not by_owner:
+            attributes = [{'Value': a, 'Attributes': {'description': n}}
+                          for a, n in self.synthetic.account_names.items()]
+
+        query = (TimePeriod['Start'], TimePeriod['End'], by_owner)
+        if query in self._groups:
+            return self._page('get_cost_and_usage', self._groups[query], NextPageToken,
+                              attributes)
+
+        groups = self._groups[query] = []
+        for month in ce._split_months(TimePeriod):
+            totals = {}
+            for resource in self.synthetic.resources:
+                owner, account_id = resource[:2]
+                key = (uncategorized + owner, account_id) if by_owner else (account_id,)
+                totals[key] = totals.get(key, 0.0) + self.synthetic.cost(resource, month['Start'])
+
+            for key, amount in totals.items():
+                groups.append((month, self._group(list(key), round(amount, 2))))
+
+        return self._page('get_cost_and_usage', groups, NextPageToken, attributes)
+
+    def get_cost_and_usage_with_resources(self, TimePeriod, Filter, GroupBy,
+                                          NextPageToken=None, **kwargs):
+        # Tell the missing and invalid tag filters apart by their 'Not' clauses,
+        # see ce._missing_tag_filter() and ce._invalid_tag_filter()
+        emails = set(Filter['And'][0]['CostCategories']['Values'])
+        state = 'invalid' if any('Not' in f for f in Filter['And']) else 'missing'
+        by_owner = GroupBy[0]['Type'] == 'COST_CATEGORY'
+
+        groups = []
+        for resource in self.synthetic.resources:
+            owner, account_id, resource_id, _, resource_state = resource
+            if owner not in emails or resource_state != state:
+                continue
+
+            first = uncategorized + owner if by_owner else account_id
+            amount = round(self.synthetic.cost(resource, TimePeriod['Start']) / 30, 2)
+            groups.append((TimePeriod, self._group([first, resource_id], amount)))
+
+        return self._page('get_cost_and_usage_with_resources', groups, NextPageToken)
+
+
+class FakeOrganizations(FakeClient):
+    """
+    Organizations stand-in serving account lists and owner tags from a
+    synthetic organization, with 20 accounts per list_accounts page
+    """
+
+    def __init__(self, synthetic, latency=0.0):
+        super().__init__(latency)
+        self.synthetic = synthetic
+
+    def _list_accounts(self):
+        ids = self.synthetic.account_ids
+        for i in range(0, len(ids), 20):
+            self._call('list_accounts')
+            yield {'Accounts': [{'Id': a, 'Name': self.synthetic.account_names[a]}
+                                for a in ids[i:i + 20]]}
+
+    def _list_tags_for_resource(self, ResourceId):
+        self._call('list_tags_for_resource')
+        tags = []
+        if ResourceId in self.synthetic.account_owners:
+            tags.append({'Key': org.account_owner_tag,
+                         'Value': self.synthetic.account_owners[ResourceId]})
+        yield {'Tags': tags}
+
+    def get_paginator(self, operation):
+        client = self
+
+        class _Paginator:
+            def paginate(self, **kwargs):
+                return getattr(client, f"_{operation}")(**kwargs)
+
+        return _Paginator()
+
+
+class FakeSES(FakeClient):
+    """
+    SES stand-in that accepts every email, recording the recipients and
+    size of each message
+    """
+
+    def __init__(self, latency=0.0, max_send_rate=1000.0):
+        super().__init__(latency)
+        self.max_send_rate = max_send_rate
+        self.sent = []
+        self.bytes_sent = 0
+
+    def get_send_quota(self):
+        self._call('get_send_quota')
+        return {'Max24HourSend': 1e6, 'MaxSendRate': self.max_send_rate, 'SentLast24Hours': 0}
+
+    def send_email(self, Destination, Message, Source):
+        self._call('send_email')
+        with self._lock:
+            self.sent.append(Destination['ToAddresses'][0])
+            self.bytes_sent += (len(Message['Body']['Html']['Data']) +
+                                len(Message['Body']['Text']['Data']))
+        return {'MessageId': f"synthetic-{len(self.sent)}"}
+
+    def send_bulk_templated_email(self, Destinations, **kwargs):
+        self._call('send_bulk_templated_email')
+        status = []
+        with self._lock:
+            for destination in Destinations:
+                self.sent.append(destination['Destination']['ToAddresses'][0])
+                self.bytes_sent += len(destination['ReplacementTemplateData'])
+                status.append({'Status': 'Success', 'MessageId': f"synthetic-{len(self.sent)}"})
+        return {'Status': status}
+
+    def update_template(self, Template):
+        self._call('update_template')
+        return {}
+
+
+class FakeSynapse(FakeClient):
+    """
+    Synapse client stand-in serving the members of a synthetic team
+    """
+
+    def __init__(self, synthetic, latency=0.0):
+        super().__init__(latency)
+        self.synthetic = synthetic
+
+    def getTeam(self, team_id):
+        self._call('getTeam')
+        return {'id': team_id, 'name': 'synthetic team'}
+
+    def getTeamMembers(self, team):
+        self._call('getTeamMembers')
+        for name in self.synthetic.team_members:
+            yield {'teamId': team['id'], 'member': {'userName': name}}
+
+
+class PhaseRecorder:
+    """
+    Record wall time, API calls and peak traced memory for each phase of a
+    run, by wrapping the function that implements each phase. Peak memory
+    is only recorded while tracemalloc is tracing.
+    """
+
+    def __init__(self, clients):
+        self.clients = clients
+        self.phases = {}
+
+    def _calls(self):
+        return sum(sum(c.calls.values()) for c in self.clients.values())
+
+    def wrap(self, phase, func):
+        def _wrapped(*args, **kwargs):
+            calls = self._calls()
+            if tracemalloc.is_tracing():
+                tracemalloc.reset_peak()
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - start
+                peak = tracemalloc.get_traced_memory()[1] if tracemalloc.is_tracing() else 0
+
+                found = self.phases.setdefault(phase, {'seconds': 0.0, 'calls': 0, 'peak': 0})
+                found['seconds'] += elapsed
+                found['calls'] += self._calls() - calls
+                found['peak'] = max(found['peak'], peak)
+
+        return _wrapped
+
+    def rows(self):
+        rows = [('phase', 'seconds', 'API calls', 'peak MiB')]
+        for phase, found in self.phases.items():
+            rows.append((phase, f"{found['seconds']:.3f}", found['calls'],
+                         f"{found['peak'] / 2**20:.1f}"))
+        return rows
@@ -0,0 +1,65 @@
+from email_totals import app, clients, workers
+
+from .stubs import LatencyClient, report, timed
+
+latency = 0.01
+owners = [f"user{i}@sagebase.org" for i in range(32)]
+
+empty_response = {
+    'ResultsByTime': [{
+        'TimePeriod': {'Start': '2023-01-01', 'End': '2023-01-02'},
+        'Total': {},
+        'Groups': [],
+    }]
+}
+
+
+def test_audit_concurrency_scaling(mocker):
+    client = LatencyClient(latency, {
+        'get_cost_and_usage_with_resources': empty_response,
+    })
+    clients.set_client('ce', client)
+
+    rows = [('workers', 'seconds', 'speedup')]
+    serial = None
+    for concurrency in (1, 4, 8, 16):
+        results, elapsed = timed(workers.map_bounded,
+                                 app.audit_other_tags,
+                                 owners,
+                                 concurrency)
+        assert results == [({}, {})] * len(owners)
+
+        if serial is None:
+            serial = elapsed
+        rows.append((concurrency, f"{elapsed:.3f}", f"{serial / elapsed:.1f}x"))
+
+    report(f"Tag audit of {len(owners)} owners at {latency}s per CE call", rows)
+
+    # two CE calls per owner for each concurrency level
+    assert client.calls['get_cost_and_usage_with_resources'] == len(owners) * 2 * 4
+
+    # allow plenty of slack for noisy CI runners
+    assert elapsed < serial / 2
+
+
+def test_audit_batch_calls(mocker):
+    client = LatencyClient(latency, {
+        'get_cost_and_usage_with_resources': empty_response,
+    })
+    clients.set_client('ce', client)
+
+    many_owners = [f"user{i}@sagebase.org" for i in range(800)]
+
+    rows = [('batch size', 'CE calls', 'seconds')]
+    for batch_size in (0, 50, 100, 400):
+        client.calls = {}
+        results, elapsed = timed(app.audit_recipients, many_owners, 8, batch_size)
+        assert results == [({}, {})] * len(many_owners)
+
+        calls = client.calls['get_cost_and_usage_with_resources']
+        rows.append((batch_size, calls, f"{elapsed:.3f}"))
+
+    report(f"Tag audit of {len(many_owners)} owners with 8 workers", rows)
+
+    # four queries per batch of 400 owners
+    assert calls == 8
@@ -0,0 +1,64 @@
+import os
+import time
+
+from email_totals import app, cache, cassette, clients, ses, synapse
+
+from .stubs import report
+from .synthetic import FakeCostExplorer, FakeOrganizations, FakeSES, FakeSynapse, SyntheticOrg
+from .test_end_to_end import accounts, env_vars, latency, owners, resources, seed
+
+
+def _run(mocker, tmp_path, name):
+    """
+    Run the lambda handler with nothing cached, and return the elapsed
+    seconds
+    """
+
+    mocker.patch.object(cache, 'cache_root', str(tmp_path / name))
+    mocker.patch.object(cache, 'memory', {})
+    mocker.patch.object(synapse, 'roster_cache_root', str(tmp_path / name / 'synapse'))
+    mocker.patch.object(clients, 'shared', {})
+    mocker.patch.object(cassette, '_cassette', None)
+    mocker.patch.object(ses, '_report_template_ready', False)
+
+    start = time.perf_counter()
+    app.lambda_handler({}, None)
+    return time.perf_counter() - start
+
+
+def test_record_and_replay(mocker, tmp_path):
+    cassette_file = tmp_path / 'cassette.json.gz'
+    mocker.patch.dict(os.environ, env_vars)
+    mocker.patch.dict(os.environ, {'CASSETTE_FILE': str(cassette_file), 'CASSETTE_SCRUB': 'True',
+                                   'BULK_SEND': 'False', 'STREAMING': 'False'})
+
+    synthetic = SyntheticOrg(accounts=accounts, owners=owners, resources=resources, seed=seed)
+    fakes = {
+        'ce': FakeCostExplorer(synthetic, latency),
+        'organizations': FakeOrganizations(synthetic, latency),
+        'ses': FakeSES(latency),
+    }
+    mocker.patch.object(clients, '_create_boto_client',
+                        lambda service, retries: fakes[service])
+    mocker.patch.object(clients, '_create_synapse_client',
+                        lambda: FakeSynapse(synthetic, latency))
+
+    mocker.patch.dict(os.environ, {'CASSETTE': 'record'})
+    recorded = _run(mocker, tmp_path, 'record')
+    recorded_sends = len(fakes['ses'].sent)
+
+    # replay creates no clients, and sends the same number of reports
+    mocker.patch.dict(os.environ, {'CASSETTE': 'replay'})
+    mocker.patch.object(clients, '_create_boto_client', side_effect=AssertionError)
+    mocker.patch.object(clients, '_create_synapse_client', side_effect=AssertionError)
+    replay = mocker.spy(cassette.Cassette, 'replay')
+    replayed = _run(mocker, tmp_path, 'replay')
+
+    replayed_sends = sum(1 for c in replay.call_args_list if c.args[2] == 'send_email')
+    assert replayed_sends == recorded_sends
+
+    report(f"Cassette for {accounts} accounts, {owners} owners, {resources} resources each, "
+           f"{latency}s per API call",
+           [('run', 'seconds', 'cassette KiB'),
+            ('record', f"{recorded:.3f}", f"{cassette_file.stat().st_size / 1024:.0f}"),
+            ('replay', f"{replayed:.3f}", '')])
@@ -0,0 +1,138 @@
+import os
+import time
+import tracemalloc
+
+import pytest
+
+from email_totals import app, clients, ses, synapse
+
+from .stubs import report
+from .synthetic import (FakeCostExplorer, FakeOrganizations, FakeSES, FakeSynapse,
+                        PhaseRecorder, SyntheticOrg)
+
+# The scale can be raised for manual runs, e.g.
+# BENCHMARK_OWNERS=5000 BENCHMARK_LATENCY=0.05 pytest tests/benchmark -s -k end_to_end
+accounts = int(os.environ.get('BENCHMARK_ACCOUNTS', '100'))
+owners = int(os.environ.get('BENCHMARK_OWNERS', '500'))
+resources = int(os.environ.get('BENCHMARK_RESOURCES', '5'))
+latency = float(os.environ.get('BENCHMARK_LATENCY', '0.002'))
+seed = int(os.environ.get('BENCHMARK_SEED', '0'))
+
+env_vars = {
+    'MINIMUM': '0.0',
+    'RESTRICT': 'False',
+    'APPROVED': '',
+    'SKIPLIST': '',
+    'CC_LIST': '',
+    'SENDER': 'sender@example.com',
+    'ADMIN_EMAIL': 'admin@example.com',
+    'SYNAPSE_TEAM_ID': '273957',
+    'SYNAPSE_TEAM_DOMAIN': '@synapse.org',
+    'CHECKPOINT': 'none',
+    'SHARD_COUNT': '1',
+}
+
+
+def _install(synthetic):
+    fakes = {
+        'ce': FakeCostExplorer(synthetic, latency),
+        'organizations': FakeOrganizations(synthetic, latency),
+        'ses': FakeSES(latency),
+        'synapse': FakeSynapse(synthetic, latency),
+    }
+    for name, fake in fakes.items():
+        clients.set_client(name, fake)
+    return fakes
+
+
+def _run(mocker, fakes):
+    """
+    Run the lambda handler end to end, and return the phase recorder and
+    the total elapsed seconds
+    """
+
+    recorder = PhaseRecorder(fakes)
+    phases = (
+        (synapse, 'get_team_sage_members', 'synapse'),
+        (app, 'build_owner_totals', 'totals'),
+        (app, 'audit_recipients', 'audit'),
+        (app, 'send_user_reports', 'send'),
+        (app, 'stream_user_reports', 'stream'),
+        (ses, 'build_unowned_email_body', 'unowned'),
+        (ses, 'send_unowned_email', 'unowned'),
+    )
+    patches = [mocker.patch.object(module, name, recorder.wrap(phase, getattr(module, name)))
+               for module, name, phase in phases]
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    app.lambda_handler({}, None)
+    elapsed = time.perf_counter() - start
+    tracemalloc.stop()
+
+    for patch in patches:
+        mocker.stop(patch)
+
+    return recorder, elapsed
+
+
+def _api_calls(fakes):
+    calls = {}
+    for name, fake in fakes.items():
+        for operation, count in fake.calls.items():
+            calls[f"{name}.{operation}"] = count
+    return calls
+
+
+def test_synthetic_reproducible():
+    first = SyntheticOrg(accounts=20, owners=50, seed=1)
+    second = SyntheticOrg(accounts=20, owners=50, seed=1)
+    other = SyntheticOrg(accounts=20, owners=50, seed=2)
+
+    assert first.resources == second.resources
+    assert first.account_owners == second.account_owners
+    assert first.resources != other.resources
+
+
+@pytest.mark.parametrize("mode", ['default', 'bulk', 'streaming'])
+def test_end_to_end(mocker, tmp_path, mode):
+    mocker.patch.dict(os.environ, env_vars)
+    mocker.patch.object(synapse, 'roster_cache_root', str(tmp_path / 'synapse'))
+    mocker.patch.dict(os.environ, {
+        'BULK_SEND': str(mode == 'bulk'),
+        'STREAMING': str(mode == 'streaming'),
+    })
+    mocker.patch.object(ses, '_report_template_ready', False)
+
+    synthetic = SyntheticOrg(accounts=accounts, owners=owners, resources=resources, seed=seed)
+    fakes = _install(synthetic)
+
+    rows = [('run', 'phase', 'seconds', 'API calls', 'peak MiB')]
+    calls = {}
+
+    # The warm run reuses this execution environment's caches, like a retry or
+    # a re-run on the same day. The next monthly run starts cold.
+    for run in ('cold', 'warm'):
+        for fake in fakes.values():
+            fake.calls = {}
+            if isinstance(fake, FakeSES):
+                fake.sent = []
+
+        recorder, elapsed = _run(mocker, fakes)
+        for row in recorder.rows()[1:]:
+            rows.append((run, ) + row)
+        rows.append((run, 'total', f"{elapsed:.3f}", sum(_api_calls(fakes).values()), ''))
+        calls[run] = _api_calls(fakes)
+
+        # every valid owner gets exactly one report, and the admin gets the unowned report
+        sent = fakes['ses'].sent
+        assert sorted(sent) == sorted(synthetic.valid_owners() | {'admin@example.com'})
+
+    report(f"End to end ({mode}) for {accounts} accounts, {owners} owners, "
+           f"{resources} resources each, {latency}s per API call", rows)
+    report("API calls", [(op, calls['cold'].get(op, 0), calls['warm'].get(op, 0))
+                         for op in sorted(calls['cold'])])
+
+    # account owners and the team roster are cached for a warm run
+    assert 'organizations.list_tags_for_resource' not in calls['warm']
+    assert 'synapse.getTeamMembers' not in calls['warm']
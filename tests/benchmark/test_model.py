@@ -0,0 +1,90 @@
+import gc
+import tracemalloc
+
+from email_totals import app, ce
+
+from .stubs import report
+
+owner_count = 5000
+accounts_per_owner = 10
+account_count = 1000
+
+target_period = {'Start': '2023-01-01', 'End': '2023-02-01'}
+compare_period = {'Start': '2022-12-01', 'End': '2023-01-01'}
+
+
+def _pages():
+    """
+    Cost explorer results for 50k (owner, account) pairs in both periods,
+    with fresh strings for every group as if they were parsed from JSON
+    """
+
+    results = []
+    for period in (compare_period, target_period):
+        groups = []
+        for i in range(owner_count):
+            for j in range(accounts_per_owner):
+                account_id = f"{(i * 7 + j * 131) % account_count:012}"
+                groups.append({
+                    'Keys': [f"Owner Email$user{i}@sagebase.org", account_id],
+                    'Metrics': {ce.cost_metric: {'Amount': f"{i + j + 1.5}"}},
+                })
+        results.append({'TimePeriod': period, 'Groups': groups})
+    return [{'ResultsByTime': results}]
+
+
+def _dict_totals(pages):
+    """
+    The previous representation, with a dictionary per (owner, account) cell
+    """
+
+    target = {}
+    compare = {}
+    for start, group in ce.iter_period_groups(pages):
+        email = group['Keys'][0].split('$', maxsplit=1)[1].lower()
+        totals = target if start == target_period['Start'] else compare
+        totals[(email, group['Keys'][1])] = float(group['Metrics'][ce.cost_metric]['Amount'])
+
+    resources = {}
+    for (email, account_id), amount in target.items():
+        usage = resources.setdefault(email, {'resources': {}})['resources']
+        usage[account_id] = {'total': amount, 'change': amount / compare[(email, account_id)] - 1}
+    return resources
+
+
+def _retained(build):
+    """
+    Build a result from fresh pages and measure the memory it retains
+    """
+
+    pages = _pages()
+    gc.collect()
+    tracemalloc.start()
+    result = build(pages)
+    del pages
+    gc.collect()
+    retained, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, retained
+
+
+def test_summary_memory(mocker):
+    pairs = owner_count * accounts_per_owner
+
+    def _compact(pages):
+        mocker.patch('email_totals.ce.get_ce_email_costs', return_value=pages)
+        return app.get_resource_totals(target_period, compare_period, 0)
+
+    baseline, dict_bytes = _retained(_dict_totals)
+    compact, compact_bytes = _retained(_compact)
+
+    # the compact model reads the same as the dictionaries
+    assert compact == baseline
+
+    report(f"Resource totals for {pairs} (owner, account) pairs", [
+        ('model', 'MB', 'bytes/pair'),
+        ('dicts', f"{dict_bytes / 1e6:.1f}", dict_bytes // pairs),
+        ('compact', f"{compact_bytes / 1e6:.1f}", compact_bytes // pairs),
+    ])
+
+    assert compact_bytes < dict_bytes / 2
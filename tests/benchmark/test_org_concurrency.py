@@ -0,0 +1,65 @@
+import os
+
+from email_totals import clients, org
+
+from .stubs import LatencyPaginatorClient, report, timed
+
+latency = 0.005
+accounts = [f"{i:012}" for i in range(100)]
+
+
+def _pages(operation, ResourceId=None):
+    if operation == 'list_accounts':
+        # list_accounts returns at most 20 accounts per page
+        for i in range(0, len(accounts), 20):
+            yield {'Accounts': [{'Id': a} for a in accounts[i:i + 20]]}
+    else:
+        owner = f"owner{int(ResourceId) % 10}@sagebase.org"
+        yield {'Tags': [{'Key': org.account_owner_tag, 'Value': owner}]}
+
+
+def test_org_concurrency_scaling(mocker):
+    client = LatencyPaginatorClient(latency, _pages)
+    clients.set_client('organizations', client)
+
+    # measure the lookups themselves, not the account cache
+    mocker.patch.dict(os.environ, {'ACCOUNT_CACHE_TTL': '0'})
+
+    rows = [('workers', 'seconds', 'speedup')]
+    serial = None
+    expected = None
+    for max_workers in (1, 2, 4, 8):
+        owners, elapsed = timed(org.get_account_owners, max_workers)
+
+        # the result is the same regardless of concurrency
+        if expected is None:
+            expected = owners
+            serial = elapsed
+        assert owners == expected
+
+        rows.append((max_workers, f"{elapsed:.3f}", f"{serial / elapsed:.1f}x"))
+
+    report(f"Account owner lookup for {len(accounts)} accounts "
+           f"at {latency}s per call", rows)
+
+    assert sum(len(a) for a in expected.values()) == len(accounts)
+
+    # allow plenty of slack for noisy CI runners
+    assert elapsed < serial / 2
+
+
+def test_org_cache(mocker):
+    client = LatencyPaginatorClient(latency, _pages)
+    clients.set_client('organizations', client)
+    mocker.patch.dict(os.environ, {'ACCOUNT_CACHE_TTL': '3600'})
+
+    rows = [('run', 'seconds', 'API calls')]
+    for run in ('cold', 'warm'):
+        client.calls = {}
+        _, elapsed = timed(org.get_account_owners, 4)
+        rows.append((run, f"{elapsed:.3f}", sum(client.calls.values())))
+
+    report(f"Account owner lookup for {len(accounts)} accounts with cache", rows)
+
+    # a warm run is served entirely from the cache
+    assert client.calls == {}
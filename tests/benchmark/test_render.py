@@ -0,0 +1,90 @@
+import logging
+import random
+
+import pytest
+
+from email_totals import render, ses
+
+from .stubs import report, timed
+
+account_count = 5000
+user_count = 10000
+
+account_names = {f"{i:012}": f"account-{i}" for i in range(account_count)}
+account_ids = list(account_names)
+
+
+@pytest.fixture(autouse=True)
+def quiet_logs():
+    # measure rendering rather than formatting the debug log of every body
+    for log in (ses.LOG, render.LOG):
+        log.setLevel(logging.INFO)
+    yield
+    for log in (ses.LOG, render.LOG):
+        log.setLevel(logging.DEBUG)
+
+
+def _usage(rng, count):
+    usage = {}
+    for account_id in rng.sample(account_ids, count):
+        usage[account_id] = {'total': rng.uniform(1, 5000)}
+        if rng.random() < 0.8:
+            usage[account_id]['change'] = rng.uniform(-1, 3)
+    return usage
+
+
+def _summaries(rng):
+    """
+    Synthetic user summaries, most users have a few rows and a few users
+    own a large share of the accounts
+    """
+
+    summaries = []
+    for i in range(user_count):
+        summary = {'resources': _usage(rng, rng.randint(1, 8))}
+        if i % 10 == 0:
+            summary['accounts'] = _usage(rng, rng.randint(1, 4))
+        if i % 7 == 0:
+            summary['missing_other_tag'] = {account_ids[i % account_count]: ['i-0abc', 'i-0def']}
+        if i % 500 == 0:
+            summary['accounts'] = _usage(rng, 2000)
+        summaries.append(summary)
+    return summaries
+
+
+def _render_all(summaries):
+    size = 0
+    for summary in summaries:
+        html, text = ses.build_user_email_body(summary, account_names)
+        size += len(html) + len(text)
+    return size
+
+
+def test_render_user_reports():
+    summaries = _summaries(random.Random(0))
+
+    size, elapsed = timed(_render_all, summaries)
+
+    report(f"Rendering {user_count} user reports over {account_count} accounts", [
+        ('seconds', 'reports/s', 'MB'),
+        (f"{elapsed:.3f}", f"{user_count / elapsed:.0f}", f"{size / 1e6:.1f}"),
+    ])
+
+
+def test_render_scales_linearly():
+    rng = random.Random(0)
+
+    rows = [('accounts', 'seconds', 'us/row')]
+    per_row = []
+    for count in (500, 2000, account_count):
+        summary = {'accounts': _usage(rng, count)}
+        _, elapsed = timed(lambda: [ses.build_user_email_body(summary, account_names)
+                                    for _ in range(10)])
+        per_row.append(elapsed / count)
+        rows.append((count, f"{elapsed:.3f}", f"{elapsed / count / 10 * 1e6:.2f}"))
+
+    report("Rendering a single large report (10 runs)", rows)
+
+    # cost per row shouldn't grow with the size of the report, allow plenty
+    # of slack for noisy CI runners
+    assert per_row[-1] < per_row[0] * 3
@@ -0,0 +1,53 @@
+import os
+
+from email_totals import clients, ses
+
+from .stubs import LatencyClient, report, timed
+
+latency = 0.02
+account_names = {'111122223333': 'test-account'}
+per_user = {
+    f"user{i}@sagebase.org": {
+        'resources': {'111122223333': {'total': 10.0, 'change': 0.1}},
+    } for i in range(40)
+}
+
+
+def test_send_concurrency_scaling(mocker):
+    mocker.patch.dict(os.environ, {'SENDER': 'test@example.com', 'CC_LIST': ''})
+
+    rows = [('workers', 'max rate', 'seconds', 'speedup')]
+    serial = None
+    for max_workers in (1, 4, 8):
+        client = LatencyClient(latency, {
+            'get_send_quota': {'MaxSendRate': 1000.0},
+            'send_email': {'MessageId': 'test'},
+        })
+        clients.set_client('ses', client)
+
+        results, elapsed = timed(ses.send_report_emails, per_user, account_names,
+                                 'Test Month', max_workers=max_workers)
+        assert all(r['status'] == 'sent' for r in results)
+        assert client.calls['send_email'] == len(per_user)
+
+        if serial is None:
+            serial = elapsed
+        rows.append((max_workers, 1000, f"{elapsed:.3f}", f"{serial / elapsed:.1f}x"))
+
+    # with a low send rate, the token bucket is the limit rather than latency
+    client = LatencyClient(latency, {
+        'get_send_quota': {'MaxSendRate': 20.0},
+        'send_email': {'MessageId': 'test'},
+    })
+    clients.set_client('ses', client)
+    _, paced = timed(ses.send_report_emails, per_user, account_names,
+                     'Test Month', max_workers=8)
+    rows.append((8, 20, f"{paced:.3f}", f"{serial / paced:.1f}x"))
+
+    report(f"Sending {len(per_user)} user reports at {latency}s per call", rows)
+
+    # allow plenty of slack for noisy CI runners
+    assert elapsed < serial / 2
+
+    # 40 sends at 20/s with a full bucket of 20 take at least a second
+    assert paced >= 0.9
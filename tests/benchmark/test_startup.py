@@ -0,0 +1,60 @@
+import json
+import subprocess
+import sys
+
+from .stubs import report
+
+# Import the lambda entry point in a fresh interpreter, as on a cold start,
+# and report import time, peak memory allocated by the import, and whether
+# any heavy client libraries were loaded
+import_script = '''
+import json
+import sys
+import time
+import tracemalloc
+
+tracemalloc.start()
+start = time.perf_counter()
+import email_totals.app
+elapsed = time.perf_counter() - start
+_, peak = tracemalloc.get_traced_memory()
+
+from email_totals import clients
+print(json.dumps({
+    'seconds': elapsed,
+    'peak_bytes': peak,
+    'clients': list(clients.shared),
+    'boto3': 'boto3' in sys.modules,
+    'synapseclient': 'synapseclient' in sys.modules,
+}))
+'''
+
+# Same measurement for the client libraries alone, for comparison
+libraries_script = import_script.replace(
+    'import email_totals.app',
+    'import boto3, synapseclient',
+)
+
+
+def _measure(script):
+    output = subprocess.run([sys.executable, '-c', script],
+                            capture_output=True,
+                            check=True,
+                            text=True)
+    return json.loads(output.stdout)
+
+
+def test_import_time():
+    app = _measure(import_script)
+    libraries = _measure(libraries_script)
+
+    rows = [('import', 'seconds', 'peak MiB')]
+    for name, found in (('email_totals.app', app), ('boto3 + synapseclient', libraries)):
+        rows.append((name, f"{found['seconds']:.3f}", f"{found['peak_bytes'] / 2**20:.1f}"))
+    report("Cold start import cost", rows)
+
+    # No clients are created, and heavy libraries are not imported,
+    # until an invocation needs them
+    assert app['clients'] == []
+    assert not app['boto3']
+    assert not app['synapseclient']
@@ -0,0 +1,96 @@
+import os
+import time
+import tracemalloc
+
+from email_totals import app, clients, ses
+
+from .stubs import LatencyClient, report
+
+owner_count = 2000
+audit_latency = 0.05
+send_latency = 0.001
+
+account_names = {f"{i:012}": f"account-{i}" for i in range(500)}
+account_ids = list(account_names)
+
+
+def _owner_totals(target_period, compare_period):
+    data = {}
+    for i in range(owner_count):
+        resources = {}
+        for j in range(10):
+            resources[account_ids[(i + j * 37) % len(account_ids)]] = {'total': i + j, 'change': 0.1}
+        data[f"user{i}@sagebase.org"] = {'resources': resources}
+    return data, account_names, {}
+
+
+def _audit_batch(owners):
+    time.sleep(audit_latency)
+    return {o: ({account_ids[0]: [f"i-{o}-{n}" for n in range(20)]}, {}) for o in owners}
+
+
+def _run(mocker, streaming):
+    mocker.patch('email_totals.app.build_owner_totals', side_effect=_owner_totals)
+    mocker.patch('email_totals.app.audit_other_tags_batch', side_effect=_audit_batch)
+
+    client = LatencyClient(send_latency, {
+        'get_send_quota': {'MaxSendRate': 100000.0},
+        'send_email': {'MessageId': 'test'},
+    })
+    clients.set_client('ses', client)
+
+    sent = []
+    send = client.send_email
+
+    def _send_email(**kwargs):
+        sent.append(time.perf_counter())
+        return send(**kwargs)
+
+    mocker.patch.object(client, 'send_email', _send_email, create=True)
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    if streaming:
+        _, _, results = app.stream_user_reports({}, {}, frozenset(), 'Test Month')
+    else:
+        summary = app.build_summary({}, {}, frozenset())
+        results = ses.send_report_emails(summary['per_user_summary'],
+                                         summary['account_names'],
+                                         'Test Month')
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    assert len(results) == owner_count
+    assert all(r['status'] == 'sent' for r in results)
+    return sent[0] - start, elapsed, peak
+
+
+def test_streaming_first_email(mocker):
+    env_vars = {
+        'MINIMUM': '1.0',
+        'AUDIT_CONCURRENCY': '4',
+        'AUDIT_BATCH_SIZE': '50',
+        'SEND_CONCURRENCY': '4',
+        'STREAM_QUEUE_DEPTH': '16',
+        'SENDER': 'test@example.com',
+        'CC_LIST': '',
+    }
+    mocker.patch.dict(os.environ, env_vars)
+    mocker.patch('email_totals.ses.valid_recipient', return_value=True)
+
+    rows = [('mode', 'first email (s)', 'total (s)', 'peak MB')]
+    found = {}
+    for streaming in (False, True):
+        first, elapsed, peak = _run(mocker, streaming)
+        found[streaming] = (first, peak)
+        rows.append(('streaming' if streaming else 'batch',
+                     f"{first:.3f}", f"{elapsed:.3f}", f"{peak / 1e6:.1f}"))
+
+    report(f"Reports for {owner_count} owners, {audit_latency}s per audit batch", rows)
+
+    # the first email goes out after one audit batch instead of all of them
+    assert found[True][0] < found[False][0] / 2
+
+    # audited summaries are released as they are sent
+    assert found[True][1] < found[False][1]
@@ -0,0 +1,48 @@
+import os
+import random
+
+from email_totals import app, ce
+
+from .stubs import report, timed
+
+owner_count = 5000
+accounts_per_owner = 20
+account_count = 1000
+
+target_period = {'Start': '2023-01-01', 'End': '2023-02-01'}
+compare_period = {'Start': '2022-12-01', 'End': '2023-01-01'}
+
+
+def _pages():
+    rng = random.Random(0)
+
+    results = []
+    for period in (compare_period, target_period):
+        groups = []
+        for i in range(owner_count):
+            for j in range(accounts_per_owner):
+                groups.append({
+                    'Keys': [f"Owner Email$user{i}@sagebase.org",
+                             f"{rng.randrange(account_count):012}"],
+                    'Metrics': {ce.cost_metric: {'Amount': f"{rng.uniform(0, 100):.6f}"}},
+                })
+        results.append({'TimePeriod': period, 'Groups': groups})
+    return [{'ResultsByTime': results}]
+
+
+def test_vectorized_resource_totals(mocker):
+    pages = _pages()
+    mocker.patch('email_totals.ce.get_ce_email_costs', return_value=pages)
+
+    rows = [('path', 'seconds')]
+    found = {}
+    for vectorize in ('False', 'True'):
+        mocker.patch.dict(os.environ, {'VECTORIZE': vectorize})
+        found[vectorize], elapsed = timed(app.get_resource_totals,
+                                          target_period, compare_period, 1.0)
+        rows.append(('numpy' if vectorize == 'True' else 'python', f"{elapsed:.3f}"))
+
+    report(f"Resource totals for {owner_count * accounts_per_owner * 2} "
+           f"cost explorer groups", rows)
+
+    assert found['True'] == found['False']
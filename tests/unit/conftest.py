@@ -3,10 +3,23 @@ import os
 import pytest
 
 
-# This needs to be set when the modules are loaded,
+# This needs to be set when the clients are created,
 # but its value is not used when running tests
 os.environ['AWS_DEFAULT_REGION'] = 'test-region'
-from email_totals import ce, ses
+from email_totals import cache, ce, clients, ses
+
+
+# Keep cached data and shared clients isolated to each test
+
+@pytest.fixture(autouse=True)
+def mock_cache(mocker, tmp_path):
+    mocker.patch.object(cache, 'cache_root', str(tmp_path))
+    mocker.patch.object(cache, 'memory', {})
+
+
+@pytest.fixture(autouse=True)
+def mock_clients(mocker):
+    mocker.patch.object(clients, 'shared', {})
 
 
 # Constants used by fixtures
@@ -16,6 +29,11 @@ ce_period = {
     'End': '2023-02-01'
 }
 
+ce_compare_period = {
+    'Start': '2022-12-01',
+    'End': '2023-01-01'
+}
+
 
 # Set up the test scenario used by all tests
 #
@@ -255,7 +273,15 @@ def mock_app_build_summary(mock_app_account_names,
 
 # CE fixtures
 
-def mock_ce_account_usage(account_totals):
+def mock_ce_span_usage(compare_data, target_data):
+    # A query spanning both months has a result for each month
+    response = dict(target_data)
+    response['ResultsByTime'] = (compare_data['ResultsByTime'] +
+                                 target_data['ResultsByTime'])
+    return response
+
+
+def mock_ce_account_usage(account_totals, period=ce_period):
     groups = []
 
     for account in account_totals:
@@ -275,7 +301,7 @@ def mock_ce_account_usage(account_totals):
         ],
         'ResultsByTime': [
             {
-                'TimePeriod': ce_period,
+                'TimePeriod': period,
                 'Total': {},
                 'Groups': groups,
                 'Estimated': True
@@ -326,10 +352,17 @@ def mock_ce_account_compare_data():
         account1_id: account1_total,
         account3_id: account3_total2,
     }
-    return mock_ce_account_usage(account_totals)
+    return mock_ce_account_usage(account_totals, ce_compare_period)
+
+
+@pytest.fixture()
+def mock_ce_account_span_data(mock_ce_account_compare_data,
+                              mock_ce_account_target_data):
+    return mock_ce_span_usage(mock_ce_account_compare_data,
+                              mock_ce_account_target_data)
 
 
-def mock_ce_email_usage(user_totals):
+def mock_ce_email_usage(user_totals, period=ce_period):
     groups = []
 
     for user, account_id, amount in user_totals:
@@ -353,7 +386,7 @@ def mock_ce_email_usage(user_totals):
         ],
         'ResultsByTime': [
             {
-                'TimePeriod': ce_period,
+                'TimePeriod': period,
                 'Total': {},
                 'Groups': groups,
                 'Estimated': False
@@ -384,7 +417,14 @@ def mock_ce_email_compare_data():
         (uncategorized, account1_id, account1_unowned_total),
         (uncategorized, account3_id, account3_total2),
     }
-    return mock_ce_email_usage(compare_totals)
+    return mock_ce_email_usage(compare_totals, ce_compare_period)
+
+
+@pytest.fixture()
+def mock_ce_email_span_data(mock_ce_email_compare_data,
+                            mock_ce_email_target_data):
+    return mock_ce_span_usage(mock_ce_email_compare_data,
+                              mock_ce_email_target_data)
 
 
 def mock_ce_response(account_id, resources):
@@ -424,11 +464,64 @@ def mock_ce_missing_tags_user3():
     return mock_ce_response(account3_id, account3_missing_ce)
 
 
+def mock_ce_owner_response(owner_resources):
+    groups = []
+
+    for owner, r in owner_resources:
+        group = {
+            'Keys': [f"Owner Email${owner}", r],
+            'Metrics': {}
+        }
+        groups.append(group)
+
+    response = {
+        'ResultsByTime': [
+            {
+                'TimePeriod': ce_period,
+                'Total': {},
+                'Groups': groups,
+            }
+        ]
+    }
+    return response
+
+
+@pytest.fixture()
+def mock_ce_missing_tags_by_owner():
+    owner_resources = [(user2, r) for r in account1_user2_missing]
+    owner_resources += [(user3.upper(), r) for r in account3_missing_ce]
+    return mock_ce_owner_response(owner_resources)
+
+
+@pytest.fixture()
+def mock_ce_missing_tags_by_account():
+    response = mock_ce_response(account1_id, account1_user2_missing)
+    response['ResultsByTime'][0]['Groups'].extend(
+        mock_ce_response(account3_id, account3_missing_ce)['ResultsByTime'][0]['Groups'])
+    return response
+
+
+@pytest.fixture()
+def mock_ce_invalid_tags_by_owner():
+    owner_resources = [(user1, r) for r in account1_user1_invalid_ce]
+    return mock_ce_owner_response(owner_resources)
+
+
+@pytest.fixture()
+def mock_ce_invalid_tags_by_account():
+    return mock_ce_response(account1_id, account1_user1_invalid_ce)
+
+
 @pytest.fixture()
 def mock_ce_period():
     return ce_period
 
 
+@pytest.fixture()
+def mock_ce_compare_period():
+    return ce_compare_period
+
+
 # Organizations fixtures
 
 @pytest.fixture()
@@ -549,10 +642,10 @@ def mock_syn_members():
 
 @pytest.fixture()
 def mock_team_sage():
-    response = [
+    response = frozenset([
         user1,
         user2,
-    ]
+    ])
 
     return response
 
@@ -1,9 +1,10 @@
+import copy
 import os
 from datetime import datetime
 
 import pytest
 
-from email_totals import app
+from email_totals import app, cassette, deadline, memory, metrics
 
 # fixtures for datetime processing around year boundaries
 
@@ -75,19 +76,17 @@ def test_report_periods(test_now,
 
 def test_resource_totals(mocker,
                          mock_ce_period,
-                         mock_ce_email_target_data,
-                         mock_ce_email_compare_data,
+                         mock_ce_compare_period,
+                         mock_ce_email_span_data,
                          mock_app_resource_dict):
-    mocker.patch('email_totals.ce.get_ce_email_costs',
-                 side_effect=[
-                     mock_ce_email_compare_data,
-                     mock_ce_email_target_data,
-                 ])
+    ce_mock = mocker.patch('email_totals.ce.get_ce_email_costs',
+                           return_value=[mock_ce_email_span_data, ])
 
-    # target and compare periods are passed through to patched functions
+    # both periods are fetched with a single query
     found_dict = app.get_resource_totals(mock_ce_period,
-                                         mock_ce_period,
+                                         mock_ce_compare_period,
                                          minimum)
+    ce_mock.assert_called_once_with(mock_ce_period, mock_ce_compare_period)
 
     assert found_dict == mock_app_resource_dict
 
@@ -95,23 +94,21 @@ def test_resource_totals(mocker,
 def test_account_totals(mocker,
                         mock_app_account_dict,
                         mock_app_account_names,
-                        mock_ce_account_target_data,
-                        mock_ce_account_compare_data,
+                        mock_ce_account_span_data,
                         mock_ce_period,
+                        mock_ce_compare_period,
                         mock_org_account_owners):
-    mocker.patch('email_totals.ce.get_ce_account_costs',
-                 side_effect=[
-                     mock_ce_account_compare_data,
-                     mock_ce_account_target_data,
-                 ])
+    ce_mock = mocker.patch('email_totals.ce.get_ce_account_costs',
+                           return_value=[mock_ce_account_span_data, ])
 
     mocker.patch('email_totals.org.get_account_owners',
                  return_value=mock_org_account_owners)
 
-    # period input doesn't matter since it's only passed to patched functions
+    # both periods are fetched with a single query
     found_dict, found_names = app.get_account_totals(mock_ce_period,
-                                                     mock_ce_period,
+                                                     mock_ce_compare_period,
                                                      minimum)
+    ce_mock.assert_called_once_with(mock_ce_period, mock_ce_compare_period)
     assert found_names == mock_app_account_names
     assert found_dict == mock_app_account_dict
 
@@ -120,7 +117,7 @@ def test_invalid_other_tag(mocker,
                            mock_app_invalid_tags_user1,
                            mock_ce_invalid_tags_user1):
     mocker.patch('email_totals.ce.get_ce_invalid_tag_for_email',
-                 return_value=mock_ce_invalid_tags_user1)
+                 return_value=[mock_ce_invalid_tags_user1, ])
 
     found_invalid_tags = app.get_invalid_other_tags('ignored')
     assert found_invalid_tags == mock_app_invalid_tags_user1
@@ -140,27 +137,219 @@ def test_missing_other_tag(mocker,
                            request):
     mock_ce_missing_tags = request.getfixturevalue(mock_ce_fixture)
     mocker.patch('email_totals.ce.get_ce_missing_tag_for_email',
-                 return_value=mock_ce_missing_tags)
+                 return_value=[mock_ce_missing_tags, ])
 
     expected_app_missing_tags = request.getfixturevalue(mock_app_fixture)
     found_missing_tags = app.get_missing_other_tags('ignored')
     assert found_missing_tags == expected_app_missing_tags
 
 
+def test_parse_multi_owner_tags(mock_ce_missing_tags_by_owner,
+                                mock_ce_missing_tags_by_account,
+                                mock_app_missing_tags_user2,
+                                mock_app_missing_tags_user3,
+                                mock_user2,
+                                mock_user3):
+    found = app._parse_ce_tag_results([mock_ce_missing_tags_by_owner, ],
+                                      [mock_ce_missing_tags_by_account, ])
+
+    # owner emails are downcased to match the summary
+    assert found == {
+        mock_user2: mock_app_missing_tags_user2,
+        mock_user3: mock_app_missing_tags_user3,
+    }
+
+
+def _share_resource(by_account, account_id='999988887777'):
+    # list the first resource in the account results under another account too
+    groups = by_account['ResultsByTime'][0]['Groups']
+    shared = copy.deepcopy(groups[0])
+    shared['Keys'][0] = account_id
+    groups.append(shared)
+    return shared['Keys'][1]
+
+
+def test_parse_multi_owner_tags_ambiguous(mock_ce_missing_tags_by_owner,
+                                          mock_ce_missing_tags_by_account,
+                                          mock_app_missing_tags_user2,
+                                          mock_app_missing_tags_user3,
+                                          mock_user2,
+                                          mock_user3):
+    resource = _share_resource(mock_ce_missing_tags_by_account)
+
+    ambiguous = set()
+    found = app._parse_ce_tag_results([mock_ce_missing_tags_by_owner, ],
+                                      [mock_ce_missing_tags_by_account, ],
+                                      ambiguous=ambiguous)
+
+    # the shared resource isn't attributed to either account
+    assert ambiguous == {mock_user2}
+    assert resource not in [r for rs in found[mock_user2].values() for r in rs]
+    assert found[mock_user3] == mock_app_missing_tags_user3
+
+
+def test_audit_other_tags_batch_ambiguous(mocker,
+                                          mock_ce_missing_tags_by_owner,
+                                          mock_ce_missing_tags_by_account,
+                                          mock_ce_invalid_tags_by_owner,
+                                          mock_ce_invalid_tags_by_account,
+                                          mock_app_invalid_tags_user1,
+                                          mock_app_missing_tags_user2,
+                                          mock_app_missing_tags_user3,
+                                          mock_user1,
+                                          mock_user2,
+                                          mock_user3):
+    _share_resource(mock_ce_missing_tags_by_account)
+
+    mocker.patch('email_totals.ce.get_ce_missing_tag_for_emails',
+                 return_value=([mock_ce_missing_tags_by_owner, ],
+                               [mock_ce_missing_tags_by_account, ]))
+    mocker.patch('email_totals.ce.get_ce_invalid_tag_for_emails',
+                 return_value=([mock_ce_invalid_tags_by_owner, ],
+                               [mock_ce_invalid_tags_by_account, ]))
+
+    # the owner of the shared resource falls back to the per-owner query
+    single = mocker.patch('email_totals.app.audit_other_tags',
+                          return_value=(mock_app_missing_tags_user2, {}))
+
+    found = app.audit_other_tags_batch([mock_user1, mock_user2, mock_user3])
+    single.assert_called_once_with(mock_user2)
+    assert found == {
+        mock_user1: ({}, mock_app_invalid_tags_user1),
+        mock_user2: (mock_app_missing_tags_user2, {}),
+        mock_user3: (mock_app_missing_tags_user3, {}),
+    }
+
+
+def test_audit_other_tags_batch(mocker,
+                                mock_ce_missing_tags_by_owner,
+                                mock_ce_missing_tags_by_account,
+                                mock_ce_invalid_tags_by_owner,
+                                mock_ce_invalid_tags_by_account,
+                                mock_app_invalid_tags_user1,
+                                mock_app_missing_tags_user2,
+                                mock_app_missing_tags_user3,
+                                mock_user1,
+                                mock_user2,
+                                mock_user3,
+                                mock_user4):
+    mocker.patch('email_totals.ce.get_ce_missing_tag_for_emails',
+                 return_value=([mock_ce_missing_tags_by_owner, ],
+                               [mock_ce_missing_tags_by_account, ]))
+
+    mocker.patch('email_totals.ce.get_ce_invalid_tag_for_emails',
+                 return_value=([mock_ce_invalid_tags_by_owner, ],
+                               [mock_ce_invalid_tags_by_account, ]))
+
+    owners = [mock_user1, mock_user2, mock_user3, mock_user4]
+    found = app.audit_other_tags_batch(owners)
+    assert found == {
+        mock_user1: ({}, mock_app_invalid_tags_user1),
+        mock_user2: (mock_app_missing_tags_user2, {}),
+        mock_user3: (mock_app_missing_tags_user3, {}),
+        mock_user4: ({}, {}),
+    }
+
+
+@pytest.mark.parametrize("batch_size", [0, 1, 3, 100])
+def test_audit_recipients(mocker, batch_size):
+    recipients = [f"user{i}" for i in range(5)]
+
+    def _audit(owner):
+        return {'missing': owner}, {}
+
+    def _audit_batch(owners):
+        return {o: _audit(o) for o in owners}
+
+    single = mocker.patch('email_totals.app.audit_other_tags',
+                          side_effect=_audit)
+    batch = mocker.patch('email_totals.app.audit_other_tags_batch',
+                         side_effect=_audit_batch)
+
+    found = app.audit_recipients(recipients, 2, batch_size)
+    assert found == [_audit(r) for r in recipients]
+
+    if batch_size:
+        assert batch.call_count == -(-len(recipients) // batch_size)
+        single.assert_not_called()
+    else:
+        assert single.call_count == len(recipients)
+        batch.assert_not_called()
+
+
+def test_audit_other_tags(mocker,
+                          mock_app_missing_tags_user2,
+                          mock_app_invalid_tags_user1):
+    mocker.patch('email_totals.app.get_missing_other_tags',
+                 return_value=mock_app_missing_tags_user2)
+
+    mocker.patch('email_totals.app.get_invalid_other_tags',
+                 return_value=mock_app_invalid_tags_user1)
+
+    found = app.audit_other_tags('ignored')
+    assert found == (mock_app_missing_tags_user2, mock_app_invalid_tags_user1)
+
+
 def test_build_summary(mocker,
                        mock_app_resource_dict,
                        mock_app_account_dict,
                        mock_app_account_names,
-                       mock_app_invalid_tags_user1,
-                       mock_app_missing_tags_user2,
-                       mock_app_missing_tags_user3,
-                       mock_app_unowned,
+                       mock_ce_missing_tags_by_owner,
+                       mock_ce_missing_tags_by_account,
+                       mock_ce_invalid_tags_by_owner,
+                       mock_ce_invalid_tags_by_account,
                        mock_app_build_summary,
                        mock_ce_period,
-                       mock_team_sage,
-                       mock_user1,
-                       mock_user2,
-                       mock_user3):
+                       mock_team_sage):
+    env_vars = {
+        'MINIMUM': str(minimum),
+    }
+    mocker.patch.dict(os.environ, env_vars)
+    os.environ.pop('AUDIT_BATCH_SIZE', None)
+
+    mocker.patch('email_totals.app.get_resource_totals',
+                 return_value=mock_app_resource_dict)
+
+    mocker.patch('email_totals.app.get_account_totals',
+                 return_value=(mock_app_account_dict, mock_app_account_names))
+
+    # Batched audits query by owner and by account, one page of each
+    missing = mocker.patch('email_totals.ce.get_ce_missing_tag_for_emails',
+                           return_value=(iter([mock_ce_missing_tags_by_owner, ]),
+                                         iter([mock_ce_missing_tags_by_account, ])))
+
+    invalid = mocker.patch('email_totals.ce.get_ce_invalid_tag_for_emails',
+                           return_value=(iter([mock_ce_invalid_tags_by_owner, ]),
+                                         iter([mock_ce_invalid_tags_by_account, ])))
+
+    single = mocker.patch('email_totals.app.audit_other_tags')
+
+    mocker.patch('email_totals.ses.valid_recipient',
+                 return_value=True)
+
+    found_summary = app.build_summary(mock_ce_period,
+                                      mock_ce_period,
+                                      mock_team_sage)
+
+    assert found_summary == mock_app_build_summary
+    missing.assert_called_once()
+    invalid.assert_called_once()
+    single.assert_not_called()
+
+
+def test_build_summary_per_owner(mocker,
+                                 mock_app_resource_dict,
+                                 mock_app_account_dict,
+                                 mock_app_account_names,
+                                 mock_app_invalid_tags_user1,
+                                 mock_app_missing_tags_user2,
+                                 mock_app_missing_tags_user3,
+                                 mock_app_build_summary,
+                                 mock_ce_period,
+                                 mock_team_sage,
+                                 mock_user1,
+                                 mock_user2,
+                                 mock_user3):
     # The mocker will call the side_effect function with the same
     # arguments that were passed to the patched function
     def _missing_tags_side_effect(email):
@@ -177,6 +366,8 @@ def test_build_summary(mocker,
 
     env_vars = {
         'MINIMUM': str(minimum),
+        'AUDIT_CONCURRENCY': '4',
+        'AUDIT_BATCH_SIZE': '0',
     }
     mocker.patch.dict(os.environ, env_vars)
 
@@ -192,6 +383,8 @@ def test_build_summary(mocker,
     mocker.patch('email_totals.app.get_invalid_other_tags',
                  side_effect=_invalid_tags_side_effect)
 
+    batch = mocker.patch('email_totals.app.audit_other_tags_batch')
+
     mocker.patch('email_totals.ses.valid_recipient',
                  return_value=True)
 
@@ -200,3 +393,146 @@ def test_build_summary(mocker,
                                       mock_team_sage)
 
     assert found_summary == mock_app_build_summary
+    batch.assert_not_called()
+
+
+priority_data = {
+    # $30 spend, up $10 from $20
+    'a@example.com': {'resources': {'111122223333': {'total': 30.0, 'change': 0.5}}},
+    # $100 spend, unchanged
+    'b@example.com': {'accounts': {'222233334444': {'total': 100.0, 'change': 0.0}}},
+    # $15 spend across resources and accounts, all new
+    'c@example.com': {'resources': {'111122223333': {'total': 5.0}},
+                      'accounts': {'333344445555': {'total': 10.0}}},
+    # $40 spend, down $40 from $80
+    'd@example.com': {'resources': {'111122223333': {'total': 40.0, 'change': -0.5}},
+                      'missing_other_tag': {'111122223333': ['i-0abcdefg']}},
+}
+
+
+@pytest.mark.parametrize(
+    "order,expected",
+    [
+        ('spend', ['b@example.com', 'd@example.com', 'a@example.com', 'c@example.com']),
+        ('change', ['d@example.com', 'c@example.com', 'a@example.com', 'b@example.com']),
+        ('none', list(priority_data)),
+    ]
+)
+def test_prioritize_recipients(mocker, order, expected):
+    mocker.patch.dict(os.environ, {'SEND_ORDER': order})
+
+    found = app.prioritize_recipients(list(priority_data), priority_data)
+    assert found == expected
+
+
+def test_owner_priority():
+    entry = priority_data['d@example.com']
+    assert app.owner_priority(entry, 'spend') == 40.0
+    assert app.owner_priority(entry, 'change') == pytest.approx(40.0)
+    assert app.owner_priority({}, 'spend') == 0.0
+
+
+def test_owner_priority_owned_account():
+    # resources in an account the owner also owns are only counted once,
+    # as part of the account total, like the report shows them
+    entry = {'resources': {'111122223333': {'total': 30.0, 'change': 0.5},
+                           '222233334444': {'total': 5.0, 'change': 0.0}},
+             'accounts': {'111122223333': {'total': 50.0, 'change': 0.0}}}
+    assert app.owner_priority(entry, 'spend') == 55.0
+    assert app.owner_priority(entry, 'change') == 0.0
+
+
+@pytest.mark.parametrize("batch_size", [0, 2])
+def test_stream_user_reports(mocker,
+                             mock_app_resource_dict,
+                             mock_app_account_dict,
+                             mock_app_account_names,
+                             mock_app_invalid_tags_user1,
+                             mock_app_missing_tags_user2,
+                             mock_app_missing_tags_user3,
+                             mock_app_build_summary,
+                             mock_ce_period,
+                             mock_team_sage,
+                             mock_user1,
+                             mock_user2,
+                             mock_user3,
+                             batch_size):
+    def _audit(email):
+        missing = {mock_user2: mock_app_missing_tags_user2,
+                   mock_user3: mock_app_missing_tags_user3}.get(email, {})
+        invalid = {mock_user1: mock_app_invalid_tags_user1}.get(email, {})
+        return missing, invalid
+
+    env_vars = {
+        'MINIMUM': str(minimum),
+        'AUDIT_CONCURRENCY': '2',
+        'AUDIT_BATCH_SIZE': str(batch_size),
+        'STREAM_QUEUE_DEPTH': '1',
+        'SEND_CONCURRENCY': '2',
+    }
+    mocker.patch.dict(os.environ, env_vars)
+
+    mocker.patch('email_totals.app.get_resource_totals',
+                 return_value=mock_app_resource_dict)
+    mocker.patch('email_totals.app.get_account_totals',
+                 return_value=(mock_app_account_dict, mock_app_account_names))
+    mocker.patch('email_totals.app.audit_other_tags',
+                 side_effect=_audit)
+    mocker.patch('email_totals.app.audit_other_tags_batch',
+                 side_effect=lambda owners: {o: _audit(o) for o in owners})
+    mocker.patch('email_totals.ses.valid_recipient',
+                 return_value=True)
+
+    sent = {}
+
+    def _send_report(recipient, summary):
+        sent[recipient] = summary
+        return {'recipient': recipient, 'status': 'sent', 'message_id': recipient}
+
+    sender = mocker.patch('email_totals.ses.report_sender',
+                          return_value=_send_report)
+
+    found_names, found_unowned, found_results = app.stream_user_reports(mock_ce_period,
+                                                                        mock_ce_period,
+                                                                        mock_team_sage,
+                                                                        'Test Month')
+
+    expected = mock_app_build_summary['per_user_summary']
+    assert sent == expected
+    assert sorted(r['recipient'] for r in found_results) == sorted(expected)
+    assert found_names == mock_app_build_summary['account_names']
+    assert found_unowned == mock_app_build_summary['unowned']
+    sender.assert_called_once_with(mock_app_account_names, 'Test Month')
+
+
+def test_lambda_handler_nested(mocker):
+    mocker.patch.dict(os.environ, {'METRICS': 'True', 'MEMORY_PROFILE': 'False'})
+    context = mocker.Mock()
+    context.get_remaining_time_in_millis.return_value = 60000
+
+    starts = mocker.spy(metrics, 'start')
+    flushes = mocker.spy(metrics, 'flush')
+    finishes = mocker.spy(memory, 'finish')
+    saves = mocker.patch.object(cassette, 'save')
+    remaining = []
+
+    def _handle_event(event, context):
+        remaining.append(deadline.remaining())
+        if 'shard' not in event:
+            # an in-process shard runs inside the coordinator's run
+            app.lambda_handler({'shard': {}}, None)
+        return event
+
+    mocker.patch('email_totals.app.handle_event', side_effect=_handle_event)
+
+    assert app.lambda_handler({}, context) == {}
+
+    # only the outermost call starts and finishes the run
+    assert starts.call_count == 1
+    assert flushes.call_count == 1
+    assert finishes.call_count == 1
+    saves.assert_called_once()
+
+    # the shard keeps the coordinator's deadline
+    assert None not in remaining
+    assert deadline.remaining() is None
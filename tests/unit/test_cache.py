@@ -0,0 +1,52 @@
+import os
+import time
+
+from email_totals import cache
+
+
+def test_store_and_load():
+    data = {'key': ['value', 1]}
+    cache.store('test', data)
+    assert cache.load('test') == data
+
+    # clear process memory to simulate a cold start
+    cache.memory.clear()
+    assert cache.load('test') == data
+
+
+def test_load_missing():
+    assert cache.load('missing') is None
+
+
+def test_load_unreadable():
+    os.makedirs(cache.cache_root, exist_ok=True)
+    with open(os.path.join(cache.cache_root, 'broken.json'), 'w') as f:
+        f.write('{not json')
+
+    assert cache.load('broken') is None
+
+
+def test_is_fresh():
+    assert cache.is_fresh(time.time(), 60)
+    assert not cache.is_fresh(time.time() - 120, 60)
+    assert not cache.is_fresh(None, 60)
+    assert not cache.is_fresh(time.time(), 0)
+
+
+def test_list_writer():
+    writer = cache.ListWriter('pages')
+    writer.append({'page': 1})
+    writer.append({'page': 2})
+
+    # nothing is stored until the list is committed
+    assert cache.load('pages') is None
+
+    writer.commit()
+    writer.discard()
+    assert cache.load('pages') == [{'page': 1}, {'page': 2}]
+
+    discarded = cache.ListWriter('discarded')
+    discarded.append({'page': 1})
+    discarded.discard()
+    assert cache.load('discarded') is None
+    assert os.listdir(cache.cache_root) == ['pages.json']
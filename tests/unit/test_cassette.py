@@ -0,0 +1,126 @@
+import gzip
+import json
+import os
+
+import pytest
+from botocore.exceptions import ClientError
+
+from email_totals import cassette, clients
+
+
+class _FakePaginator:
+    def paginate(self, **kwargs):
+        yield {'Tags': [{'Key': 'Owner Email', 'Value': 'Owner@example.com'}]}
+        yield {'Tags': [{'Key': 'Name', 'Value': kwargs['ResourceId']}]}
+
+
+class _FakeClient:
+    calls = 0
+
+    def get_paginator(self, operation):
+        return _FakePaginator()
+
+    def get_team_members(self, team):
+        _FakeClient.calls += 1
+        for name in ('Alice', 'bob'):
+            yield {'member': {'userName': name}}
+
+    def send_email(self, **kwargs):
+        _FakeClient.calls += 1
+        if kwargs['Destination']['ToAddresses'] == ['bounce@example.com']:
+            raise ClientError({'Error': {'Code': 'MessageRejected'}}, 'SendEmail')
+        return {'MessageId': 'message-1'}
+
+
+@pytest.fixture()
+def cassette_file(mocker, tmp_path):
+    mocker.patch.object(cassette, '_cassette', None)
+    path = tmp_path / 'cassette.json.gz'
+    mocker.patch.dict(os.environ, {'CASSETTE_FILE': str(path)})
+    return path
+
+
+def _exercise(client):
+    pages = list(client.get_paginator('list_tags_for_resource').paginate(ResourceId='111'))
+    members = list(client.get_team_members(273957))
+    sent = client.send_email(Destination={'ToAddresses': ['alice@synapse.org']})
+    with pytest.raises(ClientError) as e:
+        client.send_email(Destination={'ToAddresses': ['bounce@example.com']})
+    return pages, members, sent, e.value.response['Error']['Code']
+
+
+def test_scrub():
+    assert cassette.scrub('To: Alice@synapse.org') == f"To: {cassette.pseudonym('alice')}@synapse.org"
+    assert cassette.scrub({'member': {'userName': 'alice'}}) == \
+        {'member': {'userName': cassette.pseudonym('alice')}}
+    assert cassette.scrub(['no email', 1, None]) == ['no email', 1, None]
+
+    # synapse user names and emails at the synapse domain match after scrubbing
+    user_name = cassette.scrub({'userName': 'Alice'})['userName']
+    assert f"{user_name}@synapse.org" == cassette.scrub('alice@synapse.org')
+
+
+def test_disabled(mocker):
+    mocker.patch.dict(os.environ, {'CASSETTE': 'none'})
+    client = _FakeClient()
+    assert clients.get_client('fake', lambda: client) is client
+
+
+def test_record_and_replay(mocker, cassette_file):
+    mocker.patch.dict(os.environ, {'CASSETTE': 'record', 'CASSETTE_SCRUB': 'False'})
+    recorded = _exercise(clients.get_client('fake', _FakeClient))
+    cassette.save()
+
+    with gzip.open(cassette_file, 'rt') as f:
+        data = json.load(f)
+    assert data['version'] == cassette.cassette_version
+    assert [i['operation'] for i in data['interactions']] == [
+        'paginate.list_tags_for_resource', 'paginate.list_tags_for_resource',
+        'get_team_members', 'send_email', 'send_email']
+
+    # replay serves every call from the cassette without creating the client
+    mocker.patch.object(cassette, '_cassette', None)
+    mocker.patch.object(clients, 'shared', {})
+    mocker.patch.dict(os.environ, {'CASSETTE': 'replay'})
+    factory = mocker.Mock()
+    calls = _FakeClient.calls
+
+    assert _exercise(clients.get_client('fake', factory)) == recorded
+    factory.assert_not_called()
+    assert _FakeClient.calls == calls
+
+
+def test_record_scrubbed(mocker, cassette_file):
+    mocker.patch.dict(os.environ, {'CASSETTE': 'record'})
+    pages, members, _, _ = _exercise(clients.get_client('fake', _FakeClient))
+    cassette.save()
+
+    # the recorded run sees real data
+    assert members[0]['member']['userName'] == 'Alice'
+    assert pages[0]['Tags'][0]['Value'] == 'Owner@example.com'
+
+    text = gzip.open(cassette_file, 'rt').read()
+    assert 'alice' not in text.lower()
+    assert 'owner@example.com' not in text.lower()
+    assert cassette.pseudonym('alice') in text
+
+
+def test_replay_unmatched(mocker):
+    mocker.patch.dict(os.environ, {'CASSETTE': 'replay'})
+    recording = cassette.Cassette()
+    recording.record('ce', 'get_cost_and_usage', {'Start': '2023-01-01'}, {'page': 1})
+    recording.record('ce', 'get_cost_and_usage', {'Start': '2023-01-01'}, {'page': 2})
+    mocker.patch.object(cassette, '_cassette', cassette.Cassette(recording.interactions))
+
+    client = clients.get_client('ce', mocker.Mock())
+
+    # different parameters replay the recorded calls in order
+    assert client.get_cost_and_usage(Start='2024-01-01') == {'page': 1}
+    assert client.get_cost_and_usage(Start='2023-01-01') == {'page': 2}
+
+    # the last match is repeated once recorded calls are used up
+    assert client.get_cost_and_usage(Start='2023-01-01') == {'page': 2}
+
+    with pytest.raises(KeyError):
+        client.get_dimension_values()
+
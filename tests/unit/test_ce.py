@@ -5,36 +5,98 @@ from email_totals import ce
 
 
 def test_ce_accounts(mock_ce_period,
-                     mock_ce_account_target_data):
-    with Stubber(ce.ce_client) as _stub:
-        _stub.add_response('get_cost_and_usage', mock_ce_account_target_data)
+                     mock_ce_compare_period,
+                     mock_ce_account_span_data):
+    with Stubber(ce.get_ce_client()) as _stub:
+        expected_params = {
+            'TimePeriod': {
+                'Start': mock_ce_compare_period['Start'],
+                'End': mock_ce_period['End'],
+            },
+            'Granularity': 'MONTHLY',
+            'Metrics': [ce.cost_metric],
+            'GroupBy': [{'Type': 'DIMENSION', 'Key': 'LINKED_ACCOUNT'}],
+        }
+        _stub.add_response('get_cost_and_usage',
+                           mock_ce_account_span_data,
+                           expected_params)
 
-        # validate our stub response against boto
-        ce.get_ce_account_costs(mock_ce_period)
+        # validate our stub response against boto, with a single query
+        # spanning both periods
+        list(ce.get_ce_account_costs(mock_ce_period, mock_ce_compare_period))
 
         # assert that the client function was called
         _stub.assert_no_pending_responses()
 
 
 def test_ce_emails(mock_ce_period,
-                   mock_ce_email_target_data):
-    with Stubber(ce.ce_client) as _stub:
-        _stub.add_response('get_cost_and_usage', mock_ce_email_target_data)
+                   mock_ce_compare_period,
+                   mock_ce_email_span_data):
+    with Stubber(ce.get_ce_client()) as _stub:
+        _stub.add_response('get_cost_and_usage', mock_ce_email_span_data)
 
         # validate our stub response against boto
-        ce.get_ce_email_costs(mock_ce_period)
+        list(ce.get_ce_email_costs(mock_ce_period, mock_ce_compare_period))
 
         # assert that the client function was called
         _stub.assert_no_pending_responses()
 
 
+def test_iter_period_groups(mock_ce_period,
+                            mock_ce_compare_period,
+                            mock_ce_account_span_data):
+    found = list(ce.iter_period_groups([mock_ce_account_span_data, ]))
+
+    # compare month results come first, then the target month
+    compare_start = mock_ce_compare_period['Start']
+    target_start = mock_ce_period['Start']
+    assert [start for start, _ in found] == [compare_start] * 2 + [target_start] * 5
+
+
+def test_ce_pagination(mock_ce_period,
+                       mock_ce_compare_period,
+                       mock_ce_account_compare_data,
+                       mock_ce_account_target_data):
+    # split the results for each month into separate pages
+    first_page = dict(mock_ce_account_compare_data, NextPageToken='token')
+    second_page = mock_ce_account_target_data
+
+    with Stubber(ce.get_ce_client()) as _stub:
+        _stub.add_response('get_cost_and_usage', first_page)
+        expected_params = {
+            'TimePeriod': {
+                'Start': mock_ce_compare_period['Start'],
+                'End': mock_ce_period['End'],
+            },
+            'Granularity': 'MONTHLY',
+            'Metrics': [ce.cost_metric],
+            'GroupBy': [{'Type': 'DIMENSION', 'Key': 'LINKED_ACCOUNT'}],
+            'NextPageToken': 'token',
+        }
+        _stub.add_response('get_cost_and_usage', second_page, expected_params)
+
+        pages = ce.get_ce_account_costs(mock_ce_period, mock_ce_compare_period)
+
+        # groups are yielded as each page arrives
+        attributes = []
+        groups = ce.iter_period_groups(pages, attributes)
+        assert next(groups)[0] == mock_ce_compare_period['Start']
+        found = [start for start, _ in groups]
+
+        assert found == [mock_ce_compare_period['Start']] + [mock_ce_period['Start']] * 5
+        assert len(attributes) == 10
+
+        # assert the token was followed to the last page
+        _stub.assert_no_pending_responses()
+
+
 def test_ce_invalid_tags(mock_ce_invalid_tags_user1):
-    with Stubber(ce.ce_client) as _stub:
+    with Stubber(ce.get_ce_client()) as _stub:
         _stub.add_response('get_cost_and_usage_with_resources',
                            mock_ce_invalid_tags_user1)
 
         # validate our response
-        ce.get_ce_invalid_tag_for_email('email')
+        list(ce.get_ce_invalid_tag_for_email('email'))
 
         # assert no other responses
         _stub.assert_no_pending_responses()
@@ -50,12 +112,146 @@ def test_ce_invalid_tags(mock_ce_invalid_tags_user1):
 def test_ce_missing_tags(mock_ce_fixture,
                          request):
     mock_ce_missing_tag_resources = request.getfixturevalue(mock_ce_fixture)
-    with Stubber(ce.ce_client) as _stub:
+    with Stubber(ce.get_ce_client()) as _stub:
         _stub.add_response('get_cost_and_usage_with_resources',
                            mock_ce_missing_tag_resources)
 
         # validate our stub response against boto
-        ce.get_ce_missing_tag_for_email('email')
+        list(ce.get_ce_missing_tag_for_email('email'))
 
         # assert that the client function was called
         _stub.assert_no_pending_responses()
+
+
+@pytest.mark.parametrize(
+    "ce_function,mock_owner_fixture,mock_account_fixture",
+    [
+        (ce.get_ce_missing_tag_for_emails,
+         "mock_ce_missing_tags_by_owner",
+         "mock_ce_missing_tags_by_account"),
+        (ce.get_ce_invalid_tag_for_emails,
+         "mock_ce_invalid_tags_by_owner",
+         "mock_ce_invalid_tags_by_account"),
+    ]
+)
+def test_ce_tags_for_emails(ce_function,
+                            mock_owner_fixture,
+                            mock_account_fixture,
+                            request):
+    mock_by_owner = request.getfixturevalue(mock_owner_fixture)
+    mock_by_account = request.getfixturevalue(mock_account_fixture)
+    with Stubber(ce.get_ce_client()) as _stub:
+        # one query grouped by owner, and one grouped by account
+        _stub.add_response('get_cost_and_usage_with_resources', mock_by_owner)
+        _stub.add_response('get_cost_and_usage_with_resources', mock_by_account)
+
+        # validate our stub responses against boto
+        found_by_owner, found_by_account = ce_function(['email1', 'email2'])
+        assert list(found_by_owner) == [mock_by_owner, ]
+        assert list(found_by_account) == [mock_by_account, ]
+
+        # assert that the client function was called for both groupings
+        _stub.assert_no_pending_responses()
+
+
+@pytest.mark.parametrize(
+    "period,expected",
+    [
+        ({'Start': '2022-12-01', 'End': '2023-02-01'},
+         [{'Start': '2022-12-01', 'End': '2023-01-01'},
+          {'Start': '2023-01-01', 'End': '2023-02-01'}]),
+        ({'Start': '2023-01-15', 'End': '2023-02-10'},
+         [{'Start': '2023-01-15', 'End': '2023-02-01'},
+          {'Start': '2023-02-01', 'End': '2023-02-10'}]),
+    ]
+)
+def test_split_months(period, expected):
+    assert ce._split_months(period) == expected
+
+
+def test_ce_cache_final_months(mock_ce_period,
+                               mock_ce_compare_period,
+                               mock_ce_email_span_data):
+    hits = ce.cache_stats['hits']
+
+    with Stubber(ce.get_ce_client()) as _stub:
+        _stub.add_response('get_cost_and_usage', mock_ce_email_span_data)
+
+        first = list(ce.get_ce_email_costs(mock_ce_period, mock_ce_compare_period))
+
+        # both months are final and not estimated, so the second run is
+        # served from the cache without a query
+        second = list(ce.get_ce_email_costs(mock_ce_period, mock_ce_compare_period))
+
+        _stub.assert_no_pending_responses()
+
+    assert ce.cache_stats['hits'] == hits + 2
+    assert list(ce.iter_period_groups(second)) == list(ce.iter_period_groups(first))
+
+
+def test_ce_cache_estimated_month(mocker,
+                                  mock_ce_period,
+                                  mock_ce_compare_period,
+                                  mock_ce_account_span_data,
+                                  mock_ce_account_target_data):
+    # mark the compare month as final, the target month is estimated
+    mock_ce_account_span_data['ResultsByTime'][0]['Estimated'] = False
+
+    with Stubber(ce.get_ce_client()) as _stub:
+        _stub.add_response('get_cost_and_usage', mock_ce_account_span_data)
+
+        # the second run only queries the target month
+        expected_params = {
+            'TimePeriod': mock_ce_period,
+            'Granularity': 'MONTHLY',
+            'Metrics': [ce.cost_metric],
+            'GroupBy': [{'Type': 'DIMENSION', 'Key': 'LINKED_ACCOUNT'}],
+        }
+        _stub.add_response('get_cost_and_usage',
+                           mock_ce_account_target_data,
+                           expected_params)
+
+        first = list(ce.get_ce_account_costs(mock_ce_period, mock_ce_compare_period))
+        second = list(ce.get_ce_account_costs(mock_ce_period, mock_ce_compare_period))
+
+        _stub.assert_no_pending_responses()
+
+    assert list(ce.iter_period_groups(second)) == list(ce.iter_period_groups(first))
+
+
+def test_ce_cache_open_month(mock_ce_email_span_data):
+    # months that haven't ended yet are never cached
+    target = {'Start': '2999-02-01', 'End': '2999-03-01'}
+    compare = {'Start': '2999-01-01', 'End': '2999-02-01'}
+
+    with Stubber(ce.get_ce_client()) as _stub:
+        _stub.add_response('get_cost_and_usage', mock_ce_email_span_data)
+        _stub.add_response('get_cost_and_usage', mock_ce_email_span_data)
+
+        list(ce.get_ce_email_costs(target, compare))
+        list(ce.get_ce_email_costs(target, compare))
+
+        _stub.assert_no_pending_responses()
+
+
+def test_ce_cache_paged_months(mock_ce_period,
+                               mock_ce_compare_period,
+                               mock_ce_email_span_data):
+    # each month's results arrive on a separate page
+    compare_result, target_result = mock_ce_email_span_data['ResultsByTime']
+    first_page = dict(mock_ce_email_span_data, ResultsByTime=[compare_result],
+                      NextPageToken='token')
+    second_page = dict(mock_ce_email_span_data, ResultsByTime=[target_result])
+
+    with Stubber(ce.get_ce_client()) as _stub:
+        _stub.add_response('get_cost_and_usage', first_page)
+        _stub.add_response('get_cost_and_usage', second_page)
+
+        first = list(ce.get_ce_email_costs(mock_ce_period, mock_ce_compare_period))
+        second = list(ce.get_ce_email_costs(mock_ce_period, mock_ce_compare_period))
+
+        _stub.assert_no_pending_responses()
+
+    # each month is cached with only the pages that include it
+    assert len(second) == 2
+    assert list(ce.iter_period_groups(second)) == list(ce.iter_period_groups(first))
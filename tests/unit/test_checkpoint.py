@@ -0,0 +1,188 @@
+import os
+
+import pytest
+
+from email_totals import app, checkpoint, model
+
+
+def _sent(recipient):
+    return {'recipient': recipient, 'status': 'sent', 'message_id': f"id-{recipient}"}
+
+
+def _failed(recipient):
+    return {'recipient': recipient, 'status': 'failed', 'error': 'rejected'}
+
+
+def test_summary_round_trip(mock_app_build_summary, mock_user1):
+    summary = dict(mock_app_build_summary)
+    summary['unowned'] = model.UsageTable(summary['unowned'])
+
+    found = checkpoint.decode_summary(checkpoint.encode_summary(summary))
+    assert found == mock_app_build_summary
+
+    # usage tables are restored
+    assert isinstance(found['unowned'], model.UsageTable)
+    assert isinstance(found['per_user_summary'][mock_user1]['resources'], model.UsageTable)
+
+
+@pytest.mark.parametrize("backend", ['file', 'sqlite'])
+def test_run_resume(mock_app_build_summary, mock_user1, mock_user2, backend):
+    run = checkpoint.open_run('2023-01-01', backend)
+    assert run.load_summary() is None
+    assert run.sent() == frozenset()
+
+    run.save_summary(mock_app_build_summary)
+    run.record(_sent(mock_user1))
+    run.record(_failed(mock_user2))
+
+    # a retry sees the saved summary, and only successful sends
+    retry = checkpoint.open_run('2023-01-01', backend)
+    assert retry.load_summary() == mock_app_build_summary
+    assert retry.sent() == frozenset([mock_user1])
+
+    # a later result for the same recipient replaces the earlier one
+    retry.record(_sent(mock_user2))
+    assert checkpoint.open_run('2023-01-01', backend).sent() == {mock_user1, mock_user2}
+
+    # checkpoints are kept separately for each period
+    other = checkpoint.open_run('2023-02-01', backend)
+    assert other.load_summary() is None
+    assert other.sent() == frozenset()
+
+
+def test_file_partial_record(mock_user1):
+    run = checkpoint.open_run('2023-01-01', 'file')
+    run.record(_sent(mock_user1))
+
+    # simulate a run killed while appending a send result
+    path = os.path.join(run.backend.root, '2023-01-01-sends.jsonl')
+    with open(path, 'a') as f:
+        f.write('{"recipient": "user')
+
+    assert checkpoint.open_run('2023-01-01', 'file').sent() == {mock_user1}
+
+
+def test_null_backend(mock_app_build_summary, mock_user1):
+    run = checkpoint.open_run('2023-01-01', 'none')
+    run.save_summary(mock_app_build_summary)
+    run.record(_sent(mock_user1))
+
+    retry = checkpoint.open_run('2023-01-01', 'none')
+    assert retry.load_summary() is None
+    assert retry.sent() == frozenset()
+
+
+def test_lambda_handler_resume(mocker,
+                               mock_app_build_summary,
+                               mock_user1,
+                               mock_user2):
+    mocker.patch.dict(os.environ, {'CHECKPOINT': 'file', 'STREAMING': 'False',
+                                   'BULK_SEND': 'False'})
+    mocker.patch('email_totals.synapse.get_team_sage_members',
+                 return_value=frozenset())
+    build = mocker.patch('email_totals.app.build_summary',
+                         return_value=mock_app_build_summary)
+    mocker.patch('email_totals.ses.build_unowned_email_body',
+                 return_value=('html', 'text'))
+    unowned = mocker.patch('email_totals.ses.send_unowned_email',
+                           return_value='id-admin')
+
+    attempts = []
+
+    def _send_report_emails(per_user, account_names, period, on_result=None, **kwargs):
+        attempts.append(list(per_user))
+        results = []
+        for recipient in per_user:
+            # the first attempt fails for user2
+            if recipient == mock_user2 and len(attempts) == 1:
+                result = _failed(recipient)
+            else:
+                result = _sent(recipient)
+            on_result(result)
+            results.append(result)
+        return results
+
+    mocker.patch('email_totals.ses.send_report_emails',
+                 side_effect=_send_report_emails)
+
+    app.lambda_handler({}, None)
+    app.lambda_handler({}, None)
+    app.lambda_handler({}, None)
+
+    # the summary is only built once, and only failed sends are retried
+    build.assert_called_once()
+    assert attempts == [list(mock_app_build_summary['per_user_summary']),
+                        [mock_user2],
+                        []]
+    unowned.assert_called_once()
+
+
+def test_run_key():
+    assert checkpoint.run_key('2023-01-01') == '2023-01-01'
+    assert checkpoint.run_key('2023-01-01', 'rerun-1') == '2023-01-01-rerun-1'
+
+    with pytest.raises(ValueError):
+        checkpoint.run_key('2023-01-01', '../rerun')
+
+
+def test_open_run_logs_skipped(caplog, mock_user1):
+    run = checkpoint.open_run('2023-01-01', 'file')
+    run.record(_sent(mock_user1))
+    run.record(_sent(checkpoint.unowned_recipient))
+
+    checkpoint.open_run('2023-01-01', 'file')
+    assert f"skipping 1 recipients already sent a report: ['{mock_user1}']" in caplog.text
+    assert "skipping the unowned report" in caplog.text
+    assert "new run_id" in caplog.text
+
+
+def test_lambda_handler_run_id(mocker, mock_app_build_summary):
+    mocker.patch.dict(os.environ, {'CHECKPOINT': 'file', 'STREAMING': 'False',
+                                   'BULK_SEND': 'False', 'SHARD_COUNT': '1'})
+    mocker.patch('email_totals.synapse.get_team_sage_members',
+                 return_value=frozenset())
+    mocker.patch('email_totals.app.build_summary',
+                 return_value=mock_app_build_summary)
+    mocker.patch('email_totals.ses.build_unowned_email_body',
+                 return_value=('html', 'text'))
+    unowned = mocker.patch('email_totals.ses.send_unowned_email',
+                           return_value='id-admin')
+
+    attempts = []
+
+    def _send_report_emails(per_user, account_names, period, on_result=None, **kwargs):
+        attempts.append(list(per_user))
+        results = [_sent(r) for r in per_user]
+        for result in results:
+            on_result(result)
+        return results
+
+    mocker.patch('email_totals.ses.send_report_emails',
+                 side_effect=_send_report_emails)
+
+    recipients = list(mock_app_build_summary['per_user_summary'])
+    app.lambda_handler({}, None)
+    app.lambda_handler({}, None)
+
+    # a re-run with a run ID sends every report again, and its retries resume
+    app.lambda_handler({'run_id': 'rerun-1'}, None)
+    app.lambda_handler({'run_id': 'rerun-1'}, None)
+
+    assert attempts == [recipients, [], recipients, []]
+    assert unowned.call_count == 2
+
+
+@pytest.mark.parametrize("backend", ['file', 'sqlite'])
+def test_run_dispatches(mock_user1, backend):
+    run = checkpoint.open_run('2023-01-01', backend)
+    run.record(_sent(mock_user1))
+    run.dispatches().record(_sent('shard-0-of-2'))
+
+    # dispatched shards are kept apart from recipients
+    retry = checkpoint.open_run('2023-01-01', backend)
+    assert retry.sent() == {mock_user1}
+    assert retry.dispatches().sent() == {'shard-0-of-2'}
+
+    # run IDs can't produce the keys of shard checkpoints
+    with pytest.raises(ValueError):
+        checkpoint.run_key('2023-01-01', 'x+dispatched')
@@ -0,0 +1,254 @@
+import os
+
+import pytest
+from botocore.exceptions import ClientError
+
+from email_totals import app, clients, deadline, ses, workers
+
+
+class _Context:
+    def __init__(self, remaining_ms):
+        self.remaining_ms = remaining_ms
+
+    def get_remaining_time_in_millis(self):
+        return self.remaining_ms
+
+
+@pytest.fixture(autouse=True)
+def mock_deadline(mocker):
+    mocker.patch.object(deadline, '_deadline', None)
+    mocker.patch.dict(os.environ, {'DEADLINE_RESERVE': '10'})
+
+
+def test_no_context():
+    deadline.start(None)
+    assert deadline.remaining() is None
+    assert not deadline.expired()
+    assert deadline.allows(1e6)
+    deadline.finish()
+
+
+def test_deadline():
+    deadline.start(_Context(60000))
+    assert 49 < deadline.remaining() <= 50
+    assert deadline.allows(10)
+    assert not deadline.allows(60)
+
+    deadline.finish()
+    assert deadline.remaining() is None
+
+
+def test_expired():
+    deadline.start(_Context(5000))
+    assert deadline.expired()
+    deadline.finish()
+
+
+def test_backoff_budget(mocker):
+    sleep = mocker.patch('time.sleep')
+    deadline.start(_Context(10500))
+
+    def _throttled():
+        raise ClientError({'Error': {'Code': 'ThrottlingException'}}, 'TestOperation')
+
+    # the first back-off delay may be up to a second, more than is left
+    mocker.patch('random.uniform', return_value=1.0)
+    with pytest.raises(ClientError):
+        workers.call_with_backoff(_throttled)
+    sleep.assert_not_called()
+
+
+def test_send_report_emails_expired(mocker, mock_app_per_user, mock_app_account_names):
+    mocker.patch.object(ses, 'get_max_send_rate', return_value=100.0)
+    client = mocker.MagicMock()
+    clients.set_client('ses', client)
+    on_result = mocker.Mock()
+
+    deadline.start(_Context(0))
+    found = ses.send_report_emails(mock_app_per_user, mock_app_account_names,
+                                   'Test Month', on_result=on_result)
+
+    assert found == [ses.pending_result(r) for r in mock_app_per_user]
+    client.send_email.assert_not_called()
+    on_result.assert_not_called()
+
+
+def _expire_on_acquire(mocker):
+    """
+    Make the deadline pass while waiting for the send rate
+    """
+
+    def _acquire(self, tokens=1):
+        deadline._deadline = 0
+
+    mocker.patch.object(workers.TokenBucket, 'acquire', _acquire)
+
+
+def test_send_report_emails_expired_waiting(mocker, mock_app_per_user, mock_app_account_names):
+    mocker.patch.dict(os.environ, {'CC_LIST': ''})
+    mocker.patch.object(ses, 'get_max_send_rate', return_value=100.0)
+    client = mocker.MagicMock()
+    clients.set_client('ses', client)
+    on_result = mocker.Mock()
+    _expire_on_acquire(mocker)
+
+    deadline.start(_Context(60000))
+    found = ses.send_report_emails(mock_app_per_user, mock_app_account_names,
+                                   'Test Month', max_workers=1, on_result=on_result)
+
+    assert found == [ses.pending_result(r) for r in mock_app_per_user]
+    client.send_email.assert_not_called()
+    on_result.assert_not_called()
+
+
+def test_send_bulk_report_emails_expired(mocker, mock_app_per_user, mock_app_account_names):
+    mocker.patch.dict(os.environ, {'SENDER': 'test@example.com', 'CC_LIST': ''})
+    mocker.patch.object(ses, '_report_template_ready', True)
+    mocker.patch.object(ses, 'bulk_batch_size', 2)
+    mocker.patch.object(ses, 'get_max_send_rate', return_value=100.0)
+    client = mocker.MagicMock()
+    clients.set_client('ses', client)
+    on_result = mocker.Mock()
+    _expire_on_acquire(mocker)
+
+    # the deadline passes while waiting to send the first batch
+    deadline.start(_Context(60000))
+    found = ses.send_bulk_report_emails(mock_app_per_user, mock_app_account_names,
+                                        'Test Month', on_result=on_result)
+
+    assert found == [ses.pending_result(r) for r in mock_app_per_user]
+    client.send_bulk_templated_email.assert_not_called()
+    on_result.assert_not_called()
+
+
+@pytest.mark.parametrize("bulk", ['True', 'False'])
+def test_send_user_reports_expired(mocker, mock_app_per_user, mock_app_account_names, bulk):
+    mocker.patch.dict(os.environ, {'BULK_SEND': bulk})
+    client = mocker.MagicMock()
+    clients.set_client('ses', client)
+    run = mocker.MagicMock()
+    run.sent.return_value = {next(iter(mock_app_per_user))}
+
+    # nothing is sent, or even set up, once the deadline has passed
+    deadline.start(_Context(0))
+    found = app.send_user_reports(mock_app_per_user, mock_app_account_names, 'Test Month', run)
+
+    assert found == [ses.pending_result(r) for r in list(mock_app_per_user)[1:]]
+    assert client.method_calls == []
+    run.record.assert_not_called()
+
+
+def test_lambda_handler_deadline(mocker, mock_app_build_summary):
+    mocker.patch.dict(os.environ, {'CHECKPOINT': 'file', 'STREAMING': 'False',
+                                   'BULK_SEND': 'False', 'SHARD_COUNT': '1',
+                                   'SEND_CONCURRENCY': '1', 'SENDER': 'test@example.com',
+                                   'CC_LIST': '', 'ADMIN_EMAIL': 'admin@example.com'})
+    mocker.patch('email_totals.synapse.get_team_sage_members',
+                 return_value=frozenset())
+    mocker.patch('email_totals.app.build_summary',
+                 return_value=mock_app_build_summary)
+    mocker.patch.object(ses, 'get_max_send_rate', return_value=100.0)
+    mocker.patch('email_totals.ses.build_unowned_email_body',
+                 return_value=('html', 'text'))
+
+    sent = []
+
+    def _send_email(Destination, **kwargs):
+        sent.append(Destination['ToAddresses'][0])
+        # the deadline passes during the first user report
+        if deadline._deadline is not None and len(sent) > 1:
+            deadline._deadline = 0
+        return {'MessageId': f"id-{len(sent)}"}
+
+    client = mocker.MagicMock()
+    client.send_email.side_effect = _send_email
+    clients.set_client('ses', client)
+
+    recipients = list(mock_app_build_summary['per_user_summary'])
+    found = app.lambda_handler({}, _Context(60000))
+
+    # the unowned report is sent before user reports
+    assert sent == ['admin@example.com', recipients[0]]
+    assert found == {
+        'completed': recipients[:1],
+        'failed': [],
+        'pending': recipients[1:],
+        'deadline_reached': True,
+        'unowned': 'sent',
+    }
+
+    # a retry with time left sends the pending reports
+    found = app.lambda_handler({}, None)
+    assert sent[2:] == recipients[1:]
+    assert found['completed'] == recipients
+    assert found['pending'] == []
+    assert not found['deadline_reached']
+
+
+@pytest.mark.parametrize("batch_size", [0, 2])
+def test_audit_recipients_expired(mocker, batch_size):
+    recipients = [f"user{i}" for i in range(4)]
+
+    def _audit(owner):
+        # the deadline passes during the first audit
+        deadline._deadline = 0
+        return {'missing': owner}, {}
+
+    mocker.patch('email_totals.app.audit_other_tags', side_effect=_audit)
+    mocker.patch('email_totals.app.audit_other_tags_batch',
+                 side_effect=lambda owners: {o: _audit(o) for o in owners})
+
+    deadline.start(_Context(60000))
+    found = app.audit_recipients(recipients, 1, batch_size)
+    deadline.finish()
+
+    audited = max(batch_size, 1)
+    assert found[:audited] == [_audit(r) for r in recipients[:audited]]
+    assert found[audited:] == [None] * (len(recipients) - audited)
+
+
+def test_lambda_handler_audit_deadline(mocker, mock_app_build_summary):
+    mocker.patch.dict(os.environ, {'CHECKPOINT': 'file', 'STREAMING': 'False',
+                                   'BULK_SEND': 'False', 'SHARD_COUNT': '1',
+                                   'AUDIT_BATCH_SIZE': '1', 'AUDIT_CONCURRENCY': '1',
+                                   'SEND_ORDER': 'none', 'SEND_CONCURRENCY': '1',
+                                   'SENDER': 'test@example.com', 'CC_LIST': '',
+                                   'ADMIN_EMAIL': 'admin@example.com'})
+    mocker.patch('email_totals.synapse.get_team_sage_members',
+                 return_value=frozenset())
+    mocker.patch('email_totals.ses.valid_recipient', return_value=True)
+    mocker.patch('email_totals.app.build_owner_totals',
+                 side_effect=lambda *args: (dict(mock_app_build_summary['per_user_summary']),
+                                            mock_app_build_summary['account_names'],
+                                            mock_app_build_summary['unowned']))
+    mocker.patch.object(ses, 'get_max_send_rate', return_value=100.0)
+    mocker.patch('email_totals.ses.build_unowned_email_body',
+                 return_value=('html', 'text'))
+
+    def _audit_batch(owners):
+        # the deadline passes during the first audit
+        if deadline._deadline is not None:
+            deadline._deadline = 0
+        return {o: ({}, {}) for o in owners}
+
+    audit = mocker.patch('email_totals.app.audit_other_tags_batch',
+                         side_effect=_audit_batch)
+
+    client = mocker.MagicMock()
+    client.send_email.return_value = {'MessageId': 'id'}
+    clients.set_client('ses', client)
+
+    recipients = list(mock_app_build_summary['per_user_summary'])
+    found = app.lambda_handler({}, _Context(60000))
+
+    # recipients that weren't audited are pending rather than left out
+    assert audit.call_count == 1
+    assert found['completed'] == []
+    assert found['pending'] == recipients
+    assert found['deadline_reached']
+
+    # the incomplete summary isn't reused, so a retry audits everyone
+    found = app.lambda_handler({}, None)
+    assert audit.call_count == 1 + len(recipients)
+    assert found['completed'] == recipients
+    assert found['pending'] == []
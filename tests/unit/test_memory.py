@@ -0,0 +1,66 @@
+import json
+import os
+import tracemalloc
+
+from email_totals import app, memory, metrics
+
+
+def test_disabled(mocker, tmp_path):
+    report_file = tmp_path / 'memory.json'
+    mocker.patch.dict(os.environ, {'MEMORY_PROFILE': 'False', 'METRICS': 'False',
+                                   'MEMORY_REPORT': str(report_file)})
+
+    memory.start()
+    assert not memory.active()
+    assert not tracemalloc.is_tracing()
+    assert metrics.phase('test') is metrics.phase('other')
+    assert memory.finish() is None
+    assert not report_file.exists()
+
+
+def test_phase_boundaries(mocker, tmp_path):
+    report_file = tmp_path / 'memory.json'
+    mocker.patch.dict(os.environ, {'MEMORY_PROFILE': 'True', 'METRICS': 'False',
+                                   'MEMORY_REPORT': str(report_file)})
+
+    memory.start()
+    with metrics.phase('allocate'):
+        held = [bytearray(1024) for _ in range(1024)]
+    with metrics.phase('release'):
+        del held
+
+    report = memory.finish()
+    assert not tracemalloc.is_tracing()
+    assert json.loads(report_file.read_text()) == report
+
+    allocate, release = report['boundaries']
+    assert allocate['phase'] == 'allocate'
+    assert release['phase'] == 'release'
+    assert allocate['current'] > release['current'] + 2**20 / 2
+    assert report['peak'] >= allocate['peak'] >= 2**20
+
+    # the list of buffers is the largest allocation site
+    assert allocate['top'][0]['bytes'] >= 2**20
+    assert __file__ in allocate['top'][0]['site'][0]
+
+
+def test_lambda_handler_profile(mocker, tmp_path, mock_app_build_summary):
+    report_file = tmp_path / 'memory.json'
+    mocker.patch.dict(os.environ, {'MEMORY_PROFILE': 'True', 'METRICS': 'False',
+                                   'MEMORY_REPORT': str(report_file),
+                                   'CHECKPOINT': 'none', 'STREAMING': 'False',
+                                   'BULK_SEND': 'False', 'SHARD_COUNT': '1'})
+    mocker.patch('email_totals.synapse.get_team_sage_members',
+                 return_value=frozenset())
+    mocker.patch('email_totals.app.build_summary',
+                 return_value=mock_app_build_summary)
+    mocker.patch('email_totals.ses.send_report_emails', return_value=[])
+    mocker.patch('email_totals.ses.build_unowned_email_body',
+                 return_value=('html', 'text'))
+    mocker.patch('email_totals.ses.send_unowned_email', return_value=None)
+
+    app.lambda_handler({}, None)
+
+    report = json.loads(report_file.read_text())
+    assert [b['phase'] for b in report['boundaries']] == ['synapse', 'summary',
+                                                          'unowned', 'send']
@@ -0,0 +1,92 @@
+import json
+import os
+
+from botocore.stub import Stubber
+
+from email_totals import app, clients, metrics
+
+
+def test_disabled(mocker):
+    mocker.patch.dict(os.environ, {'METRICS': 'False'})
+
+    metrics.start()
+    assert metrics.phase('test') is metrics.phase('other')
+    with metrics.phase('test'):
+        metrics.add('ApiCalls')
+    assert metrics.flush() is None
+
+
+def test_phases(mocker, capsys):
+    mocker.patch.dict(os.environ, {'METRICS': 'True',
+                                   'METRICS_NAMESPACE': 'Test',
+                                   'AWS_LAMBDA_FUNCTION_NAME': 'test-function'})
+
+    metrics.start()
+    with metrics.phase('outer'):
+        metrics.add('ApiCalls')
+        with metrics.phase('inner'):
+            metrics.add('ApiCalls', 2)
+            metrics.add('Retries')
+
+    # nothing is recorded outside of a phase
+    metrics.add('ApiCalls')
+
+    document = metrics.flush()
+    assert document['outer.ApiCalls'] == 1
+    assert document['inner.ApiCalls'] == 2
+    assert document['inner.Retries'] == 1
+    assert document['outer.Duration'] >= document['inner.Duration']
+
+    definition = document['_aws']['CloudWatchMetrics'][0]
+    assert definition['Namespace'] == 'Test'
+    assert definition['Dimensions'] == [['FunctionName']]
+    assert document['FunctionName'] == 'test-function'
+    assert {'Name': 'inner.Retries', 'Unit': 'Count'} in definition['Metrics']
+    assert {'Name': 'outer.Duration', 'Unit': 'Milliseconds'} in definition['Metrics']
+    assert all(m['Name'] in document for m in definition['Metrics'])
+
+    # the document is written as a single line of JSON
+    assert json.loads(capsys.readouterr().out) == document
+
+    # recording stops once the run is flushed
+    assert metrics.phase('test') is metrics.phase('other')
+
+
+def test_client_calls(mocker):
+    mocker.patch.dict(os.environ, {'METRICS': 'True'})
+
+    client = clients.get_boto_client('ses')
+    metrics.start()
+    with Stubber(client) as _stub:
+        _stub.add_response('get_send_quota', {'MaxSendRate': 1.0})
+        _stub.add_response('get_send_quota', {'MaxSendRate': 1.0})
+
+        with metrics.phase('test'):
+            client.get_send_quota()
+            client.get_send_quota()
+
+    document = metrics.flush()
+    assert document['test.ApiCalls'] == 2
+
+
+def test_lambda_handler_metrics(mocker, capsys, mock_app_build_summary):
+    mocker.patch.dict(os.environ, {'METRICS': 'True', 'CHECKPOINT': 'none',
+                                   'STREAMING': 'False', 'BULK_SEND': 'False',
+                                   'SHARD_COUNT': '1'})
+    mocker.patch('email_totals.synapse.get_team_sage_members',
+                 return_value=frozenset())
+    mocker.patch('email_totals.app.build_summary',
+                 return_value=mock_app_build_summary)
+    mocker.patch('email_totals.ses.send_report_emails', return_value=[])
+    mocker.patch('email_totals.ses.build_unowned_email_body',
+                 return_value=('html', 'text'))
+    mocker.patch('email_totals.ses.send_unowned_email', return_value=None)
+
+    app.lambda_handler({}, None)
+
+    lines = capsys.readouterr().out.splitlines()
+    assert len(lines) == 1
+
+    document = json.loads(lines[0])
+    for phase in ('synapse', 'summary', 'send', 'unowned'):
+        assert f"{phase}.Duration" in document
@@ -0,0 +1,83 @@
+import copy
+import json
+
+import pytest
+
+from email_totals import model
+
+
+@pytest.fixture()
+def usage():
+    return {
+        '111122223333': {'total': 10.0},
+        '222233334444': {'total': 20.0, 'change': 0.5},
+    }
+
+
+def test_usage_table_mapping(usage):
+    table = model.UsageTable(usage)
+
+    assert table == usage
+    assert usage == table
+    assert len(table) == 2
+    assert list(table) == list(usage)
+    assert '111122223333' in table
+    assert '333344445555' not in table
+    assert 'change' not in table['111122223333']
+    assert table['222233334444']['change'] == 0.5
+    assert table.get('333344445555') is None
+    assert table.to_dict() == usage
+    assert json.loads(json.dumps(table.to_dict())) == usage
+    assert repr(table) == repr(usage)
+
+
+def test_usage_table_summary_equality(usage):
+    # adapters compare equal to the nested dictionaries used by the tests
+    summary = {'user@example.com': {'resources': model.UsageTable(usage)}}
+    assert summary == {'user@example.com': {'resources': copy.deepcopy(usage)}}
+
+
+def test_usage_table_update(usage):
+    table = model.UsageTable(usage)
+
+    table['111122223333'] = {'total': 1.0, 'change': -0.5}
+    table['333344445555'] = {'total': 3.0}
+    del table['222233334444']
+
+    assert table == {
+        '111122223333': {'total': 1.0, 'change': -0.5},
+        '333344445555': {'total': 3.0},
+    }
+
+    with pytest.raises(KeyError):
+        del table['222233334444']
+
+
+def test_usage_table_index():
+    count = model.index_after_rows * 4
+    table = model.UsageTable()
+    for i in range(count):
+        table.add(f"{i:012}", float(i))
+
+    # large tables are looked up through an index, kept up to date as rows
+    # are added and removed
+    assert table[f"{count - 1:012}"]['total'] == count - 1
+    table.add('999999999999', 1.0, 0.25)
+    assert table['999999999999'] == {'total': 1.0, 'change': 0.25}
+    del table[f"{0:012}"]
+    assert table[f"{count - 1:012}"]['total'] == count - 1
+    assert f"{0:012}" not in table
+
+
+def test_iter_usage(usage):
+    expected = [('111122223333', 10.0, None), ('222233334444', 20.0, 0.5)]
+    assert list(model.iter_usage(usage)) == expected
+    assert list(model.iter_usage(model.UsageTable(usage))) == expected
+
+
+def test_intern_id():
+    # build equal strings at runtime so they are distinct objects
+    first = ''.join(['1111', '2222', '3333'])
+    second = ''.join(['111122', '223333'])
+    assert first is not second
+    assert model.intern_id(first) is model.intern_id(second)
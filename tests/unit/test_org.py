@@ -1,6 +1,10 @@
+import os
+import time
+
+import pytest
 from botocore.stub import Stubber
 
-from email_totals import org
+from email_totals import cache, clients, org
 
 
 def test_account_owners(mock_org_accounts,
@@ -10,7 +14,7 @@ def test_account_owners(mock_org_accounts,
                         mock_org_account_tags_user3,
                         mock_org_account_tags_user4,
                         mock_org_account_owners):
-    with Stubber(org.org_client) as _stub:
+    with Stubber(org.get_org_client()) as _stub:
         _stub.add_response('list_accounts', mock_org_accounts)
 
         # user1 owns account0; no one owns account1
@@ -20,8 +24,123 @@ def test_account_owners(mock_org_accounts,
         _stub.add_response('list_tags_for_resource', mock_org_account_tags_user3)
         _stub.add_response('list_tags_for_resource', mock_org_account_tags_user4)
 
-        found_account_owners = org.get_account_owners()
+        # stubbed responses are returned in order, so look up tags serially
+        found_account_owners = org.get_account_owners(max_workers=1)
         assert found_account_owners == mock_org_account_owners
 
         # assert that the client function was called the expected number of times
         _stub.assert_no_pending_responses()
+
+
+@pytest.mark.parametrize("max_workers", [1, 4])
+def test_account_owners_concurrent(mocker,
+                                   mock_org_accounts,
+                                   mock_org_account_no_tags,
+                                   mock_org_account_tags_user1,
+                                   mock_org_account_tags_user2,
+                                   mock_org_account_tags_user3,
+                                   mock_org_account_tags_user4,
+                                   mock_org_account_owners,
+                                   max_workers):
+    account_tags = [
+        mock_org_account_tags_user1,
+        mock_org_account_no_tags,
+        mock_org_account_tags_user2,
+        mock_org_account_tags_user3,
+        mock_org_account_tags_user4,
+    ]
+    tags_by_account = {}
+    for account, tags in zip(mock_org_accounts['Accounts'], account_tags):
+        tags_by_account[account['Id']] = tags
+
+    # Tag lookups can happen in any order, so look up responses by account
+    def _paginate(ResourceId=None):
+        if ResourceId is None:
+            return [mock_org_accounts, ]
+        return [tags_by_account[ResourceId], ]
+
+    mock_client = mocker.MagicMock()
+    mock_client.get_paginator.return_value.paginate.side_effect = _paginate
+    clients.set_client('organizations', mock_client)
+
+    found_account_owners = org.get_account_owners(max_workers=max_workers)
+    assert found_account_owners == mock_org_account_owners
+
+
+def test_account_owners_cached(mocker,
+                               mock_org_accounts,
+                               mock_org_account_no_tags,
+                               mock_org_account_tags_user1,
+                               mock_org_account_tags_user2,
+                               mock_org_account_tags_user3,
+                               mock_org_account_tags_user4,
+                               mock_org_account_owners,
+                               mock_app_account_names):
+    mocker.patch.dict(os.environ, {'ACCOUNT_CACHE_TTL': '3600'})
+
+    with Stubber(org.get_org_client()) as _stub:
+        _stub.add_response('list_accounts', mock_org_accounts)
+        _stub.add_response('list_tags_for_resource', mock_org_account_tags_user1)
+        _stub.add_response('list_tags_for_resource', mock_org_account_no_tags)
+        _stub.add_response('list_tags_for_resource', mock_org_account_tags_user2)
+        _stub.add_response('list_tags_for_resource', mock_org_account_tags_user3)
+        _stub.add_response('list_tags_for_resource', mock_org_account_tags_user4)
+
+        assert org.get_account_owners(max_workers=1) == mock_org_account_owners
+
+        # a warm invocation doesn't call organizations at all
+        assert org.get_account_owners(max_workers=1) == mock_org_account_owners
+
+        # a cold start reads the cache file
+        cache.memory.clear()
+        assert org.get_account_owners(max_workers=1) == mock_org_account_owners
+
+        _stub.assert_no_pending_responses()
+
+    assert org.get_account_names() == mock_app_account_names
+
+
+def test_account_owners_stale_entry(mocker,
+                                    mock_org_accounts,
+                                    mock_org_account_tags_user1,
+                                    mock_org_account_owners):
+    mocker.patch.dict(os.environ, {'ACCOUNT_CACHE_TTL': '3600'})
+
+    # cache every account, with a stale owner tag for the first account
+    now = time.time()
+    accounts = {}
+    for account in mock_org_accounts['Accounts']:
+        accounts[account['Id']] = {'name': account['Name'], 'owner': None, 'fetched': now}
+    for owner, account_ids in mock_org_account_owners.items():
+        for account_id in account_ids:
+            accounts[account_id]['owner'] = owner
+
+    first_account = mock_org_accounts['Accounts'][0]['Id']
+    accounts[first_account]['owner'] = 'previous-owner'
+    accounts[first_account]['fetched'] = now - 7200
+    cache.store(org.account_cache_name, {'listed': now, 'accounts': accounts})
+
+    with Stubber(org.get_org_client()) as _stub:
+        # only the stale account is looked up again
+        _stub.add_response('list_tags_for_resource',
+                           mock_org_account_tags_user1,
+                           {'ResourceId': first_account})
+
+        assert org.get_account_owners(max_workers=1) == mock_org_account_owners
+
+        _stub.assert_no_pending_responses()
+
+
+def test_update_account_names(mocker,
+                              mock_org_accounts,
+                              mock_org_account_no_tags):
+    mocker.patch.dict(os.environ, {'ACCOUNT_CACHE_TTL': '3600'})
+
+    account = mock_org_accounts['Accounts'][0]
+    with Stubber(org.get_org_client()) as _stub:
+        _stub.add_response('list_accounts', {'Accounts': [account, ]})
+        _stub.add_response('list_tags_for_resource', mock_org_account_no_tags)
+        org.get_account_owners(max_workers=1)
+
+    org.update_account_names({account['Id']: 'new-name', 'unknown': 'ignored'})
+    assert org.get_account_names() == {account['Id']: 'new-name'}
@@ -0,0 +1,67 @@
+import copy
+
+from email_totals import model, render
+
+
+def test_user_report_does_not_modify_summary(mock_app_account_names,
+                                             mock_app_per_user,
+                                             mock_user1):
+    summary = mock_app_per_user[mock_user1]
+    expected = copy.deepcopy(summary)
+
+    render.user_report(summary, mock_app_account_names)
+
+    assert summary == expected
+
+
+def test_owned_resources():
+    summary = {
+        'resources': {'111': {'total': 1.0}, '222': {'total': 2.0}},
+        'accounts': {'222': {'total': 3.0}},
+    }
+    assert render.owned_resources(summary) == {'111': {'total': 1.0}}
+    assert render.owned_resources({'accounts': {'222': {}}}) == {}
+
+
+def test_layouts_compiled_once():
+    render.usage_layout.cache_clear()
+
+    for _ in range(3):
+        render.write_usage_table([], [], {}, {}, 'Account Total')
+
+    info = render.usage_layout.cache_info()
+    assert (info.hits, info.misses) == (2, 1)
+
+
+def test_write_usage_table_rows():
+    usage = {
+        '111122223333': {'total': 1.005, 'change': -0.5},
+        '222233334444': {'total': 2},
+    }
+
+    html_out, text_out = [], []
+    render.write_usage_table(html_out, text_out, usage,
+                             {'111122223333': 'one', '222233334444': 'two'})
+
+    assert len(html_out) == len(text_out)
+    assert '<td>$1.00</td><td>-50.00%</td>' in html_out[1]
+    assert ''.join(text_out) == ('Account Name (Account ID)\tYour Total\tMonth-over-Month Change\n'
+                            'one\t111122223333\t$1.00\t-50.00%\n'
+                            'two\t222233334444\t$2.00\t\n')
+
+
+def test_format_amounts():
+    assert render.format_amounts(12.345, 0.1234) == ('$12.35', '12.34%')
+    assert render.format_amounts(0) == ('$0.00', '')
+
+
+def test_user_report_usage_table(mock_app_account_names,
+                                 mock_app_per_user):
+    for summary in mock_app_per_user.values():
+        compact = dict(summary)
+        for key in ('resources', 'accounts'):
+            if key in compact:
+                compact[key] = model.UsageTable(compact[key])
+
+        found = render.user_report(compact, mock_app_account_names)
+        assert found == render.user_report(summary, mock_app_account_names)
@@ -1,9 +1,65 @@
+import copy
+import json
 import os
+import re
 
 import pytest
-from botocore.stub import Stubber
-
-from email_totals import ses
+from botocore.exceptions import ClientError
+from botocore.stub import ANY, Stubber
+
+from email_totals import clients, ses, workers
+
+
+def _render_template(template, data):
+    """
+    Render the subset of Handlebars used by the report template, i.e.
+    `{{value}}`, `{{{value}}}`, `{{#if value}}`, `{{#each list}}`, and
+    `../value` lookups, so that bulk output can be compared to our own
+    """
+
+    tokens = re.split(r'(\{\{\{.*?\}\}\}|\{\{.*?\}\})', template)
+
+    def _parse(i, closing=None):
+        nodes = []
+        while i < len(tokens):
+            token = tokens[i]
+            i += 1
+            if token.startswith('{{/'):
+                assert token == '{{/' + closing + '}}'
+                return nodes, i
+            if token.startswith('{{#'):
+                helper, name = token[3:-2].split()
+                children, i = _parse(i, helper)
+                nodes.append((helper, name, children))
+            elif token.startswith('{{'):
+                nodes.append(('var', token.strip('{}'), None))
+            else:
+                nodes.append(('text', token, None))
+        return nodes, i
+
+    def _lookup(name, stack):
+        while name.startswith('../'):
+            name = name[3:]
+            stack = stack[:-1]
+        return stack[-1][name]
+
+    def _render(nodes, stack):
+        output = ''
+        for kind, value, children in nodes:
+            if kind == 'text':
+                output += value
+            elif kind == 'var':
+                output += str(_lookup(value, stack))
+            elif kind == 'if':
+                if _lookup(value, stack):
+                    output += _render(children, stack)
+            elif kind == 'each':
+                for item in _lookup(value, stack):
+                    output += _render(children, stack + [item])
+        return output
+
+    nodes, _ = _parse(0)
+    return _render(nodes, [data])
 
 
 def test_empty_cc_list(mocker):
@@ -49,15 +105,92 @@ def test_send_report_email(mocker,
     }
     mocker.patch.dict(os.environ, env_vars)
 
-    with Stubber(ses.ses_client) as _stub:
+    with Stubber(ses.get_ses_client()) as _stub:
         _stub.add_response('send_email', mock_ses_response)
 
-        ses.send_report_email(recipient, html_body, text_body, period)
+        found = ses.send_report_email(recipient, html_body, text_body, period)
+        assert found == 'testId'
 
         # assert that the client function was called
         _stub.assert_no_pending_responses()
 
 
+def test_send_email_failure(mocker):
+    mocker.patch.dict(os.environ, {'SENDER': 'test@example.com'})
+
+    with Stubber(ses.get_ses_client()) as _stub:
+        _stub.add_client_error('send_email', 'MessageRejected')
+
+        found = ses.send_email(['user@example.com', ], 'subject', 'html', 'text')
+        assert found is None
+
+        _stub.assert_no_pending_responses()
+
+
+@pytest.mark.parametrize(
+    "quota,expected",
+    [
+        (14.0, 14.0),
+        (0.5, 1.0),
+    ]
+)
+def test_get_max_send_rate(quota, expected):
+    with Stubber(ses.get_ses_client()) as _stub:
+        _stub.add_response('get_send_quota', {'MaxSendRate': quota})
+
+        assert ses.get_max_send_rate() == expected
+
+        _stub.assert_no_pending_responses()
+
+
+def test_get_max_send_rate_error():
+    with Stubber(ses.get_ses_client()) as _stub:
+        _stub.add_client_error('get_send_quota', 'AccessDenied')
+
+        assert ses.get_max_send_rate() == 1.0
+
+
+@pytest.mark.parametrize("max_workers", [1, 4])
+def test_send_report_emails(mocker,
+                            mock_app_account_names,
+                            mock_app_per_user,
+                            mock_user2,
+                            max_workers):
+    mocker.patch.dict(os.environ, {'SENDER': 'test@example.com', 'CC_LIST': 'cc@example.com'})
+    mocker.patch.object(ses, 'get_max_send_rate', return_value=100.0)
+
+    sent = []
+
+    def _send_email(**kwargs):
+        recipients = kwargs['Destination']['ToAddresses']
+        sent.append(recipients)
+        if recipients[0] == mock_user2:
+            raise ClientError({'Error': {'Code': 'MessageRejected', 'Message': 'rejected'}},
+                              'SendEmail')
+        return {'MessageId': f"id-{recipients[0]}"}
+
+    client = mocker.MagicMock()
+    client.send_email.side_effect = _send_email
+    clients.set_client('ses', client)
+
+    found = ses.send_report_emails(mock_app_per_user, mock_app_account_names,
+                                   'Test Month', max_workers=max_workers)
+
+    # results are returned in recipient order, and a failure doesn't stop
+    # the remaining reports from being sent
+    assert [r['recipient'] for r in found] == list(mock_app_per_user)
+    for result in found:
+        if result['recipient'] == mock_user2:
+            assert result['status'] == 'failed'
+            assert 'MessageRejected' in result['error']
+        else:
+            assert result['status'] == 'sent'
+            assert result['message_id'] == f"id-{result['recipient']}"
+
+    assert len(sent) == len(mock_app_per_user)
+    assert all(r[1:] == ['cc@example.com'] for r in sent)
+
+
 def test_send_unowned_email(mocker,
                             mock_ses_response):
     text_body = 'test'
@@ -71,7 +204,7 @@ def test_send_unowned_email(mocker,
     }
     mocker.patch.dict(os.environ, env_vars)
 
-    with Stubber(ses.ses_client) as _stub:
+    with Stubber(ses.get_ses_client()) as _stub:
         _stub.add_response('send_email', mock_ses_response)
 
         ses.send_unowned_email(html_body, text_body, period)
@@ -145,3 +278,103 @@ def test_valid_recipient(mocker,
 
     found = ses.valid_recipient(mock_email, mock_team_sage)
     assert found == result
+
+
+@pytest.mark.parametrize("user", ["mock_user1", "mock_user2", "mock_user3", "mock_user4"])
+def test_report_template(mock_app_account_names,
+                         mock_app_per_user,
+                         user,
+                         request):
+    summary = mock_app_per_user[request.getfixturevalue(user)]
+    original = copy.deepcopy(summary)
+
+    data = ses.build_report_template_data(summary,
+                                          mock_app_account_names,
+                                          'Test Month')
+
+    # replacement data must be JSON for SES
+    data = json.loads(json.dumps(data))
+
+    template = ses._build_report_template()
+    found_html = _render_template(template['HtmlPart'], data)
+    found_text = _render_template(template['TextPart'], data)
+    found_subject = _render_template(template['SubjectPart'], data)
+
+    expected_html, expected_text = ses.build_user_email_body(summary,
+                                                             mock_app_account_names)
+    assert found_html == expected_html
+    assert found_text == expected_text
+    assert found_subject == 'AWS Monthly Cost Report (Test Month)'
+
+    # rendering leaves the summary unchanged
+    assert summary == original
+
+
+def test_ensure_report_template(mocker):
+    mocker.patch.object(ses, '_report_template_ready', False)
+
+    with Stubber(ses.get_ses_client()) as _stub:
+        _stub.add_client_error('update_template', 'TemplateDoesNotExist')
+        _stub.add_response('create_template', {})
+
+        ses.ensure_report_template()
+
+        # the template is only set up once per process
+        ses.ensure_report_template()
+
+        _stub.assert_no_pending_responses()
+
+
+def test_send_bulk_report_emails(mocker,
+                                 mock_app_account_names,
+                                 mock_app_per_user,
+                                 mock_ses_response,
+                                 mock_user1,
+                                 mock_user2):
+    env_vars = {
+        'SENDER': 'test@example.com',
+        'CC_LIST': '',
+    }
+    mocker.patch.dict(os.environ, env_vars)
+    mocker.patch.object(ses, '_report_template_ready', False)
+    mocker.patch.object(ses, 'bulk_batch_size', 3)
+    mocker.patch.object(ses, 'get_max_send_rate', return_value=100.0)
+    acquire_many = mocker.spy(workers.TokenBucket, 'acquire_many')
+    acquire = mocker.spy(workers.TokenBucket, 'acquire')
+
+    per_user = dict(mock_app_per_user)
+
+    with Stubber(ses.get_ses_client()) as _stub:
+        _stub.add_response('update_template', {})
+
+        # four users are sent in two batches, and one failure falls back
+        # to sending separately
+        bulk_status = {
+            'Status': [
+                {'Status': 'Success', 'MessageId': 'id1'},
+                {'Status': 'AccountThrottled', 'Error': 'throttled'},
+                {'Status': 'Success', 'MessageId': 'id3'},
+            ]
+        }
+        _stub.add_response('send_bulk_templated_email', bulk_status)
+        _stub.add_response('send_bulk_templated_email',
+                           {'Status': [{'Status': 'Success', 'MessageId': 'id4'}]})
+        _stub.add_response('send_email', mock_ses_response,
+                           {'Source': 'test@example.com',
+                            'Destination': {'ToAddresses': [mock_user2, ]},
+                            'Message': ANY})
+
+        recorded = []
+        found = ses.send_bulk_report_emails(per_user, mock_app_account_names, 'Test Month',
+                                            on_result=recorded.append)
+
+        _stub.assert_no_pending_responses()
+
+    assert found == recorded
+    assert sorted(r['recipient'] for r in found) == sorted(per_user)
+    assert all(r['status'] == 'sent' for r in found)
+
+    # each batch is paced by its number of destinations, and the fallback
+    # send by its recipients
+    assert [c.args[1] for c in acquire_many.call_args_list] == [3, 1]
+    assert acquire.call_args_list[-1].args[1] == 1
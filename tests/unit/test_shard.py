@@ -0,0 +1,155 @@
+import json
+import os
+
+import pytest
+from botocore.stub import Stubber
+
+from email_totals import app, checkpoint, clients, shard
+
+
+@pytest.mark.parametrize("count", [1, 2, 3])
+def test_split_summary(mock_app_build_summary, count):
+    shards = shard.split_summary(mock_app_build_summary, count)
+    assert len(shards) == count
+
+    # every recipient is in exactly one shard, which has the names it needs
+    found = {}
+    for index, shard_summary in enumerate(shards):
+        for recipient, entry in shard_summary['per_user_summary'].items():
+            assert recipient not in found
+            assert shard.shard_index(recipient, count) == index
+            found[recipient] = entry
+
+            for key in ('resources', 'accounts', 'missing_other_tag', 'invalid_other_tag'):
+                for account_id in entry.get(key, {}):
+                    assert account_id in shard_summary['account_names']
+
+        assert shard_summary['unowned'] == {}
+
+    assert found == mock_app_build_summary['per_user_summary']
+
+
+def test_lambda_dispatcher(mock_app_build_summary):
+    events = shard.build_shard_events(mock_app_build_summary, '2023-01-01', 'January 2023', 2)
+    dispatcher = shard.LambdaDispatcher('test-function')
+
+    with Stubber(clients.get_boto_client('lambda')) as _stub:
+        _stub.add_response('invoke', {'StatusCode': 202},
+                           {'FunctionName': 'test-function',
+                            'InvocationType': 'Event',
+                            'Payload': json.dumps(events[0], separators=(',', ':'))})
+
+        assert dispatcher.dispatch(events[0]) == {'status': 202}
+
+        _stub.assert_no_pending_responses()
+
+
+def test_build_shard_events_resplit(mock_app_build_summary):
+    per_user = mock_app_build_summary['per_user_summary']
+    sizes = [shard.payload_size(e) for e in
+             shard.build_shard_events(mock_app_build_summary, '2023-01-01', 'January 2023', 1)]
+
+    # too large for one shard, so the summary is split until every shard fits
+    events = shard.build_shard_events(mock_app_build_summary, '2023-01-01', 'January 2023', 1,
+                                      max_bytes=sizes[0] - 1)
+    assert len(events) > 1
+    assert all(e['shard']['count'] == len(events) for e in events)
+    assert all(shard.payload_size(e) < sizes[0] for e in events)
+
+    found = {}
+    for event in events:
+        found.update(checkpoint.decode_summary(event['summary'])['per_user_summary'])
+    assert sorted(found) == sorted(per_user)
+
+    # a single recipient that doesn't fit can't be split
+    with pytest.raises(ValueError):
+        shard.build_shard_events(mock_app_build_summary, '2023-01-01', 'January 2023', 1,
+                                 max_bytes=10)
+
+
+def test_lambda_dispatcher_oversized(mocker, mock_app_build_summary):
+    events = shard.build_shard_events(mock_app_build_summary, '2023-01-01', 'January 2023', 1)
+    mocker.patch.object(shard, 'max_payload_bytes', 10)
+
+    with Stubber(clients.get_boto_client('lambda')) as _stub:
+        with pytest.raises(ValueError):
+            shard.LambdaDispatcher('test-function').dispatch(events[0])
+
+
+def test_get_dispatcher(mocker):
+    context = mocker.MagicMock(invoked_function_arn='test-arn')
+    dispatcher = shard.get_dispatcher(context, app.lambda_handler)
+    assert isinstance(dispatcher, shard.LambdaDispatcher)
+    assert dispatcher.function_name == 'test-arn'
+
+    assert isinstance(shard.get_dispatcher(None, app.lambda_handler), shard.LocalDispatcher)
+
+
+def test_lambda_handler_sharded(mocker, mock_app_build_summary):
+    mocker.patch.dict(os.environ, {'SHARD_COUNT': '3', 'CHECKPOINT': 'file',
+                                   'STREAMING': 'False', 'BULK_SEND': 'False'})
+    mocker.patch('email_totals.synapse.get_team_sage_members',
+                 return_value=frozenset())
+    build = mocker.patch('email_totals.app.build_summary',
+                         return_value=mock_app_build_summary)
+    mocker.patch('email_totals.ses.build_unowned_email_body',
+                 return_value=('html', 'text'))
+    unowned = mocker.patch('email_totals.ses.send_unowned_email',
+                           return_value='id-admin')
+
+    sent = []
+
+    def _send_report_emails(per_user, account_names, period, on_result=None, rate_share=1.0):
+        assert rate_share == 1 / 3
+        results = []
+        for recipient in per_user:
+            sent.append(recipient)
+            result = {'recipient': recipient, 'status': 'sent', 'message_id': recipient}
+            on_result(result)
+            results.append(result)
+        return results
+
+    mocker.patch('email_totals.ses.send_report_emails',
+                 side_effect=_send_report_emails)
+
+    dispatched = mocker.spy(shard.LocalDispatcher, 'dispatch')
+
+    # shards are dispatched in-process without a lambda context
+    app.lambda_handler({}, None)
+    assert dispatched.call_count == 3
+    assert sorted(sent) == sorted(mock_app_build_summary['per_user_summary'])
+    unowned.assert_called_once()
+
+    # a retried coordinator doesn't dispatch the shards again
+    app.lambda_handler({}, None)
+    assert dispatched.call_count == 3
+    build.assert_called_once()
+
+    # a retried shard skips recipients it already sent
+    target_month, _ = app.report_periods(app.datetime.now())
+    events = shard.build_shard_events(mock_app_build_summary, target_month['Start'],
+                                      'Test Month', 3)
+    for event in events:
+        found = app.lambda_handler(event, None)
+        assert found['results'] == []
+
+    # dispatched shards are checkpointed apart from the coordinator's sends
+    run = checkpoint.open_run(target_month['Start'])
+    assert run.sent() == {checkpoint.unowned_recipient}
+    assert run.dispatches().sent() == {shard.shard_name(i, 3) for i in range(3)}
+
+
+def test_lambda_handler_streaming_sharded(mocker, caplog):
+    mocker.patch.dict(os.environ, {'SHARD_COUNT': '3', 'CHECKPOINT': 'file',
+                                   'STREAMING': 'True'})
+    mocker.patch('email_totals.synapse.get_team_sage_members',
+                 return_value=frozenset())
+    stream = mocker.patch('email_totals.app.stream_user_reports',
+                          return_value=({}, {}, []))
+    dispatched = mocker.spy(shard, 'dispatch_shards')
+
+    # streamed reports are sent from this invocation, without sharding
+    app.lambda_handler({}, None)
+    stream.assert_called_once()
+    dispatched.assert_not_called()
+    assert "Ignoring SHARD_COUNT=3 when STREAMING is enabled" in caplog.text
@@ -1,21 +1,59 @@
 import os
 
-from email_totals import synapse
+import pytest
+import synapseclient
 
+from email_totals import cache, clients, synapse
 
-def test_team_sage(mocker, mock_syn_team, mock_syn_members, mock_team_sage):
+
+@pytest.fixture()
+def mock_syn_client(mocker, tmp_path, mock_syn_team, mock_syn_members):
     env_vars = {
         'SYNAPSE_TEAM_ID': '123',
         'SYNAPSE_TEAM_DOMAIN': '@synapse.org',
     }
     mocker.patch.dict(os.environ, env_vars)
+    mocker.patch.object(synapse, 'roster_cache_root', str(tmp_path))
 
-    mock_syn_client = mocker.MagicMock(spec=synapse.syn_client)
+    mock_syn_client = mocker.MagicMock(spec=synapseclient.Synapse)
 
     mock_syn_client.getTeam.return_value = mock_syn_team
     mock_syn_client.getTeamMembers.return_value = mock_syn_members
 
-    synapse.syn_client = mock_syn_client
+    clients.set_client('synapse', mock_syn_client)
+    return mock_syn_client
+
 
+def test_team_sage(mock_syn_client, mock_team_sage):
     found_team_sage = synapse.get_team_sage_members()
     assert found_team_sage == mock_team_sage
+    assert isinstance(found_team_sage, frozenset)
+
+
+def test_team_sage_cached(mocker, mock_syn_client, mock_team_sage):
+    mocker.patch.dict(os.environ, {'SYNAPSE_CACHE_TTL': '3600'})
+
+    assert synapse.get_team_sage_members() == mock_team_sage
+
+    # a warm invocation uses the roster in memory
+    assert synapse.get_team_sage_members() == mock_team_sage
+
+    # a cold start reads the roster from /tmp
+    cache.memory.clear()
+    assert synapse.get_team_sage_members() == mock_team_sage
+
+    mock_syn_client.getTeamMembers.assert_called_once()
+
+    info = synapse.roster_info()
+    assert info['size'] == len(mock_team_sage)
+    assert info['age'] >= 0
+
+
+def test_team_sage_expired(mocker, mock_syn_client, mock_team_sage):
+    mocker.patch.dict(os.environ, {'SYNAPSE_CACHE_TTL': '0'})
+
+    assert synapse.get_team_sage_members() == mock_team_sage
+    assert synapse.get_team_sage_members() == mock_team_sage
+
+    assert mock_syn_client.getTeamMembers.call_count == 2
+    assert synapse.roster_info() is None
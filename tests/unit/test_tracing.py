@@ -0,0 +1,103 @@
+import json
+import os
+
+import pytest
+from botocore.awsrequest import AWSResponse
+from botocore.stub import Stubber
+
+from email_totals import clients, tracing
+
+quota = {'Max24HourSend': 100.0, 'MaxSendRate': 1.0, 'SentLast24Hours': 0.0}
+
+
+class _RawBody:
+    def __init__(self, body):
+        self.body = body
+
+    def stream(self, **kwargs):
+        yield self.body
+
+
+def _responses(*responses):
+    """
+    Build a before-send handler that returns the given (status, body) tuples
+    in order instead of sending each HTTP request
+    """
+
+    responses = list(responses)
+
+    def _before_send(request, **kwargs):
+        status, body = responses.pop(0)
+        return AWSResponse(request.url, status, {}, _RawBody(body))
+
+    return _before_send
+
+
+@pytest.fixture()
+def mock_credentials(mocker):
+    mocker.patch.dict(os.environ, {'AWS_ACCESS_KEY_ID': 'test',
+                                   'AWS_SECRET_ACCESS_KEY': 'test'})
+
+
+def test_fingerprint():
+    assert tracing.fingerprint({'a': 1, 'b': [2]}) == tracing.fingerprint({'b': [2], 'a': 1})
+    assert tracing.fingerprint({'a': 1}) != tracing.fingerprint({'a': 2})
+
+
+def test_disabled(mocker):
+    mocker.patch.dict(os.environ, {'TRACE': 'none'})
+    write = mocker.spy(tracing, 'write_span')
+
+    client = clients.get_boto_client('ses')
+    with Stubber(client) as _stub:
+        _stub.add_response('get_send_quota', quota)
+        client.get_send_quota()
+
+    write.assert_not_called()
+
+
+def test_trace_file(mocker, tmp_path, mock_credentials):
+    trace_file = tmp_path / 'trace.jsonl'
+    mocker.patch.dict(os.environ, {'TRACE': 'file', 'TRACE_FILE': str(trace_file)})
+    mocker.patch('time.sleep')
+
+    client = clients.get_boto_client('ses', {'mode': 'standard'})
+
+    # the first attempt is throttled and retried
+    throttled = b'<ErrorResponse><Error><Code>Throttling</Code></Error></ErrorResponse>'
+    body = (b'<GetSendQuotaResponse><GetSendQuotaResult>'
+            b'<MaxSendRate>1.0</MaxSendRate>'
+            b'</GetSendQuotaResult></GetSendQuotaResponse>')
+    client.meta.events.register('before-send', _responses((400, throttled), (200, body)))
+
+    client.get_send_quota()
+
+    spans = [json.loads(line) for line in trace_file.read_text().splitlines()]
+    assert len(spans) == 1
+
+    span = spans[0]
+    assert span['service'] == 'ses'
+    assert span['operation'] == 'GetSendQuota'
+    assert span['fingerprint'] == tracing.fingerprint({})
+    assert span['attempts'] == 2
+    assert span['status'] == 200
+    assert span['bytes'] == len(body)
+    assert 0 <= span['wait_ms'] <= span['latency_ms']
+
+
+def test_trace_log(mocker, caplog, mock_credentials):
+    mocker.patch.dict(os.environ, {'TRACE': 'log'})
+
+    client = clients.get_boto_client('ses')
+    error = b'<ErrorResponse><Error><Code>MessageRejected</Code></Error></ErrorResponse>'
+    client.meta.events.register('before-send', _responses((400, error)))
+
+    with pytest.raises(client.exceptions.MessageRejected):
+        client.get_send_quota()
+
+    lines = [r.getMessage() for r in caplog.records if r.name == tracing.__name__]
+    assert len(lines) == 1
+
+    span = json.loads(lines[0].split('Trace: ', 1)[1])
+    assert span['attempts'] == 1
+    assert span['status'] == 'MessageRejected'
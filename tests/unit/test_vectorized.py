@@ -0,0 +1,110 @@
+import os
+import random
+
+from email_totals import app, ce, vectorized
+
+target_period = {'Start': '2023-01-01', 'End': '2023-02-01'}
+compare_period = {'Start': '2022-12-01', 'End': '2023-01-01'}
+
+
+def _pages(target_totals, compare_totals):
+    results = []
+    for period, totals in ((compare_period, compare_totals), (target_period, target_totals)):
+        groups = []
+        for user, account_id, amount in totals:
+            groups.append({
+                'Keys': [f"Owner Email${user}", account_id],
+                'Metrics': {ce.cost_metric: {'Amount': str(amount)}},
+            })
+        results.append({'TimePeriod': period, 'Groups': groups})
+    return [{'ResultsByTime': results}, ]
+
+
+def _resource_totals(mocker, pages, minimum_total, vectorize):
+    mocker.patch.dict(os.environ, {'VECTORIZE': str(vectorize)})
+    mocker.patch('email_totals.ce.get_ce_email_costs', return_value=pages)
+    return app.get_resource_totals(target_period, compare_period, minimum_total)
+
+
+def test_vectorized_resource_totals(mocker,
+                                    mock_ce_period,
+                                    mock_ce_compare_period,
+                                    mock_ce_email_span_data,
+                                    mock_app_resource_dict):
+    mocker.patch.dict(os.environ, {'VECTORIZE': 'True'})
+    mocker.patch('email_totals.ce.get_ce_email_costs',
+                 return_value=[mock_ce_email_span_data, ])
+
+    found = app.get_resource_totals(mock_ce_period, mock_ce_compare_period, 1.0)
+    assert found == mock_app_resource_dict
+
+
+def test_vectorized_matches_python(mocker):
+    rng = random.Random(0)
+
+    def _totals():
+        totals = []
+        for _ in range(500):
+            user = f"User{rng.randint(0, 40)}@Example.com"
+            # mixed case duplicates are merged
+            if rng.random() < 0.5:
+                user = user.lower()
+            amount = rng.choice([0, 0.5, rng.uniform(-5, 500)])
+            totals.append((user, f"{rng.randint(0, 30):012}", amount))
+        return totals
+
+    pages = _pages(_totals(), _totals())
+
+    for minimum_total in (-10.0, 0.0, 1.0):
+        expected = _resource_totals(mocker, pages, minimum_total, False)
+        found = _resource_totals(mocker, pages, minimum_total, True)
+
+        # same totals, changes, and order
+        assert found == expected
+        assert list(found) == list(expected)
+        for email in expected:
+            assert list(found[email]['resources']) == list(expected[email]['resources'])
+
+
+def test_zero_compare_total(mocker):
+    pages = _pages([('user@example.com', '111122223333', 5.0)],
+                   [('user@example.com', '111122223333', 0.0)])
+
+    expected = {'user@example.com': {'resources': {'111122223333': {'total': 5.0}}}}
+    for vectorize in (False, True):
+        assert _resource_totals(mocker, pages, 0.0, vectorize) == expected
+
+
+def test_build_account_changes():
+    target = {'a': 10.0, 'b': 5.0, 'c': 0.5, 'd': 2.0}
+    compare = {'a': 5.0, 'b': 0.0, 'c': 1.0}
+
+    found = vectorized.build_account_changes(target, compare, 1.0)
+    assert found == {'a': 1.0, 'b': None, 'd': None}
+
+
+def test_vectorize_unavailable(mocker):
+    mocker.patch.dict(os.environ, {'VECTORIZE': 'True'})
+    mocker.patch.dict('sys.modules', {'email_totals.vectorized': None})
+
+    assert app.load_vectorized() is None
+
+
+def test_vectorized_account_totals(mocker,
+                                   mock_app_account_dict,
+                                   mock_app_account_names,
+                                   mock_ce_account_span_data,
+                                   mock_ce_period,
+                                   mock_ce_compare_period,
+                                   mock_org_account_owners):
+    mocker.patch.dict(os.environ, {'VECTORIZE': 'True'})
+    mocker.patch('email_totals.ce.get_ce_account_costs',
+                 return_value=[mock_ce_account_span_data, ])
+    mocker.patch('email_totals.org.get_account_owners',
+                 return_value=mock_org_account_owners)
+
+    found_dict, found_names = app.get_account_totals(mock_ce_period,
+                                                     mock_ce_compare_period,
+                                                     1.0)
+    assert found_names == mock_app_account_names
+    assert found_dict == mock_app_account_dict
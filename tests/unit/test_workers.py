@@ -0,0 +1,143 @@
+import threading
+import time
+
+import pytest
+from botocore.exceptions import ClientError
+
+from email_totals import workers
+
+
+def _client_error(code):
+    return ClientError({'Error': {'Code': code, 'Message': 'test'}}, 'TestOperation')
+
+
+def test_map_bounded_order():
+    items = list(range(20))
+    found = workers.map_bounded(lambda x: x * 2, items, 4)
+    assert found == [x * 2 for x in items]
+
+
+@pytest.mark.parametrize("max_workers", [1, 4])
+def test_map_bounded_throttled(mocker, max_workers):
+    mocker.patch('time.sleep')
+
+    calls = {}
+
+    def _flaky(item):
+        calls[item] = calls.get(item, 0) + 1
+        if calls[item] < 3:
+            raise _client_error('ThrottlingException')
+        return item
+
+    found = workers.map_bounded(_flaky, ['a', 'b'], max_workers)
+    assert found == ['a', 'b']
+    assert calls == {'a': 3, 'b': 3}
+
+
+def test_call_with_backoff_exhausted(mocker):
+    mocker.patch('time.sleep')
+
+    def _throttled():
+        raise _client_error('TooManyRequestsException')
+
+    with pytest.raises(ClientError):
+        workers.call_with_backoff(_throttled, attempts=2)
+
+
+def test_call_with_backoff_log(mocker, caplog):
+    mocker.patch('time.sleep')
+    calls = []
+
+    def _send(body):
+        calls.append(body)
+        if len(calls) == 1:
+            raise _client_error('Throttling')
+        return 'id'
+
+    assert workers.call_with_backoff(_send, '<html>report</html>', label='send_email') == 'id'
+
+    # only the label is logged, never the arguments
+    messages = [r.getMessage() for r in caplog.records]
+    assert any('Throttled calling send_email' in m for m in messages)
+    assert not any('report' in m for m in messages)
+
+
+def test_call_with_backoff_not_throttled(mocker):
+    sleep = mocker.patch('time.sleep')
+
+    def _denied():
+        raise _client_error('AccessDeniedException')
+
+    with pytest.raises(ClientError):
+        workers.call_with_backoff(_denied)
+
+    sleep.assert_not_called()
+
+
+def test_token_bucket_paces_calls(mocker):
+    clock = {'now': 0.0}
+
+    def _sleep(seconds):
+        clock['now'] += seconds
+
+    mocker.patch('time.monotonic', side_effect=lambda: clock['now'])
+    mocker.patch('time.sleep', side_effect=_sleep)
+
+    bucket = workers.TokenBucket(2)
+
+    # the bucket starts full, then refills at two tokens per second
+    for _ in range(6):
+        bucket.acquire()
+    assert clock['now'] == pytest.approx(2.0)
+
+    # requests larger than the bucket only wait for a full bucket
+    bucket.acquire(5)
+    assert clock['now'] == pytest.approx(3.0)
+
+    # unless they are taken a bucketful at a time
+    bucket.acquire_many(5)
+    assert clock['now'] == pytest.approx(5.5)
+
+
+def test_pipeline_bounded_queue(mocker):
+    lock = threading.Lock()
+    state = {'pending': 0, 'peak': 0}
+
+    def _produce(batch):
+        outputs = []
+        for item in batch:
+            with lock:
+                state['pending'] += 1
+                state['peak'] = max(state['peak'], state['pending'])
+            outputs.append(item)
+        return outputs
+
+    def _consume(item):
+        time.sleep(0.001)
+        with lock:
+            state['pending'] -= 1
+        return item * 2
+
+    batches = [[i * 5 + j for j in range(5)] for i in range(10)]
+    found = workers.pipeline(_produce, batches, _consume, 2, 2, 3)
+
+    assert sorted(found) == [i * 2 for i in range(50)]
+
+    # producers build at most one batch ahead of the queue and consumers
+    peak = 2 * 5 + 3 + 2
+    assert state['peak'] <= peak
+
+
+def test_pipeline_error():
+    def _produce(item):
+        if item == 'bad':
+            raise ValueError(item)
+        return [item]
+
+    consumed = []
+
+    with pytest.raises(ValueError):
+        workers.pipeline(_produce, ['a', 'bad', 'b'], consumed.append, 2, 1, 1)
+
+    # items that don't depend on the failure are still consumed
+    assert sorted(consumed) == ['a', 'b']